@@ -10,13 +10,19 @@
 #
 # tcpdump -s 128 -Q out -nn -tt -vv -p -l 'tcp and (port 5432 or port 6543)' | perl pg_egress_collect.pl -o /tmp/output.txt
 #
+# With --pcap it reads tcpdump's binary pcap output instead of its text, which
+# is much cheaper at high packet rates, and also accounts bytes per local port
+# and per remote address into a JSON file next to the total:
+#
+# tcpdump -s 128 -Q out -nn -p -U -w - 'tcp and (port 5432 or port 6543)' | perl pg_egress_collect.pl --pcap
+#
 
 use POSIX;
 use List::Util qw(sum);
 use Getopt::Long 'HelpMessage';
-use IO::Async::Loop;
-use IO::Async::Stream;
-use IO::Async::Timer::Periodic;
+use JSON::PP;
+use Socket qw(AF_INET6 inet_ntoa inet_ntop);
+use Time::HiRes;
 
 use strict;
 use warnings;
@@ -24,6 +30,17 @@ use warnings;
 # total captured packets lenth in a time frame
 my $captured_len = 0;
 
+# per-interval accounting in pcap mode; the remotes table holds at most
+# $max_remotes addresses, the rest are added up in $remote_overflow
+my %ports_watched = (5432 => 1, 6543 => 1);
+my $max_remotes = 1024;
+my %by_port;
+my %by_remote;
+my %remote_overflow = (bytes => 0, packets => 0);
+my $captured_packets = 0;
+my $undecoded_packets = 0;
+my $interval_start = time;
+
 # extract tcp packet length captured by tcpdump
 #
 # Sample IPv4 input lines:
@@ -47,7 +64,144 @@ sub extract_packet_length {
         # extract tcp packet length and add it up
         my $len = $1;
         $captured_len += $len;
+        $captured_packets++;
+    }
+}
+
+# pcap stream state: the unpack template for the file's byte order and the link type
+my $pcap_u32;
+my $pcap_linktype;
+
+# parse the 24 byte pcap file header
+sub parse_pcap_header {
+    my ($header) = @_;
+
+    my $magic = unpack("V", $header);
+    if ($magic == 0xa1b2c3d4 || $magic == 0xa1b23c4d) {
+        $pcap_u32 = "V";
+    } elsif (unpack("N", $header) == 0xa1b2c3d4 || unpack("N", $header) == 0xa1b23c4d) {
+        $pcap_u32 = "N";
+    } else {
+        die sprintf("not a pcap stream (magic 0x%08x)\n", $magic);
+    }
+    $pcap_linktype = unpack("x20 $pcap_u32", $header) & 0xffff;
+}
+
+# account every complete pcap record in the buffer and remove it from the buffer
+sub extract_pcap_records {
+    my ($buffref) = @_;
+
+    if (!defined $pcap_u32) {
+        return if length($$buffref) < 24;
+        parse_pcap_header(substr($$buffref, 0, 24, ""));
+    }
+
+    my $offset = 0;
+    my $available = length($$buffref);
+    while ($available - $offset >= 16) {
+        my $captured = unpack("x8 $pcap_u32", substr($$buffref, $offset, 12));
+        last if $available - $offset - 16 < $captured;
+        account_packet(substr($$buffref, $offset + 16, $captured));
+        $offset += 16 + $captured;
+    }
+    substr($$buffref, 0, $offset, "");
+}
+
+# offset of the IP header and its ethertype for the capture's link type
+sub link_header {
+    my ($packet) = @_;
+
+    if ($pcap_linktype == 1) {
+        # Ethernet, possibly with 802.1Q/802.1ad tags
+        my $offset = 12;
+        my $ethertype = unpack("n", substr($packet, $offset, 2));
+        while ($ethertype == 0x8100 || $ethertype == 0x88a8) {
+            $offset += 4;
+            $ethertype = unpack("n", substr($packet, $offset, 2));
+        }
+        return ($offset + 2, $ethertype);
+    } elsif ($pcap_linktype == 113) {
+        # Linux cooked capture (tcpdump -i any)
+        return (16, unpack("n", substr($packet, 14, 2)));
+    } elsif ($pcap_linktype == 276) {
+        # Linux cooked capture v2
+        return (20, unpack("n", substr($packet, 0, 2)));
+    } elsif ($pcap_linktype == 101 || $pcap_linktype == 12) {
+        # raw IP
+        my $version = ord(substr($packet, 0, 1)) >> 4;
+        return (0, $version == 6 ? 0x86dd : 0x0800);
+    }
+    return;
+}
+
+# add one captured packet's TCP payload length to the counters
+sub account_packet {
+    my ($packet) = @_;
+
+    my ($ip, $ethertype) = link_header($packet);
+    my ($tcp, $payload, $src_addr, $dst_addr);
+    if (defined $ethertype && $ethertype == 0x0800 && length($packet) >= $ip + 20) {
+        my ($version_ihl, $total_len, $protocol);
+        ($version_ihl, $total_len, $protocol, $src_addr, $dst_addr) = unpack("C x n x5 C x2 a4 a4", substr($packet, $ip, 20));
+        return $undecoded_packets++ if $protocol != 6;
+        $tcp = $ip + ($version_ihl & 0x0f) * 4;
+        $payload = $total_len - ($version_ihl & 0x0f) * 4;
+    } elsif (defined $ethertype && $ethertype == 0x86dd && length($packet) >= $ip + 40) {
+        my $next_header;
+        ($payload, $next_header, $src_addr, $dst_addr) = unpack("x4 n C x a16 a16", substr($packet, $ip, 40));
+        # TCP directly after the fixed header; extension headers are rare enough to ignore
+        return $undecoded_packets++ if $next_header != 6;
+        $tcp = $ip + 40;
+    } else {
+        return $undecoded_packets++;
+    }
+    return $undecoded_packets++ if length($packet) < $tcp + 13;
+
+    my ($src_port, $dst_port, $data_offset) = unpack("n n x8 C", substr($packet, $tcp, 13));
+    my $len = $payload - ($data_offset >> 4) * 4;
+    $len = 0 if $len < 0;
+
+    # the local side is the watched port; with -Q out that is the source
+    my ($port, $remote) = $ports_watched{$src_port} || !$ports_watched{$dst_port}
+        ? ($src_port, $dst_addr)
+        : ($dst_port, $src_addr);
+
+    $captured_len += $len;
+    $captured_packets++;
+
+    my $port_counter = $by_port{$ports_watched{$port} ? $port : "other"} ||= {bytes => 0, packets => 0};
+    $port_counter->{bytes} += $len;
+    $port_counter->{packets}++;
+
+    my $remote_counter = $by_remote{$remote};
+    if (!$remote_counter) {
+        $remote_counter = keys(%by_remote) < $max_remotes
+            ? ($by_remote{$remote} = {bytes => 0, packets => 0})
+            : \%remote_overflow;
+    }
+    $remote_counter->{bytes} += $len;
+    $remote_counter->{packets}++;
+}
+
+# write content to a temporary file and rename it over path, so readers never see a partial file
+sub write_atomically {
+    my ($path, $content) = @_;
+
+    my $tmp = "$path.tmp.$$";
+    open(my $fh, ">", $tmp) or die "Could not open file '$tmp' $!";
+    print $fh $content;
+    close($fh) or die "Could not write file '$tmp' $!";
+    return $tmp;
+}
+
+# keep the previous $keep versions of path as path.1 .. path.$keep
+sub rotate {
+    my ($path, $keep) = @_;
+
+    for (my $i = $keep - 1; $i >= 1; $i--) {
+        rename("$path.$i", "$path." . ($i + 1)) if -e "$path.$i";
     }
+    rename($path, "$path.1") if $keep > 0 && -e $path;
 }
 
 # write total length to file
@@ -57,9 +211,83 @@ sub write_file {
     my $now = strftime "%F %T", localtime time;
     print "[$now] write captured len $captured_len to $output\n";
 
-    open(my $fh, "+>", $output) or die "Could not open file '$output' $!";
-    print $fh "$captured_len";
-    close($fh) or die "Could not write file '$output' $!";
+    my $tmp = write_atomically($output, "$captured_len");
+    rename($tmp, $output) or die "Could not rename '$tmp' to '$output' $!";
+}
+
+# write the per-port and per-remote counters as JSON, rotating the previous files
+sub write_json {
+    my ($json_output, $keep) = @_;
+
+    my %remotes;
+    while (my ($addr, $counter) = each %by_remote) {
+        $remotes{length($addr) == 4 ? inet_ntoa($addr) : inet_ntop(AF_INET6, $addr)} = $counter;
+    }
+    my $now = time;
+    my $document = {
+        interval_start => $interval_start,
+        interval_end => $now,
+        bytes => $captured_len,
+        packets => $captured_packets,
+        undecoded_packets => $undecoded_packets,
+        ports => \%by_port,
+        remotes => \%remotes,
+        remotes_overflow => \%remote_overflow,
+    };
+
+    my $tmp = write_atomically($json_output, JSON::PP->new->canonical->encode($document) . "\n");
+    rotate($json_output, $keep);
+    rename($tmp, $json_output) or die "Could not rename '$tmp' to '$json_output' $!";
+}
+
+# reset all counters for the next interval
+sub reset_counters {
+    $captured_len = 0;
+    $captured_packets = 0;
+    $undecoded_packets = 0;
+    %by_port = ();
+    %by_remote = ();
+    %remote_overflow = (bytes => 0, packets => 0);
+    $interval_start = time;
+}
+
+# process tcpdump text lines or pcap records from the buffer
+sub extract {
+    my ($buffref, $pcap) = @_;
+
+    if ($pcap) {
+        extract_pcap_records($buffref);
+        return;
+    }
+    while($$buffref =~ s/^(.*\n)//) {
+        my $line = $1;
+        extract_packet_length($line);
+    }
+}
+
+# read a recorded capture to the end, write the outputs once and report the throughput
+sub replay {
+    my ($input, $pcap, $output, $json_output, $keep) = @_;
+
+    my $fh;
+    if ($input eq "-") {
+        $fh = \*STDIN;
+    } else {
+        open($fh, "<", $input) or die "Could not open file '$input' $!";
+    }
+    binmode($fh);
+    my $buffer = "";
+    my $start = Time::HiRes::time();
+    while (read($fh, $buffer, 65536, length($buffer))) {
+        extract(\$buffer, $pcap);
+    }
+    close($fh) if $input ne "-";
+    my $elapsed = Time::HiRes::time() - $start;
+
+    printf STDERR "replayed %d packets, %d bytes of egress in %.3fs (%.0f packets/s)\n",
+        $captured_packets, $captured_len, $elapsed, $elapsed > 0 ? $captured_packets / $elapsed : 0;
+    write_file($output);
+    write_json($json_output, $keep) if $pcap;
 }
 
 # main
@@ -68,20 +296,35 @@ sub main {
     GetOptions(
         "interval:i"    => \(my $interval = 60),
         "output:s"      => \(my $output = "/tmp/pg_egress_collect.txt"),
+        "pcap"          => \(my $pcap = 0),
+        "json-output:s" => \(my $json_output = "/tmp/pg_egress_collect.json"),
+        "keep:i"        => \(my $keep = 5),
+        "max-remotes:i" => \$max_remotes,
+        "port:i@"       => \(my $ports = []),
+        "replay:s"      => \(my $replay),
         "help"          => sub { HelpMessage(0) },
     ) or HelpMessage(1);
+    %ports_watched = map { $_ => 1 } @$ports if @$ports;
+
+    if (defined $replay) {
+        replay($replay, $pcap, $output, $json_output, $keep);
+        return;
+    }
+
+    # loaded here so that --replay works without IO::Async installed
+    require IO::Async::Loop;
+    require IO::Async::Stream;
+    require IO::Async::Timer::Periodic;
 
     my $loop = IO::Async::Loop->new;
 
     # tcpdump extractor
+    binmode(STDIN) if $pcap;
     my $extractor = IO::Async::Stream->new_for_stdin(
         on_read => sub {
             my ($self, $buffref, $eof) = @_;
 
-            while($$buffref =~ s/^(.*\n)//) {
-                my $line = $1;
-                extract_packet_length($line);
-            }
+            extract($buffref, $pcap);
 
             return 0;
         },
@@ -92,9 +335,10 @@ sub main {
         interval => $interval,
         on_tick => sub {
             write_file($output);
+            write_json($json_output, $keep) if $pcap;
 
             # reset total captured length
-            $captured_len = 0;
+            reset_counters();
         },
     );
     $writer->start;
@@ -116,7 +360,7 @@ pg_egress_collect.pl - collect egress from tcpdump output, extract TCP packet le
 
 =head1 SYNOPSIS
 
-pg_egress_collect.pl [-i interval] [-o output]
+pg_egress_collect.pl [-i interval] [-o output] [--pcap [--json-output path] [--keep n] [--max-remotes n] [--port port ...]] [--replay file]
 
 Options:
 
@@ -126,6 +370,27 @@ Options:
     -o, --output output
         output file path, default is /tmp/pg_egress_collect.txt
 
+    --pcap
+        read pcap records (tcpdump -w -) instead of tcpdump -vv text, and
+        also write per-port and per-remote counters to the JSON output
+
+    --json-output path
+        JSON output file path in pcap mode, default is /tmp/pg_egress_collect.json
+
+    --keep n
+        number of previous JSON files to keep as path.1 .. path.n, default is 5
+
+    --max-remotes n
+        number of remote addresses counted individually per interval, the
+        rest are added up in remotes_overflow, default is 1024
+
+    --port port
+        local port to account for, can be repeated, default is 5432 and 6543
+
+    --replay file
+        read a recorded capture from file (- for STDIN), write the outputs
+        once and print the throughput, then exit
+
     -h, --help
         print this help message
 
@@ -1,160 +1,207 @@
+import argparse
+import ctypes
+import ctypes.util
+import os
+import select
+import signal
+import struct
+import stat
 import subprocess
 import json
 import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
 
-# Expected groups for each user
-expected_results = {
-    "postgres": [
-        {"groupname": "postgres", "username": "postgres"},
-        {"groupname": "ssl-cert", "username": "postgres"}
-    ],
-    "ubuntu": [
-        {"groupname":"ubuntu","username":"ubuntu"},
-        {"groupname":"adm","username":"ubuntu"},
-        {"groupname":"dialout","username":"ubuntu"},
-        {"groupname":"cdrom","username":"ubuntu"},
-        {"groupname":"floppy","username":"ubuntu"},
-        {"groupname":"sudo","username":"ubuntu"},
-        {"groupname":"audio","username":"ubuntu"},
-        {"groupname":"dip","username":"ubuntu"},
-        {"groupname":"video","username":"ubuntu"},
-        {"groupname":"plugdev","username":"ubuntu"},
-        {"groupname":"lxd","username":"ubuntu"},
-        {"groupname":"netdev","username":"ubuntu"}
-    ],
-    "root": [
-        {"groupname":"root","username":"root"}
-    ],
-    "daemon": [
-        {"groupname":"daemon","username":"daemon"}
-    ],
-    "bin": [
-        {"groupname":"bin","username":"bin"}
-    ],
-    "sys": [
-        {"groupname":"sys","username":"sys"}
-    ],
-    "sync": [
-        {"groupname":"nogroup","username":"sync"}
-    ],
-    "games": [
-        {"groupname":"games","username":"games"}
-    ],
-    "man": [
-        {"groupname":"man","username":"man"}
-    ],
-    "lp": [
-        {"groupname":"lp","username":"lp"}
-    ],
-    "mail": [
-        {"groupname":"mail","username":"mail"}
-    ],
-    "news": [
-        {"groupname":"news","username":"news"}
-    ],
-    "uucp": [
-        {"groupname":"uucp","username":"uucp"}
-    ],
-    "proxy": [
-        {"groupname":"proxy","username":"proxy"}
-    ],
-    "www-data": [
-        {"groupname":"www-data","username":"www-data"}
-    ],
-    "backup": [
-        {"groupname":"backup","username":"backup"}
-    ],
-    "list": [
-        {"groupname":"list","username":"list"}
-    ],
-    "irc": [
-        {"groupname":"irc","username":"irc"}
-    ],
-    "gnats": [
-        {"groupname":"gnats","username":"gnats"}
-    ],
-    "nobody": [
-        {"groupname":"nogroup","username":"nobody"}
-    ],
-    "systemd-network": [
-        {"groupname":"systemd-network","username":"systemd-network"}
-    ],
-    "systemd-resolve": [
-        {"groupname":"systemd-resolve","username":"systemd-resolve"}
-    ],
-    "systemd-timesync": [
-        {"groupname":"systemd-timesync","username":"systemd-timesync"}
-    ],
-    "messagebus": [
-        {"groupname":"messagebus","username":"messagebus"}
-    ],
-    "ec2-instance-connect": [
-        {"groupname":"nogroup","username":"ec2-instance-connect"}
-    ],
-    "sshd": [
-        {"groupname":"nogroup","username":"sshd"}
-    ],
-    "wal-g": [
-        {"groupname":"wal-g","username":"wal-g"},
-        {"groupname":"postgres","username":"wal-g"}
-    ],
-    "pgbouncer": [
-        {"groupname":"pgbouncer","username":"pgbouncer"},
-        {"groupname":"ssl-cert","username":"pgbouncer"},
-        {"groupname":"postgres","username":"pgbouncer"}
-    ],
-    "gotrue": [
-        {"groupname":"gotrue","username":"gotrue"}
-    ],
-    "envoy": [
-        {"groupname":"envoy","username":"envoy"}
-    ],
-    "kong": [
-        {"groupname":"kong","username":"kong"}
-    ],
-    "nginx": [
-        {"groupname":"nginx","username":"nginx"}
-    ],
-    "vector": [
-        {"groupname":"vector","username":"vector"},
-        {"groupname":"adm","username":"vector"},
-        {"groupname":"systemd-journal","username":"vector"},
-        {"groupname":"postgres","username":"vector"}
-    ],
-    "adminapi": [
-        {"groupname":"adminapi","username":"adminapi"},
-        {"groupname":"root","username":"adminapi"},
-        {"groupname":"systemd-journal","username":"adminapi"},
-        {"groupname":"admin","username":"adminapi"},
-        {"groupname":"postgres","username":"adminapi"},
-        {"groupname":"pgbouncer","username":"adminapi"},
-        {"groupname":"wal-g","username":"adminapi"},
-        {"groupname":"postgrest","username":"adminapi"},
-        {"groupname":"envoy","username":"adminapi"},
-        {"groupname":"kong","username":"adminapi"},
-        {"groupname":"vector","username":"adminapi"}
-    ],
-    "postgrest": [
-        {"groupname":"postgrest","username":"postgrest"}
-    ],
-    "tcpdump": [
-        {"groupname":"tcpdump","username":"tcpdump"}
-    ],
-    "systemd-coredump": [
-        {"groupname":"systemd-coredump","username":"systemd-coredump"}
-    ]
-}
-# This program depends on osquery being installed on the system
-# Function to run osquery
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'permission_baseline.json')
+
+# Memberships are read natively from the account files by default;
+# osquery is only needed for the osquery backend and --cross-check.
 def normalize_results(results):
     """Sort results by groupname to ensure consistent comparison."""
     return sorted(results, key=lambda x: x['groupname'])
 
-def run_osquery(query):
-    process = subprocess.Popen(['osqueryi', '--json', query], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+def quote_literal(value):
+    """Render a Python value as an SQLite literal."""
+    if value is None:
+        return 'NULL'
+    if isinstance(value, bool):
+        return '1' if value else '0'
+    if isinstance(value, (int, float)):
+        return repr(value)
+    literal = "'" + str(value).replace("'", "''") + "'"
+    # Line breaks are spliced in with char(), so a statement always fits on one line
+    return literal.replace('\r', "' || char(13) || '").replace('\n', "' || char(10) || '")
+
+def bind_parameters(query, params=()):
+    """
+    Substitute `?` placeholders outside string literals with quoted values.
+
+    osqueryi has no bind API, so this is the only place values enter SQL text;
+    every value goes through quote_literal.
+    """
+    params = list(params)
+    out = []
+    quote = None
+    for ch in query:
+        if quote:
+            if ch == quote:
+                quote = None
+        elif ch in ("'", '"'):
+            quote = ch
+        elif ch == '?':
+            if not params:
+                raise ValueError("Not enough parameters for query")
+            out.append(quote_literal(params.pop(0)))
+            continue
+        out.append(ch)
+    if params:
+        raise ValueError("Too many parameters for query")
+    return ''.join(out)
+
+def run_osquery(query, params=()):
+    process = subprocess.Popen(['osqueryi', '--json', bind_parameters(query, params)],
+                               stdout=subprocess.PIPE, stderr=subprocess.PIPE)
     output, error = process.communicate()
     return output.decode('utf-8')
 
+class OsquerySession:
+    """
+    One long-lived osqueryi process that many queries are pipelined through.
+
+    Each query is followed by a sentinel SELECT; the response to a query is
+    everything printed before the sentinel's row, so responses are framed
+    without relying on osqueryi's output layout. stdout is a pty so osqueryi
+    line-buffers its output instead of holding it until exit. stderr is framed
+    the same way, by a query against a table named after the marker that
+    always fails, so an error is attributed to the query that caused it.
+    """
+
+    FRAME_COLUMN = '__frame__'
+
+    def __init__(self, binary='osqueryi', timeout=30.0):
+        self.binary = binary
+        self.timeout = timeout
+        self.process = None
+        self.restarts = 0
+        self._stdout_fd = None
+        self._buffer = b''
+        self._stderr_buffer = b''
+        self._frame = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def start(self):
+        import pty
+        import tty
+        master, slave = pty.openpty()
+        tty.setraw(slave)
+        self.process = subprocess.Popen([self.binary, '--json'], stdin=subprocess.PIPE, stdout=slave,
+                                        stderr=subprocess.PIPE, close_fds=True)
+        os.close(slave)
+        self._stdout_fd = master
+        self._buffer = b''
+        self._stderr_buffer = b''
+        os.set_blocking(self.process.stderr.fileno(), False)
+
+    def close(self):
+        if self.process is not None:
+            try:
+                self.process.stdin.close()
+            except OSError:
+                pass
+            try:
+                self.process.wait(timeout=5)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+                self.process.wait()
+            self.process.stderr.close()
+            self.process = None
+        if self._stdout_fd is not None:
+            os.close(self._stdout_fd)
+            self._stdout_fd = None
+
+    def query(self, query, params=()):
+        """Run one query and return its rows, restarting osqueryi once if it died or timed out."""
+        sql = bind_parameters(query, params)
+        for attempt in range(2):
+            if self.process is None or self.process.poll() is not None:
+                if self.process is not None:
+                    self.close()
+                    self.restarts += 1
+                self.start()
+            try:
+                return self._execute(sql)
+            except (OSError, TimeoutError, EOFError):
+                self.close()
+                self.restarts += 1
+                if attempt == 1:
+                    raise
+
+    def _read_into(self, fd, deadline):
+        """Wait for and return one chunk from fd; raise on timeout or EOF."""
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            raise TimeoutError(f"osqueryi did not answer within {self.timeout}s")
+        ready, _, _ = select.select([fd], [], [], remaining)
+        if not ready:
+            return b''
+        try:
+            chunk = os.read(fd, 65536)
+        except OSError:
+            chunk = b''
+        if not chunk:
+            raise EOFError("osqueryi exited")
+        return chunk
+
+    def _execute(self, sql):
+        self._frame += 1
+        marker = f"frame-{os.getpid()}-{self._frame}"
+        stderr_marker = f"stderr_frame_{os.getpid()}_{self._frame}"
+        # osqueryi reads statements line by line, so send each one on a single line;
+        # only the line breaks are replaced, whitespace inside literals is kept
+        payload = sql.replace('\r', ' ').replace('\n', ' ').strip().rstrip(';') + ';\n'
+        payload += f"SELECT * FROM {stderr_marker};\n"
+        payload += f"SELECT '{marker}' AS {self.FRAME_COLUMN};\n"
+        self.process.stdin.write(payload.encode('utf-8'))
+        self.process.stdin.flush()
+
+        needle = marker.encode('utf-8')
+        deadline = time.monotonic() + self.timeout
+        while True:
+            position = self._buffer.find(needle)
+            if position != -1:
+                end = self._buffer.find(b']', position)
+                if end != -1:
+                    break
+            self._buffer += self._read_into(self._stdout_fd, deadline)
+
+        start = self._buffer.rfind(b'[', 0, position)
+        output = self._buffer[:start].decode('utf-8').replace('\r', '').strip()
+        self._buffer = self._buffer[end + 1:]
+
+        # The failing marker query ran before the stdout sentinel, so its error
+        # is already in the pipe; everything before its line belongs to this query
+        stderr_needle = stderr_marker.encode('utf-8')
+        stderr_fd = self.process.stderr.fileno()
+        while True:
+            position = self._stderr_buffer.find(stderr_needle)
+            if position != -1:
+                end = self._stderr_buffer.find(b'\n', position)
+                if end != -1:
+                    break
+            self._stderr_buffer += self._read_into(stderr_fd, deadline)
+        line_start = self._stderr_buffer.rfind(b'\n', 0, position) + 1
+        error = self._stderr_buffer[:line_start].decode('utf-8', errors='replace').strip()
+        self._stderr_buffer = self._stderr_buffer[end + 1:]
+        if error:
+            raise RuntimeError(f"osquery error: {error}")
+        return json.loads(output) if output else []
+
+
 def parse_json(json_str):
     try:
         return json.loads(json_str)
@@ -162,60 +209,587 @@ def parse_json(json_str):
         print("Error decoding JSON:", e)
         sys.exit(1)
 
-def compare_results(username, query_result):
-    expected_result = expected_results.get(username)
-    if expected_result is None:
-        print(f"No expected result defined for user '{username}'")
-        sys.exit(1)
-
-    # Normalize both results before comparison
-    normalized_expected = normalize_results(expected_result)
-    normalized_actual = normalize_results(query_result)
-
-    if normalized_actual == normalized_expected:
-        print(f"The query result for user '{username}' matches the expected result.")
-    else:
-        print(f"The query result for user '{username}' does not match the expected result.")
-        print("Expected:", expected_result)
-        print("Got:", query_result)
-        sys.exit(1)
-
-def check_nixbld_users():
-    query = """
+MEMBERSHIP_QUERY = """
     SELECT u.username, g.groupname 
     FROM users u 
     JOIN user_groups ug ON u.uid = ug.uid 
     JOIN groups g ON ug.gid = g.gid 
-    WHERE u.username LIKE 'nixbld%';
-    """
-    query_result = run_osquery(query)
-    parsed_result = parse_json(query_result)
-    
-    for user in parsed_result:
-        if user['groupname'] != 'nixbld':
-            print(f"User '{user['username']}' is in group '{user['groupname']}' instead of 'nixbld'.")
-            sys.exit(1)
-    
-    print("All nixbld users are in the 'nixbld' group.")
-
-# Keep your existing usernames list as is
-# Define usernames for which you want to compare results
-usernames = ["postgres", "ubuntu", "root", "daemon", "bin", "sys", "sync", "games","man","lp","mail","news","uucp","proxy","www-data","backup","list","irc","gnats","nobody","systemd-network","systemd-resolve","systemd-timesync","messagebus","ec2-instance-connect","sshd","wal-g","pgbouncer","gotrue","envoy","kong","nginx","vector","adminapi","postgrest","tcpdump","systemd-coredump"]
-
-# Iterate over usernames, run the query, and compare results
-# Modify the query to include ordering
-for username in usernames:
-    query = f"""
+    ORDER BY u.username, g.groupname;
+    """
+
+USER_MEMBERSHIP_QUERY = """
     SELECT u.username, g.groupname 
     FROM users u 
     JOIN user_groups ug ON u.uid = ug.uid 
     JOIN groups g ON ug.gid = g.gid 
-    WHERE u.username = '{username}' 
+    WHERE u.username = ? 
     ORDER BY g.groupname;
     """
-    query_result = run_osquery(query)
-    parsed_result = parse_json(query_result)
-    compare_results(username, parsed_result)
 
-# Check if all nixbld users are in the nixbld group
-check_nixbld_users()
+def fetch_osquery_group_memberships(session=None):
+    """Fetch every user->group membership with a single osquery query, grouped by username."""
+    rows = session.query(MEMBERSHIP_QUERY) if session is not None else parse_json(run_osquery(MEMBERSHIP_QUERY))
+    memberships = {}
+    for row in rows:
+        memberships.setdefault(row['username'], []).append(row)
+    return memberships
+
+def benchmark_osquery(usernames, iterations=1):
+    """
+    Compare per-query latency of a process per query with a pipelined session.
+
+    Runs the per-user membership query for every username, the way the check
+    used to, once per iteration with each approach.
+    """
+    def summarize(samples):
+        samples = sorted(samples)
+        return {
+            "queries": len(samples),
+            "mean_ms": round(1000 * sum(samples) / len(samples), 2),
+            "p50_ms": round(1000 * samples[len(samples) // 2], 2),
+            "p95_ms": round(1000 * samples[min(len(samples) - 1, int(len(samples) * 0.95))], 2),
+            "total_s": round(sum(samples), 3),
+        }
+
+    per_process = []
+    for _ in range(iterations):
+        for username in usernames:
+            start = time.monotonic()
+            parse_json(run_osquery(USER_MEMBERSHIP_QUERY, (username,)))
+            per_process.append(time.monotonic() - start)
+
+    session_samples = []
+    with OsquerySession() as session:
+        start = time.monotonic()
+        session.query("SELECT 1 AS warmup;")
+        startup = time.monotonic() - start
+        for _ in range(iterations):
+            for username in usernames:
+                start = time.monotonic()
+                session.query(USER_MEMBERSHIP_QUERY, (username,))
+                session_samples.append(time.monotonic() - start)
+
+    return {
+        "process_per_query": summarize(per_process),
+        "session": dict(summarize(session_samples), startup_s=round(startup, 3)),
+    }
+
+def read_account_file(path):
+    """Split a colon-separated account file (passwd, group, gshadow) into field lists."""
+    with open(path, encoding='utf-8') as f:
+        return [line.rstrip('\n').split(':') for line in f
+                if line.strip() and not line.startswith(('#', '+', '-'))]
+
+def load_account_database(passwd_path='/etc/passwd', group_path='/etc/group'):
+    """
+    Parse the account files once into indexed maps.
+
+    Returns a tuple (users_by_uid, groups_by_gid, members_by_gid) where
+    users_by_uid maps uid -> (username, primary gid), groups_by_gid maps
+    gid -> groupname and members_by_gid maps gid -> set of usernames,
+    including users whose primary group it is. Like getgrouplist(3), which
+    osquery uses, membership comes from passwd and group only.
+    """
+    users_by_uid = {}
+    for fields in read_account_file(passwd_path):
+        if len(fields) >= 4:
+            users_by_uid[int(fields[2])] = (fields[0], int(fields[3]))
+
+    groups_by_gid = {}
+    members_by_gid = {}
+    for fields in read_account_file(group_path):
+        if len(fields) >= 4:
+            gid = int(fields[2])
+            groups_by_gid[gid] = fields[0]
+            members_by_gid.setdefault(gid, set()).update(m for m in fields[3].split(',') if m)
+
+    for username, gid in users_by_uid.values():
+        members_by_gid.setdefault(gid, set()).add(username)
+
+    return users_by_uid, groups_by_gid, members_by_gid
+
+def memberships_from_database(users_by_uid, groups_by_gid, members_by_gid):
+    """Turn the indexed account maps into the username -> memberships mapping used by the checks."""
+    known_users = {username for username, _ in users_by_uid.values()}
+
+    memberships = {}
+    for gid, members in members_by_gid.items():
+        groupname = groups_by_gid.get(gid)
+        if groupname is None:
+            continue
+        # Like osquery's users JOIN user_groups, ignore members without a passwd entry
+        for username in members & known_users:
+            memberships.setdefault(username, []).append({"groupname": groupname, "username": username})
+
+    for rows in memberships.values():
+        rows.sort(key=lambda x: x['groupname'])
+    return memberships
+
+def fetch_native_group_memberships(passwd_path='/etc/passwd', group_path='/etc/group'):
+    """Build the same username -> memberships mapping as the osquery backend from the account files."""
+    return memberships_from_database(*load_account_database(passwd_path, group_path))
+
+def check_gshadow(group_path='/etc/group', gshadow_path='/etc/gshadow'):
+    """
+    Compare the member lists in group and gshadow; return a list of diff entries.
+
+    The two files are expected to agree. Skipped (empty result) when gshadow
+    is not readable, e.g. when not running as root.
+    """
+    try:
+        shadow_members = {fields[0]: set(m for m in fields[3].split(',') if m)
+                          for fields in read_account_file(gshadow_path) if len(fields) >= 4}
+    except (FileNotFoundError, PermissionError):
+        return []
+
+    diffs = []
+    for fields in read_account_file(group_path):
+        if len(fields) < 4 or fields[0] not in shadow_members:
+            continue
+        members = set(m for m in fields[3].split(',') if m)
+        if members != shadow_members[fields[0]]:
+            diffs.append({
+                "groupname": fields[0],
+                "only_in_group": sorted(members - shadow_members[fields[0]]),
+                "only_in_gshadow": sorted(shadow_members[fields[0]] - members),
+            })
+    return diffs
+
+def cross_check(native, osquery):
+    """Compare the memberships reported by both backends; return a list of disagreements."""
+    diffs = []
+    for username in sorted(set(native) | set(osquery)):
+        native_rows = normalize_results(native.get(username, []))
+        osquery_rows = normalize_results(osquery.get(username, []))
+        if native_rows != osquery_rows:
+            print(f"Backends disagree for user '{username}'")
+            print("Native:", native_rows)
+            print("osquery:", osquery_rows)
+            diffs.append({
+                "username": username,
+                "native": [row['groupname'] for row in native_rows],
+                "osquery": [row['groupname'] for row in osquery_rows],
+            })
+    if not diffs:
+        print(f"Native and osquery backends agree on {len(native)} users.")
+    return diffs
+
+def load_baseline(path):
+    """
+    Load the security baseline spec.
+
+    The spec has a "users" map of username -> expected groups, an optional
+    "nixbld" rule and a "paths" list of {path, owner, group, mode, recurse}
+    entries. JSON is always supported; YAML needs PyYAML.
+    """
+    with open(path, encoding='utf-8') as f:
+        if path.endswith(('.yml', '.yaml')):
+            import yaml
+            return yaml.safe_load(f)
+        return json.load(f)
+
+def compare_results(username, query_result, expected_groups, verbose=True):
+    """Compare one user's memberships with the expected groups; return a diff entry or None if they match."""
+    if expected_groups is None:
+        if verbose:
+            print(f"No expected result defined for user '{username}'")
+        return {"username": username, "error": "no expected result defined"}
+
+    actual = {row['groupname'] for row in query_result}
+    expected = set(expected_groups)
+
+    if actual == expected:
+        if verbose:
+            print(f"The query result for user '{username}' matches the expected result.")
+        return None
+
+    if verbose:
+        print(f"The query result for user '{username}' does not match the expected result.")
+        print("Expected:", sorted(expected))
+        print("Got:", sorted(actual))
+    return {"username": username, "missing": sorted(expected - actual), "unexpected": sorted(actual - expected)}
+
+def check_nixbld_users(memberships, user_prefix='nixbld', group='nixbld', verbose=True):
+    """Check that every nixbld* user is only in the nixbld group; return a list of diff entries."""
+    diffs = []
+    for username, groups in memberships.items():
+        if not username.startswith(user_prefix):
+            continue
+        for user in groups:
+            if user['groupname'] != group:
+                if verbose:
+                    print(f"User '{user['username']}' is in group '{user['groupname']}' instead of '{group}'.")
+                diffs.append({"username": user['username'], "expected": group, "actual": user['groupname']})
+
+    if not diffs and verbose:
+        print(f"All {user_prefix} users are in the '{group}' group.")
+    return diffs
+
+def check_path_stat(path, st, spec, users_by_uid, groups_by_gid, check_mode=True):
+    """Compare one lstat() result with a path spec; return a list of diff entries."""
+    diffs = []
+    owner = users_by_uid.get(st.st_uid, (str(st.st_uid), None))[0]
+    group = groups_by_gid.get(st.st_gid, str(st.st_gid))
+    if 'owner' in spec and owner != spec['owner']:
+        diffs.append({"path": path, "field": "owner", "expected": spec['owner'], "actual": owner})
+    if 'group' in spec and group != spec['group']:
+        diffs.append({"path": path, "field": "group", "expected": spec['group'], "actual": group})
+    if check_mode and 'mode' in spec:
+        mode = stat.S_IMODE(st.st_mode)
+        if mode != int(str(spec['mode']), 8):
+            diffs.append({"path": path, "field": "mode", "expected": str(spec['mode']), "actual": f"{mode:04o}"})
+    return diffs
+
+def unreadable_entry(path, error):
+    """
+    The entry for a path that could not be stat'ed or listed.
+
+    Without root, paths under directories such as /etc/pgbouncer (0700) are
+    expected to be unreadable; they are reported as skipped rather than as
+    drift. As root, any error is a diff.
+    """
+    if isinstance(error, PermissionError) and os.geteuid() != 0:
+        return {"path": path, "field": "skipped", "actual": "needs root"}
+    return {"path": path, "field": "error", "actual": str(error)}
+
+def split_skipped(entries):
+    """Split audit entries into (diffs, skipped)."""
+    return ([entry for entry in entries if entry['field'] != 'skipped'],
+            [entry for entry in entries if entry['field'] == 'skipped'])
+
+def audit_path(spec, users_by_uid, groups_by_gid):
+    """
+    Audit one path spec with a single lstat() per path.
+
+    With "recurse", owner and group are also checked for everything below the
+    path, using the stat results from os.scandir. Paths that need root to
+    read are returned as "skipped" entries when not running as root.
+    """
+    path = spec['path']
+    try:
+        st = os.lstat(path)
+    except FileNotFoundError:
+        return [{"path": path, "field": "exists", "expected": True, "actual": False}]
+    except OSError as e:
+        return [unreadable_entry(path, e)]
+
+    diffs = check_path_stat(path, st, spec, users_by_uid, groups_by_gid)
+    if spec.get('recurse') and stat.S_ISDIR(st.st_mode):
+        pending = [path]
+        while pending:
+            directory = pending.pop()
+            try:
+                with os.scandir(directory) as it:
+                    for entry in it:
+                        entry_st = entry.stat(follow_symlinks=False)
+                        diffs.extend(check_path_stat(entry.path, entry_st, spec, users_by_uid, groups_by_gid,
+                                                     check_mode=False))
+                        if stat.S_ISDIR(entry_st.st_mode):
+                            pending.append(entry.path)
+            except OSError as e:
+                diffs.append(unreadable_entry(directory, e))
+    return diffs
+
+def audit_paths(path_specs, users_by_uid, groups_by_gid, workers=8, skipped=None):
+    """
+    Audit all path specs concurrently; return the diff entries in spec order.
+
+    Paths skipped because they need root are appended to `skipped` when given.
+    """
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        results = pool.map(lambda spec: audit_path(spec, users_by_uid, groups_by_gid), path_specs)
+        diffs, skipped_entries = split_skipped([diff for result in results for diff in result])
+    for diff in diffs:
+        print(f"Path '{diff['path']}' {diff['field']}: expected {diff.get('expected')}, got {diff.get('actual')}")
+    if skipped_entries:
+        print(f"Skipped {len(skipped_entries)} path(s) that need root: "
+              f"{', '.join(entry['path'] for entry in skipped_entries)}")
+    if skipped is not None:
+        skipped.extend(skipped_entries)
+    if not diffs:
+        print(f"All {len(path_specs) - len(skipped_entries)} readable baseline paths have the expected owner, "
+              f"group and mode.")
+    return diffs
+
+class Inotify:
+    """Minimal ctypes wrapper around the Linux inotify API."""
+
+    IN_MODIFY = 0x00000002
+    IN_ATTRIB = 0x00000004
+    IN_CLOSE_WRITE = 0x00000008
+    IN_MOVED_FROM = 0x00000040
+    IN_MOVED_TO = 0x00000080
+    IN_CREATE = 0x00000100
+    IN_DELETE = 0x00000200
+    IN_DELETE_SELF = 0x00000400
+    IN_MOVE_SELF = 0x00000800
+    IN_Q_OVERFLOW = 0x00004000
+    IN_IGNORED = 0x00008000
+    IN_MASK_ADD = 0x20000000
+
+    DIR_MASK = IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+    SELF_MASK = IN_ATTRIB | IN_MODIFY | IN_DELETE_SELF | IN_MOVE_SELF
+
+    _EVENT = struct.Struct('iIII')
+
+    def __init__(self):
+        libc_name = ctypes.util.find_library('c') or 'libc.so.6'
+        self._libc = ctypes.CDLL(libc_name, use_errno=True)
+        self.fd = self._libc.inotify_init1(os.O_CLOEXEC | os.O_NONBLOCK)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+
+    def add_watch(self, path, mask):
+        """
+        Watch a path; return the watch descriptor, or None if the path does not exist or is not readable.
+
+        inotify keeps one mask per inode, so the mask is added to any earlier
+        watch on the same path rather than replacing it.
+        """
+        wd = self._libc.inotify_add_watch(self.fd, os.fsencode(path), ctypes.c_uint32(mask | self.IN_MASK_ADD))
+        if wd < 0:
+            errno = ctypes.get_errno()
+            if errno in (2, 20):  # ENOENT, ENOTDIR
+                return None
+            if errno == 13:  # EACCES, e.g. /etc/pgbouncer without root
+                print(f"Not watching {path}: permission denied", file=sys.stderr)
+                return None
+            raise OSError(errno, f"inotify_add_watch failed for {path}")
+        return wd
+
+    def read_events(self, timeout=None):
+        """Block until events arrive (or the timeout expires); return (wd, mask, name) tuples."""
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return []
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return []
+        events = []
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, name_len = self._EVENT.unpack_from(data, offset)
+            offset += self._EVENT.size
+            name = data[offset:offset + name_len].rstrip(b'\0').decode('utf-8', errors='replace')
+            offset += name_len
+            events.append((wd, mask, name))
+        return events
+
+    def close(self):
+        os.close(self.fd)
+
+def emit_event(stream, event, **fields):
+    """Write one drift event as a JSON line."""
+    stream.write(json.dumps({"ts": round(time.time(), 3), "event": event, **fields}) + "\n")
+    stream.flush()
+
+def diff_snapshot(stream, kind, key, old, new):
+    """Emit drift/resolved events for the entries that changed between two evaluations of one key."""
+    old = old or []
+    new = new or []
+    for entry in new:
+        if entry not in old:
+            emit_event(stream, "drift", kind=kind, key=key, diff=entry)
+    for entry in old:
+        if entry not in new:
+            emit_event(stream, "resolved", kind=kind, key=key, diff=entry)
+
+def user_event_kind(key):
+    return "gshadow" if key.startswith("gshadow:") else "user"
+
+def evaluate_users(baseline, memberships, args):
+    """Evaluate every user, nixbld and gshadow entry of the baseline; return key -> list of diffs."""
+    results = {}
+    for username, groups in baseline.get('users', {}).items():
+        diff = compare_results(username, memberships.get(username, []), groups, verbose=False)
+        results[username] = [diff] if diff else []
+    nixbld = baseline.get('nixbld')
+    if nixbld:
+        for diff in check_nixbld_users(memberships, verbose=False, **nixbld):
+            results.setdefault(diff['username'], []).append(diff)
+    for diff in check_gshadow(args.group, args.gshadow):
+        results[f"gshadow:{diff['groupname']}"] = [diff]
+    return results
+
+def run_daemon(args, baseline, stream=sys.stdout):
+    """
+    Watch the account files and baseline paths with inotify and emit drift events as JSON lines.
+
+    The process sleeps in select() until the kernel reports a change, so it
+    uses no CPU while idle. Account file changes re-evaluate the users (and
+    the paths, whose owner names depend on them); a path event re-audits only
+    the baseline entries that watch it. If the kernel's event queue overflows,
+    events may have been lost, so everything is re-evaluated.
+    """
+    path_specs = baseline.get('paths', [])
+    account_files = {args.passwd, args.group, args.gshadow}
+    account_names = {os.path.dirname(os.path.abspath(p)): set() for p in account_files}
+    for p in account_files:
+        account_names[os.path.dirname(os.path.abspath(p))].add(os.path.basename(p))
+
+    inotify = Inotify()
+    # wd -> list of (target, name filter); target is "accounts" or a path spec index
+    watches = {}
+
+    def watch(path, mask, target, name=None):
+        wd = inotify.add_watch(path, mask)
+        if wd is not None and (target, name) not in watches.setdefault(wd, []):
+            watches[wd].append((target, name))
+
+    def watch_spec(index):
+        path = path_specs[index]['path']
+        watch(os.path.dirname(path), Inotify.DIR_MASK, index, os.path.basename(path))
+        watch(path, Inotify.SELF_MASK | Inotify.DIR_MASK, index)
+        if path_specs[index].get('recurse') and os.path.isdir(path):
+            for dirpath, dirnames, _ in os.walk(path):
+                for dirname in dirnames:
+                    watch(os.path.join(dirpath, dirname), Inotify.SELF_MASK | Inotify.DIR_MASK, index)
+
+    for directory, names in account_names.items():
+        for name in names:
+            watch(directory, Inotify.DIR_MASK, "accounts", name)
+    for index in range(len(path_specs)):
+        watch_spec(index)
+
+    db = load_account_database(args.passwd, args.group)
+    users = evaluate_users(baseline, memberships_from_database(*db), args)
+    paths = {index: split_skipped(audit_path(spec, db[0], db[1]))[0] for index, spec in enumerate(path_specs)}
+    emit_event(stream, "snapshot", users=len(users), paths=len(paths), watches=len(watches),
+               drifted_users=sum(bool(d) for d in users.values()), drifted_paths=sum(bool(d) for d in paths.values()))
+    for key, diffs in users.items():
+        diff_snapshot(stream, user_event_kind(key), key, [], diffs)
+    for index, diffs in paths.items():
+        diff_snapshot(stream, "path", path_specs[index]['path'], [], diffs)
+
+    try:
+        while True:
+            events = inotify.read_events()
+            # Coalesce bursts such as useradd rewriting passwd, group and gshadow
+            time.sleep(args.debounce)
+            events += inotify.read_events(timeout=0)
+
+            accounts_changed = False
+            affected = set()
+            for wd, mask, name in events:
+                if mask & Inotify.IN_Q_OVERFLOW:
+                    emit_event(stream, "overflow")
+                    accounts_changed = True
+                    continue
+                for target, name_filter in watches.get(wd, []):
+                    if name_filter is not None and name != name_filter:
+                        continue
+                    if target == "accounts":
+                        accounts_changed = True
+                    else:
+                        affected.add(target)
+                if mask & Inotify.IN_IGNORED:
+                    watches.pop(wd, None)
+
+            if accounts_changed:
+                db = load_account_database(args.passwd, args.group)
+                new_users = evaluate_users(baseline, memberships_from_database(*db), args)
+                for key in set(users) | set(new_users):
+                    diff_snapshot(stream, user_event_kind(key), key, users.get(key), new_users.get(key))
+                users = new_users
+                affected.update(range(len(path_specs)))
+
+            for index in sorted(affected):
+                new_diffs = split_skipped(audit_path(path_specs[index], db[0], db[1]))[0]
+                diff_snapshot(stream, "path", path_specs[index]['path'], paths[index], new_diffs)
+                paths[index] = new_diffs
+                # Re-arm watches on paths that were replaced or created
+                watch_spec(index)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        inotify.close()
+
+def main():
+    parser = argparse.ArgumentParser(description='Audit users, groups and file permissions against the image baseline')
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE,
+                        help='Baseline spec (JSON, or YAML if PyYAML is installed)')
+    parser.add_argument('--backend', choices=['native', 'osquery'], default='native',
+                        help='Read memberships from the account files (default) or from osquery')
+    parser.add_argument('--cross-check', action='store_true',
+                        help='Also query the other backend and report any disagreement')
+    parser.add_argument('--osquery-session', action='store_true',
+                        help='Run osquery queries through one long-lived osqueryi process')
+    parser.add_argument('--benchmark-osquery', type=int, metavar='N', default=0,
+                        help='Benchmark N rounds of per-user osquery queries, process-per-query vs session, and exit')
+    parser.add_argument('--passwd', default='/etc/passwd', help='passwd file for the native backend')
+    parser.add_argument('--group', default='/etc/group', help='group file for the native backend')
+    parser.add_argument('--gshadow', default='/etc/gshadow', help='gshadow file checked for agreement with the group file')
+    parser.add_argument('--skip-paths', action='store_true', help='Only check users and groups')
+    parser.add_argument('--workers', type=int, default=8, help='Threads used for the path sweep')
+    parser.add_argument('--report', help="Write the structured diff report as JSON to this file ('-' for stdout)")
+    parser.add_argument('--daemon', action='store_true',
+                        help='Keep running and emit drift events as JSON lines whenever watched files change')
+    parser.add_argument('--debounce', type=float, default=0.2,
+                        help='Seconds to wait for related changes before re-evaluating in daemon mode')
+    args = parser.parse_args()
+
+    start = time.monotonic()
+    baseline = load_baseline(args.baseline)
+
+    if args.benchmark_osquery:
+        print(json.dumps(benchmark_osquery(list(baseline.get('users', {})), args.benchmark_osquery), indent=2))
+        return
+
+    if args.daemon:
+        # Exit cleanly under systemd, which stops services with SIGTERM
+        signal.signal(signal.SIGTERM, signal.default_int_handler)
+        run_daemon(args, baseline)
+        return
+    expected_users = baseline.get('users', {})
+    nixbld = baseline.get('nixbld', {})
+
+    # The account database doubles as the uid/gid -> name cache for the path sweep
+    users_by_uid, groups_by_gid, _ = load_account_database(args.passwd, args.group)
+
+    # Fetch all memberships in one pass, then compare every user in one pass
+    native = osquery = None
+    if args.backend == 'native' or args.cross_check:
+        native = fetch_native_group_memberships(args.passwd, args.group)
+    if args.backend == 'osquery' or args.cross_check:
+        if args.osquery_session:
+            with OsquerySession() as session:
+                osquery = fetch_osquery_group_memberships(session)
+        else:
+            osquery = fetch_osquery_group_memberships()
+    memberships = native if args.backend == 'native' else osquery
+
+    skipped_paths = []
+    report = {
+        "baseline": os.path.abspath(args.baseline),
+        "backend": args.backend,
+        "users": [diff for diff in (compare_results(username, memberships.get(username, []), groups)
+                                    for username, groups in expected_users.items()) if diff],
+        "nixbld": check_nixbld_users(memberships, **nixbld) if nixbld else [],
+        "gshadow": check_gshadow(args.group, args.gshadow),
+        "paths": [] if args.skip_paths else audit_paths(baseline.get('paths', []), users_by_uid, groups_by_gid,
+                                                         args.workers, skipped_paths),
+        "skipped_paths": skipped_paths,
+        "backends": cross_check(native, osquery) if args.cross_check else [],
+    }
+    report["elapsed_seconds"] = round(time.monotonic() - start, 4)
+    report["ok"] = not any(report[key] for key in ("users", "nixbld", "gshadow", "paths", "backends"))
+
+    print(f"Checked {len(expected_users)} users, {sum(u.startswith(nixbld.get('user_prefix', 'nixbld')) for u in memberships)} "
+          f"nixbld users and {0 if args.skip_paths else len(baseline.get('paths', []))} paths "
+          f"with the {args.backend} backend in {report['elapsed_seconds']:.3f}s")
+
+    if args.report == '-':
+        print(json.dumps(report, indent=2))
+    elif args.report:
+        with open(args.report, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+
+    if not report["ok"]:
+        if report["users"]:
+            print(f"{len(report['users'])} user(s) with unexpected group memberships: "
+                  f"{', '.join(diff['username'] for diff in report['users'])}")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
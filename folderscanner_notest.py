@@ -3,15 +3,39 @@
 FolderScanner - Production-ready utility to scan and document file structures.
 
 This tool scans directories and files, respecting depth limitations and exclusion patterns,
-to create comprehensive documentation of the code structure in text or markdown format.
+to create comprehensive documentation of the code structure in text, markdown or JSON lines format.
+It can also run as a long-lived service that keeps registered roots indexed and cached in memory
+and renders scans for clients over a Unix socket.
 """
+import io
 import os
+import re
 import sys
 import argparse
+import bisect
+import bz2
+import collections
+import ctypes
+import ctypes.util
 import fnmatch
+import functools
+import gzip
+import hashlib
+import json
 import logging
+import lzma
+import signal
+import socket
+import socketserver
+import struct
+import subprocess
+import tarfile
 import textwrap
-from typing import List, Tuple, Set, Dict, Optional, Any
+import threading
+import time
+import tokenize
+import zipfile
+from typing import List, Tuple, Set, Dict, Optional, Any, BinaryIO, Callable, Iterator
 from dataclasses import dataclass, field
 
 # Configure logging
@@ -22,6 +46,21 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+TREE_SAMPLE_NAMES = 3  # Sample file names shown for a collapsed directory
+TREE_TOP_EXTENSIONS = 3  # Extensions shown for a collapsed directory
+LOW_IMPACT_BYTES_PER_SEC = 4 * 1024 * 1024  # Default read limit for --low-impact
+LOW_IMPACT_FILES_PER_SEC = 100  # Default file limit for --low-impact
+
+# Archives accepted as scan roots
+TAR_SUFFIXES = (".tar", ".tar.gz", ".tgz", ".tar.bz2", ".tbz2", ".tar.xz", ".txz")
+ZIP_SUFFIXES = (".zip",)
+NAR_SUFFIXES = (".nar", ".nar.xz", ".nar.bz2", ".nar.gz")
+
+MANIFEST_VERSION = 1  # Bump when the manifest layout changes
+SERVE_CACHE_BYTES = 256 * 1024 * 1024  # Default file block cache size for --serve
+SERVE_LATENCY_SAMPLES = 1000  # Recent request latencies kept for --serve metrics
+SERVE_MAX_INDEXES = 64  # Directory indexes kept by --serve, one per root and request options
+
 @dataclass
 class ScanConfig:
     """Configuration for directory scanning."""
@@ -31,8 +70,17 @@ class ScanConfig:
     exclude_dirs: Set[str] = field(default_factory=set)  # Directory names to exclude
     exclude_files: Set[str] = field(default_factory=set)  # File patterns to exclude
     depth_specs: Dict[str, int] = field(default_factory=dict)  # Path -> depth limit mapping
-    output_format: str = "txt"  # Output format: "txt" or "md"
+    output_format: str = "txt"  # Output format: "txt", "md" or "jsonl"
     output_file: str = "scan_output.txt"  # Output file path
+    minify: bool = False  # Strip comments and blank lines from emitted content
+    collapse_threshold: int = 200  # Summarize directories with more entries than this (0 disables)
+
+@dataclass
+class ScanStats:
+    """Counters collected while scanning."""
+    files_read: int = 0
+    words_before_minify: int = 0  # Words read from disk
+    words_after_minify: int = 0  # Words emitted after minification
 
 def parse_paths_with_depth(raw_paths: List[str]) -> Tuple[List[str], Dict[str, int]]:
     """
@@ -140,35 +188,923 @@ def is_excluded(path: str, is_dir: bool, config: ScanConfig) -> bool:
     
     return False
 
-def get_file_contents(file_path: str) -> str:
+# ---------------------------------------------------------------------------
+# Content minification
+#
+# Each minifier returns the file as a list of (line, protected) pairs.
+# A protected line ends inside a string literal (or heredoc / block scalar)
+# and is emitted verbatim; every other line has its trailing whitespace
+# stripped and is dropped if nothing is left.
+# ---------------------------------------------------------------------------
+
+HASH_COMMENT_FLAVORS = {
+    ".sh": "shell", ".bash": "shell",
+    ".yml": "yaml", ".yaml": "yaml",
+    ".nix": "nix",
+    ".conf": "shell", ".cfg": "shell", ".toml": "shell",
+}
+
+SHELL_HEREDOC_RE = re.compile(r"<<(-?)\s*(['\"]?)([A-Za-z_][A-Za-z0-9_]*)\2")
+YAML_BLOCK_SCALAR_RE = re.compile(r"(^|[\s:-])[|>][0-9+-]*$")
+SQL_DOLLAR_QUOTE_RE = re.compile(r"\$([A-Za-z_][A-Za-z0-9_]*)?\$")
+
+def _join_lines(lines: List[Tuple[str, bool]], trailing_newline: bool) -> str:
+    """Collapse unprotected lines and join the result back into a single string."""
+    kept = []
+    for text, protected in lines:
+        if protected:
+            kept.append(text)
+            continue
+        text = text.rstrip()
+        if text:
+            kept.append(text)
+    result = "\n".join(kept)
+    if trailing_newline and kept:
+        result += "\n"
+    return result
+
+def _minify_python(content: str) -> str:
+    """Strip comments and blank lines from Python source using `tokenize`."""
+    lines = content.splitlines()
+    comment_cols: Dict[int, int] = {}
+    protected_rows: Set[int] = set()
+    string_ends: Dict[int, int] = {}
+    fstring_start = getattr(tokenize, "FSTRING_START", None)
+    fstring_end = getattr(tokenize, "FSTRING_END", None)
+    fstring_stack: List[Tuple[int, int]] = []
+
+    try:
+        for tok in tokenize.generate_tokens(io.StringIO(content).readline):
+            if tok.type == tokenize.COMMENT:
+                comment_cols[tok.start[0]] = tok.start[1]
+            elif tok.type == fstring_start:
+                fstring_stack.append(tok.start)
+            elif tok.type == fstring_end and fstring_stack:
+                start_row, _ = fstring_stack.pop()
+                protected_rows.update(range(start_row, tok.end[0]))
+                string_ends[tok.end[0]] = max(string_ends.get(tok.end[0], 0), tok.end[1])
+            elif tok.type == tokenize.STRING and tok.end[0] > tok.start[0]:
+                protected_rows.update(range(tok.start[0], tok.end[0]))
+                string_ends[tok.end[0]] = max(string_ends.get(tok.end[0], 0), tok.end[1])
+    except (tokenize.TokenError, SyntaxError) as e:
+        logger.debug(f"Python tokenize failed, leaving content unchanged: {e}")
+        return content
+
+    result = []
+    for row, line in enumerate(lines, start=1):
+        if row in protected_rows:
+            result.append((line, True))
+            continue
+        if row in comment_cols:
+            line = line[:comment_cols[row]]
+        if row in string_ends:
+            # Never strip into the tail of a multi-line string literal.
+            end = string_ends[row]
+            line = line[:end] + line[end:].rstrip()
+            result.append((line, True))
+            continue
+        result.append((line, False))
+    return _join_lines(result, content.endswith("\n"))
+
+def _minify_shell(content: str) -> str:
+    """Strip `#` comments and blank lines from shell-style config and scripts."""
+    result = []
+    in_single = in_double = False
+    heredocs: List[Tuple[str, bool]] = []
+    heredoc: Optional[Tuple[str, bool]] = None
+    continued = False
+    arith_depth = 0  # Open parentheses inside $(( )) / (( )), where << is a shift
+
+    for row, line in enumerate(content.splitlines()):
+        if heredoc is not None:
+            delim, strip_tabs = heredoc
+            if (line.lstrip("\t") if strip_tabs else line) == delim:
+                heredoc = heredocs.pop(0) if heredocs else None
+            result.append((line, True))
+            continue
+        if row == 0 and line.startswith("#!"):
+            result.append((line, True))
+            continue
+
+        started_quoted = in_single or in_double
+        cut = None
+        i = 0
+        while i < len(line):
+            ch = line[i]
+            if in_single:
+                if ch == "'":
+                    in_single = False
+            elif ch == "\\":
+                i += 1
+            elif in_double:
+                if ch == '"':
+                    in_double = False
+            elif arith_depth:
+                if ch == "(":
+                    arith_depth += 1
+                elif ch == ")":
+                    arith_depth -= 1
+            elif line.startswith("((", i):
+                arith_depth = 2
+                i += 1
+            elif ch == "'":
+                in_single = True
+            elif ch == '"':
+                in_double = True
+            elif ch == "#" and (i == 0 or line[i - 1] in " \t"):
+                cut = i
+                break
+            elif (ch == "<" and line.startswith("<<", i) and not line.startswith("<<<", i)
+                  and (i == 0 or line[i - 1] != "<")):
+                match = SHELL_HEREDOC_RE.match(line, i)
+                if match:
+                    heredocs.append((match.group(3), match.group(1) == "-"))
+                    i = match.end() - 1
+            i += 1
+
+        text = line if cut is None else line[:cut]
+        protected = started_quoted or in_single or in_double
+        if continued and not text.strip():
+            protected = True
+        result.append((text, protected))
+        continued = not protected and text.rstrip().endswith("\\")
+        if heredocs and not (in_single or in_double):
+            heredoc = heredocs.pop(0)
+
+    return _join_lines(result, content.endswith("\n"))
+
+def _minify_yaml(content: str) -> str:
+    """Strip `#` comments and blank lines from YAML, leaving block scalars intact."""
+    result = []
+    quote: Optional[str] = None
+    block_indent: Optional[int] = None
+
+    for line in content.splitlines():
+        stripped = line.lstrip(" ")
+        indent = len(line) - len(stripped)
+        if block_indent is not None:
+            if not stripped or indent > block_indent:
+                result.append((line, True))
+                continue
+            block_indent = None
+
+        started_quoted = quote is not None
+        cut = None
+        i = 0
+        while i < len(line):
+            ch = line[i]
+            if quote == "'":
+                if ch == "'":
+                    if line.startswith("''", i):
+                        i += 1
+                    else:
+                        quote = None
+            elif quote == '"':
+                if ch == "\\":
+                    i += 1
+                elif ch == '"':
+                    quote = None
+            elif ch in "'\"":
+                before = line[:i].rstrip()
+                # Quotes only open a scalar at the start of a value.
+                if not before or before[-1] in "[{,?" or (before[-1] in ":-" and line[i - 1] in " \t"):
+                    quote = ch
+            elif ch == "#" and (i == 0 or line[i - 1] in " \t"):
+                cut = i
+                break
+            i += 1
+
+        text = line if cut is None else line[:cut]
+        protected = started_quoted or quote is not None
+        result.append((text, protected))
+        if not protected and YAML_BLOCK_SCALAR_RE.search(text.rstrip()):
+            block_indent = indent
+
+    return _join_lines(result, content.endswith("\n"))
+
+def _minify_nix(content: str) -> str:
+    """Strip `#` and `/* */` comments and blank lines from Nix expressions."""
+    result = []
+    current: List[str] = []
+    # Each frame is [mode, brace_depth]; modes are "code", "string" and "indented".
+    stack: List[List[Any]] = [["code", 0]]
+    i = 0
+    n = len(content)
+
+    while i < n:
+        ch = content[i]
+        mode = stack[-1][0]
+        if ch == "\n":
+            result.append(("".join(current), mode != "code"))
+            current = []
+            i += 1
+            continue
+        if mode == "code":
+            if ch == "#":
+                end = content.find("\n", i)
+                i = n if end == -1 else end
+                continue
+            if content.startswith("/*", i) and (i == 0 or content[i - 1] in " \t\n;=({["):
+                end = content.find("*/", i + 2)
+                end = n if end == -1 else end + 2
+                current.append(" ")
+                for _ in range(content.count("\n", i, end)):
+                    result.append(("".join(current), False))
+                    current = []
+                i = end
+                continue
+            if ch == '"':
+                stack.append(["string", 0])
+            elif content.startswith("''", i):
+                stack.append(["indented", 0])
+                current.append("''")
+                i += 2
+                continue
+            elif ch == "{":
+                stack[-1][1] += 1
+            elif ch == "}":
+                if stack[-1][1] == 0 and len(stack) > 1:
+                    stack.pop()
+                else:
+                    stack[-1][1] -= 1
+            current.append(ch)
+            i += 1
+            continue
+
+        # Inside a string literal: copy verbatim, tracking escapes and interpolation.
+        step = 1
+        if content.startswith("$${", i):
+            step = 3
+        elif content.startswith("${", i):
+            stack.append(["code", 0])
+            step = 2
+        elif mode == "string":
+            if ch == "\\":
+                step = 2
+            elif ch == '"':
+                stack.pop()
+        elif content.startswith("'''", i):
+            step = 3
+        elif content.startswith("''$", i) or content.startswith("''\\", i):
+            step = 3
+        elif content.startswith("''", i):
+            stack.pop()
+            step = 2
+        chunk = content[i:i + step]
+        if "\n" in chunk:
+            head, tail = chunk.split("\n", 1)
+            result.append(("".join(current) + head, True))
+            current = [tail]
+        else:
+            current.append(chunk)
+        i += step
+
+    if current:
+        result.append(("".join(current), stack[-1][0] != "code"))
+    return _join_lines(result, content.endswith("\n"))
+
+def _minify_sql(content: str) -> str:
+    """Strip `--` and `/* */` comments and blank lines from SQL."""
+    result = []
+    current: List[str] = []
+    i = 0
+    n = len(content)
+    # Active literal: (closing delimiter, allows backslash escapes) or None.
+    literal: Optional[Tuple[str, bool]] = None
+
+    while i < n:
+        ch = content[i]
+        if ch == "\n":
+            result.append(("".join(current), literal is not None))
+            current = []
+            i += 1
+            continue
+        if literal is not None:
+            closing, backslash = literal
+            if backslash and ch == "\\":
+                current.append(content[i:i + 2])
+                i += 2
+                continue
+            if content.startswith(closing, i):
+                # Doubled quotes are an escaped quote, not the end of the literal.
+                if closing in ("'", '"') and content.startswith(closing * 2, i):
+                    current.append(closing * 2)
+                    i += 2
+                    continue
+                literal = None
+                current.append(closing)
+                i += len(closing)
+                continue
+            current.append(ch)
+            i += 1
+            continue
+
+        if content.startswith("--", i):
+            end = content.find("\n", i)
+            i = n if end == -1 else end
+            continue
+        if content.startswith("/*", i):
+            depth = 0
+            j = i
+            while j < n:
+                if content.startswith("/*", j):
+                    depth += 1
+                    j += 2
+                elif content.startswith("*/", j):
+                    depth -= 1
+                    j += 2
+                    if depth == 0:
+                        break
+                else:
+                    j += 1
+            current.append(" ")
+            for _ in range(content.count("\n", i, j)):
+                result.append(("".join(current), False))
+                current = []
+            i = j
+            continue
+        if ch == "'":
+            escaped = i > 0 and content[i - 1] in "eE" and (i < 2 or not (content[i - 2].isalnum() or content[i - 2] == "_"))
+            literal = ("'", escaped)
+        elif ch == '"':
+            literal = ('"', False)
+        elif ch == "$" and (i == 0 or not (content[i - 1].isalnum() or content[i - 1] == "_")):
+            match = SQL_DOLLAR_QUOTE_RE.match(content, i)
+            if match:
+                literal = (match.group(0), False)
+                current.append(match.group(0))
+                i = match.end()
+                continue
+        current.append(ch)
+        i += 1
+
+    if current:
+        result.append(("".join(current), literal is not None))
+    return _join_lines(result, content.endswith("\n"))
+
+def get_minifier(file_path: str) -> Optional[Any]:
     """
-    Read the contents of a file, handling exceptions gracefully.
+    Select the minifier for a file based on its extension.
+
+    Templates (`*.j2`) are minified according to the extension they render to.
+
+    Args:
+        file_path: Path or name of the file.
+
+    Returns:
+        The minifier callable, or None if the file type is not supported.
+    """
+    name = os.path.basename(file_path)
+    if name.endswith(".j2"):
+        name = name[:-3]
+    ext = os.path.splitext(name)[1].lower()
+    if ext == ".py":
+        return _minify_python
+    if ext == ".sql":
+        return _minify_sql
+    flavor = HASH_COMMENT_FLAVORS.get(ext)
+    if flavor == "yaml":
+        return _minify_yaml
+    if flavor == "nix":
+        return _minify_nix
+    if flavor == "shell":
+        return _minify_shell
+    return None
+
+def minify_content(content: str, file_path: str) -> str:
+    """
+    Strip comments and collapse whitespace in file content, leaving string literals untouched.
+
+    Args:
+        content: File contents.
+        file_path: Path of the file, used to select the language.
+
+    Returns:
+        str: Minified contents, or the original contents for unsupported types and read errors.
+    """
+    if content.startswith("Error reading file:"):
+        return content
+    minifier = get_minifier(file_path)
+    if minifier is None:
+        return content
+    return minifier(content)
+
+class TokenBucket:
+    """Token bucket that blocks the caller until enough tokens are available."""
+
+    def __init__(self, rate: float, capacity: Optional[float] = None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else rate
+        # Start empty so short scans cannot exceed the rate with an initial burst
+        self.tokens = 0.0
+        self.updated = time.monotonic()
+
+    def consume(self, amount: float) -> float:
+        """
+        Take tokens from the bucket, sleeping if it runs dry.
+
+        Requests larger than the capacity are allowed and paid back over time,
+        so a single large file cannot stall the scan indefinitely.
+
+        Args:
+            amount: Number of tokens to take.
+
+        Returns:
+            float: Seconds spent sleeping.
+        """
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        self.tokens -= amount
+        if self.tokens >= 0:
+            return 0.0
+        delay = -self.tokens / self.rate
+        time.sleep(delay)
+        return delay
+
+class IOThrottle:
+    """Rate limits and page-cache hygiene for low-impact scans on live hosts."""
+
+    def __init__(self, bytes_per_sec: float = 0, files_per_sec: float = 0, drop_cache: bool = True):
+        self.bytes_per_sec = bytes_per_sec
+        self.files_per_sec = files_per_sec
+        self.drop_cache = drop_cache and hasattr(os, "posix_fadvise")
+        self.byte_bucket = TokenBucket(bytes_per_sec) if bytes_per_sec > 0 else None
+        self.file_bucket = TokenBucket(files_per_sec) if files_per_sec > 0 else None
+        self.bytes_read = 0
+        self.files_read = 0
+        self.dirs_listed = 0
+        self.sleep_seconds = 0.0
+        self.started = time.monotonic()
+
+    def before_read(self, size: int) -> None:
+        """Wait until the limits allow reading another file of the given size."""
+        if self.file_bucket is not None:
+            self.sleep_seconds += self.file_bucket.consume(1)
+        if self.byte_bucket is not None:
+            self.sleep_seconds += self.byte_bucket.consume(size)
+        self.files_read += 1
+        self.bytes_read += size
+
+    def before_listing(self, directory: str) -> None:
+        """Wait until the file limit allows listing another directory; a listing costs one file."""
+        if self.file_bucket is not None:
+            self.sleep_seconds += self.file_bucket.consume(1)
+        self.dirs_listed += 1
+
+    def after_read(self, fd: int) -> None:
+        """Drop the file's pages from the page cache so the scan does not evict hot data."""
+        if self.drop_cache:
+            try:
+                os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+            except OSError as e:
+                logger.debug(f"posix_fadvise failed: {e}")
+
+    def report(self) -> str:
+        """Summarize achieved throughput against the configured limits."""
+        elapsed = max(time.monotonic() - self.started, 1e-9)
+        byte_limit = f"{format_size(self.bytes_per_sec)}/s" if self.bytes_per_sec else "unlimited"
+        file_limit = f"{self.files_per_sec:g} files/s" if self.files_per_sec else "unlimited"
+        return (
+            f"Low-impact scan: {self.files_read} files, {format_size(self.bytes_read)}, "
+            f"{self.dirs_listed} directories in {elapsed:.1f}s; "
+            f"{format_size(self.bytes_read / elapsed)}/s (limit {byte_limit}), "
+            f"{self.files_read / elapsed:.1f} files/s (limit {file_limit}), "
+            f"{self.sleep_seconds:.1f}s throttled"
+        )
+
+def throttle_from_args(args: argparse.Namespace) -> Optional[IOThrottle]:
+    """
+    Build the IOThrottle for the rate limit options, or None when there are none.
+
+    --low-impact fills in the default for whichever limit was not given;
+    without it, a limit that was not given stays unlimited.
+    """
+    if not (args.low_impact or args.max_bytes_per_sec is not None or args.max_files_per_sec is not None):
+        return None
+    bytes_per_sec, files_per_sec = args.max_bytes_per_sec, args.max_files_per_sec
+    if bytes_per_sec is None:
+        bytes_per_sec = LOW_IMPACT_BYTES_PER_SEC if args.low_impact else 0
+    if files_per_sec is None:
+        files_per_sec = LOW_IMPACT_FILES_PER_SEC if args.low_impact else 0
+    return IOThrottle(bytes_per_sec=bytes_per_sec, files_per_sec=files_per_sec, drop_cache=args.low_impact)
+
+def lower_process_priority() -> None:
+    """Move this process to the lowest CPU priority and the idle I/O scheduling class."""
+    try:
+        os.setpriority(os.PRIO_PROCESS, 0, 19)
+        logger.info("CPU priority lowered to nice 19")
+    except (AttributeError, OSError) as e:
+        logger.warning(f"Could not lower CPU priority: {e}")
+
+    try:
+        subprocess.run(['ionice', '-c', '3', '-p', str(os.getpid())], check=True,
+                       stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+        logger.info("I/O priority set to idle class")
+    except (OSError, subprocess.CalledProcessError) as e:
+        logger.warning(f"Could not lower I/O priority: {e}")
+
+def parse_rate(value: str) -> float:
+    """
+    Parse a rate such as "512K" or "10M" into a number per second.
+
+    Args:
+        value: Number with an optional K, M or G (binary) suffix.
+
+    Returns:
+        float: The rate.
+
+    Raises:
+        argparse.ArgumentTypeError: If the value cannot be parsed.
+    """
+    multipliers = {"K": 1024, "M": 1024 ** 2, "G": 1024 ** 3}
+    text = value.strip().upper().rstrip("B")
+    factor = 1
+    if text and text[-1] in multipliers:
+        factor = multipliers[text[-1]]
+        text = text[:-1]
+    try:
+        rate = float(text) * factor
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"Invalid rate: {value}")
+    if rate < 0:
+        raise argparse.ArgumentTypeError(f"Rate must be non-negative: {value}")
+    return rate
+
+def get_file_contents_and_stat(file_path: str, throttle: Optional[IOThrottle] = None
+                               ) -> Tuple[str, Optional[os.stat_result]]:
+    """
+    Read the contents of a file together with the stat of the file that was read.
+
+    The stat is taken from the open descriptor before reading, so a file
+    rewritten during the scan is never paired with a stat newer than its
+    content.
 
     Args:
         file_path: Absolute path to the file.
+        throttle: Optional IOThrottle applied around the read.
 
     Returns:
-        str: File contents or an error message if reading fails.
+        Tuple of (file contents or an error message, stat or None if reading fails).
     """
     try:
         with open(file_path, 'r', encoding='utf-8') as f:
-            return f.read()
+            st = os.fstat(f.fileno())
+            if throttle is None:
+                return f.read(), st
+            throttle.before_read(st.st_size)
+            content = f.read()
+            throttle.after_read(f.fileno())
+            return content, st
     except Exception as e:
         error_msg = f"Error reading file: {e}"
         logger.error(error_msg)
-        return error_msg
+        return error_msg, None
+
+def get_file_contents(file_path: str, throttle: Optional[IOThrottle] = None) -> str:
+    """
+    Read the contents of a file, handling exceptions gracefully.
+
+    Args:
+        file_path: Absolute path to the file.
+        throttle: Optional IOThrottle applied around the read.
+
+    Returns:
+        str: File contents or an error message if reading fails.
+    """
+    return get_file_contents_and_stat(file_path, throttle)[0]
 
-def walk_directories(config: ScanConfig) -> List[Tuple[str, str, str]]:
+def process_content(content: str, file_path: str, config: ScanConfig, stats: Optional[ScanStats] = None) -> str:
+    """
+    Pass file content through the enabled content stages.
+
+    Args:
+        content: File contents as read.
+        file_path: Path of the file, used to select language-specific stages.
+        config: ScanConfig object with processing options.
+        stats: Optional ScanStats updated with per-file counters.
+
+    Returns:
+        str: Processed contents.
+    """
+    if stats is not None:
+        stats.files_read += 1
+        stats.words_before_minify += count_words(content)
+    if config.minify:
+        content = minify_content(content, file_path)
+    if stats is not None:
+        stats.words_after_minify += count_words(content)
+    return content
+
+def read_file(file_path: str, config: ScanConfig, stats: Optional[ScanStats] = None,
+              throttle: Optional[IOThrottle] = None) -> str:
+    """
+    Read a file and pass it through the enabled content stages.
+
+    Args:
+        file_path: Absolute path to the file.
+        config: ScanConfig object with processing options.
+        stats: Optional ScanStats updated with per-file counters.
+        throttle: Optional IOThrottle for low-impact reads.
+
+    Returns:
+        str: Processed file contents or an error message if reading fails.
+    """
+    return read_file_and_stat(file_path, config, stats, throttle)[0]
+
+def read_file_and_stat(file_path: str, config: ScanConfig, stats: Optional[ScanStats] = None,
+                       throttle: Optional[IOThrottle] = None) -> Tuple[str, Optional[os.stat_result]]:
+    """
+    Like read_file, but also return the stat taken when the file was read.
+
+    Returns:
+        Tuple of (processed contents or an error message, stat or None if reading fails).
+    """
+    content, st = get_file_contents_and_stat(file_path, throttle)
+    return process_content(content, file_path, config, stats), st
+
+def is_archive(path: str) -> bool:
+    """Check whether a path names a supported archive (tar, zip or NAR)."""
+    name = os.path.basename(path).lower()
+    return os.path.isfile(path) and name.endswith(TAR_SUFFIXES + ZIP_SUFFIXES + NAR_SUFFIXES)
+
+def is_single_file_root(root_path: str) -> bool:
+    """Check whether a scan root is a plain file rather than a directory or archive."""
+    return os.path.isfile(root_path) and not is_archive(root_path)
+
+def _read_nar_string(stream: BinaryIO) -> bytes:
+    """Read one length-prefixed, 8-byte padded NAR string."""
+    header = stream.read(8)
+    if len(header) != 8:
+        raise ValueError("Truncated NAR archive")
+    length = struct.unpack("<Q", header)[0]
+    data = stream.read(length)
+    if len(data) != length:
+        raise ValueError("Truncated NAR archive")
+    stream.read((8 - length % 8) % 8)
+    return data
+
+def _expect_nar_token(stream: BinaryIO, expected: bytes) -> None:
+    token = _read_nar_string(stream)
+    if token != expected:
+        raise ValueError(f"Malformed NAR archive: expected {expected!r}, got {token[:32]!r}")
+
+def _iter_nar_node(stream: BinaryIO, path: str) -> Iterator[Tuple[str, bytes]]:
+    """Yield (path, contents) for every regular file below one NAR node."""
+    _expect_nar_token(stream, b"(")
+    _expect_nar_token(stream, b"type")
+    node_type = _read_nar_string(stream)
+
+    if node_type == b"regular":
+        token = _read_nar_string(stream)
+        if token == b"executable":
+            _expect_nar_token(stream, b"")
+            token = _read_nar_string(stream)
+        if token != b"contents":
+            raise ValueError(f"Malformed NAR archive: expected b'contents', got {token[:32]!r}")
+        yield path, _read_nar_string(stream)
+        _expect_nar_token(stream, b")")
+    elif node_type == b"symlink":
+        _expect_nar_token(stream, b"target")
+        _read_nar_string(stream)
+        _expect_nar_token(stream, b")")
+    elif node_type == b"directory":
+        while True:
+            token = _read_nar_string(stream)
+            if token == b")":
+                break
+            if token != b"entry":
+                raise ValueError(f"Malformed NAR archive: expected b'entry', got {token[:32]!r}")
+            _expect_nar_token(stream, b"(")
+            _expect_nar_token(stream, b"name")
+            name = _read_nar_string(stream).decode("utf-8", errors="replace")
+            _expect_nar_token(stream, b"node")
+            yield from _iter_nar_node(stream, f"{path}/{name}" if path else name)
+            _expect_nar_token(stream, b")")
+    else:
+        raise ValueError(f"Unknown NAR node type: {node_type[:32]!r}")
+
+def iter_archive_members(archive_path: str) -> Iterator[Tuple[str, int, Any]]:
+    """
+    Stream the regular files of an archive in a single sequential pass.
+
+    Compressed tarballs and NARs are decompressed on the fly; nothing is
+    written to disk.
+
+    Args:
+        archive_path: Path to a tar, zip or NAR archive.
+
+    Yields:
+        Tuples of (member path, size, reader) where reader() returns the member's bytes.
+        The reader must be called before advancing to the next member.
+    """
+    name = os.path.basename(archive_path).lower()
+
+    if name.endswith(TAR_SUFFIXES):
+        with tarfile.open(archive_path, mode="r|*") as tar:
+            for member in tar:
+                if member.isfile():
+                    fileobj = tar.extractfile(member)
+                    yield member.name, member.size, fileobj.read
+
+    elif name.endswith(ZIP_SUFFIXES):
+        with zipfile.ZipFile(archive_path) as zf:
+            # Read members in on-disk order so the archive is read front to back
+            for info in sorted(zf.infolist(), key=lambda i: i.header_offset):
+                if not info.is_dir():
+                    yield info.filename, info.file_size, functools.partial(zf.read, info)
+
+    else:
+        openers = {".xz": lzma.open, ".bz2": bz2.open, ".gz": gzip.open}
+        opener = openers.get(os.path.splitext(name)[1], open)
+        with opener(archive_path, "rb") as stream:
+            _expect_nar_token(stream, b"nix-archive-1")
+            for member_path, data in _iter_nar_node(stream, ""):
+                yield member_path, len(data), (lambda data=data: data)
+
+def member_rel_path(member_path: str) -> Optional[str]:
+    """
+    Return an archive member's path relative to the archive root.
+
+    Leading slashes are dropped, so absolute member names stay inside the
+    archive when joined to its path. Returns None for a name whose ".."
+    components would leave the archive root.
+    """
+    rel_path = os.path.normpath(member_path.lstrip("/"))
+    if rel_path in (".", os.pardir) or rel_path.startswith(os.pardir + os.sep):
+        return None
+    return rel_path
+
+def scan_archive(archive_path: str, config: ScanConfig, stats: Optional[ScanStats] = None,
+                 throttle: Optional[IOThrottle] = None,
+                 listing: Optional[List[Tuple[str, int]]] = None) -> List[Tuple[str, str, str]]:
+    """
+    Collect the contents of an archive's members as if it were a directory.
+
+    Members go through the same exclusion rules, depth limit and content
+    stages as files found on disk. A member that cannot be read on its own,
+    such as an encrypted zip entry, is skipped without ending the scan.
+
+    Args:
+        archive_path: Absolute path to the archive.
+        config: ScanConfig object with exclusion rules and depth specs.
+        stats: Optional ScanStats updated as members are read.
+        throttle: Optional IOThrottle limiting read throughput.
+        listing: Optional list that receives the (member path, stored size) of
+            each member collected, for rendering the archive's structure.
+
+    Returns:
+        List of (archive_path, member path, content) tuples.
+    """
+    logger.info(f"Scanning archive: {archive_path}")
+    depth_limit = config.depth_specs.get(archive_path)
+    file_data = []
+
+    try:
+        for member_path, size, reader in iter_archive_members(archive_path):
+            rel_path = member_rel_path(member_path)
+            if rel_path is None:
+                logger.warning(f"Skipping {archive_path}:{member_path}: path leaves the archive root")
+                continue
+            rel_dir = os.path.dirname(rel_path)
+            depth = rel_dir.count(os.sep) + 1 if rel_dir else 0
+            if depth_limit is not None and depth > depth_limit:
+                continue
+            if rel_dir and is_excluded(rel_dir, True, config):
+                continue
+            if is_excluded(rel_path, False, config):
+                continue
+
+            if throttle is not None:
+                throttle.before_read(size)
+            try:
+                data = reader()
+            except (RuntimeError, NotImplementedError) as e:
+                # zipfile raises these for encrypted members and unsupported compression methods
+                logger.warning(f"Skipping {archive_path}:{rel_path}: {e}")
+                continue
+            try:
+                content = data.decode("utf-8")
+            except UnicodeDecodeError as e:
+                content = f"Error reading file: {e}"
+                logger.debug(f"{archive_path}:{rel_path}: {content}")
+            logger.debug(f"Reading: {archive_path}:{rel_path}")
+            file_data.append((archive_path, rel_path, process_content(content, rel_path, config, stats)))
+            if listing is not None:
+                listing.append((rel_path, size))
+    except (OSError, EOFError, ValueError, tarfile.TarError, zipfile.BadZipFile, lzma.LZMAError) as e:
+        logger.error(f"Error reading archive {archive_path}: {e}")
+
+    return file_data
+
+def iter_root_files(path: str, config: ScanConfig, on_directory: Optional[Callable[[str], None]] = None,
+                    tree: Optional["TreeNode"] = None) -> Iterator[Tuple[str, str, str]]:
+    """
+    List the files of one directory or single-file root, respecting depth limits and exclusions.
+
+    Nothing is read, so callers can decide per file whether its content is needed.
+    The same walk fills in the structure tree when one is passed, so rendering the
+    structure never lists the directory a second time.
+
+    Args:
+        path: Absolute path of a directory or plain file root.
+        config: ScanConfig object with exclusion rules and depth specs.
+        on_directory: Optional callback run with each directory just before it is listed,
+            e.g. to watch it, so no change made after the listing goes unnoticed.
+        tree: Optional empty TreeNode for a directory root, filled in as the walk proceeds.
+            Directories with more than config.collapse_threshold entries are collapsed
+            into counters; only the files below them are stat'ed, for their sizes.
+
+    Yields:
+        Tuples: (root_path, relative file path, absolute file path).
+        For single files: (full_file_path, filename, full_file_path)
+    """
+    # Handle single files
+    if os.path.isfile(path):
+        logger.info(f"Processing single file: {path}")
+        file_name = os.path.basename(path)
+        
+        # Check if the file should be excluded
+        if not is_excluded(file_name, False, config):
+            # FIXED: Store full file path as root_path for single files
+            yield path, file_name, path
+        return
+        
+    # Handle directories
+    logger.info(f"Scanning directory: {path}")
+    
+    # Check if we have a depth limit for this path
+    depth_limit = config.depth_specs.get(path)
+    if depth_limit is not None:
+        logger.info(f"Depth limit set to {depth_limit} for {path}")
+
+    # Each entry: directory, its path relative to the root, its depth, the node
+    # it renders as (None inside a collapsed subtree or without a tree) and the
+    # collapsed node its files are counted into, if any
+    pending: List[Tuple[str, str, int, Optional[TreeNode], Optional[TreeNode]]] = [(path, ".", 0, tree, None)]
+    while pending:
+        subdir, rel_subdir, depth, node, summary = pending.pop()
+        logger.debug(f"Processing directory at depth {depth}: {subdir}")
+        if on_directory is not None:
+            on_directory(subdir)
+        files, dirs = _list_directory(subdir, rel_subdir, config)
+
+        if (node is not None and config.collapse_threshold
+                and len(files) + len(dirs) > config.collapse_threshold):
+            node.collapsed = True
+            summary, node = node, None
+        if summary is not None:
+            for entry in files:
+                _add_to_summary(summary, entry.name, _entry_size(entry))
+        elif node is not None:
+            node.files = sorted(entry.name for entry in files)
+
+        # Process files in the current directory
+        for entry in files:
+            rel_path = entry.name if rel_subdir == "." else os.path.join(rel_subdir, entry.name)
+            logger.debug(f"Reading: {rel_path}")
+            yield path, rel_path, entry.path
+
+        # Check depth limit
+        if depth_limit is not None and depth + 1 > depth_limit:
+            logger.debug(f"Not descending below {subdir} - depth limit of {depth_limit}")
+            continue
+
+        dirs.sort(key=lambda entry: entry.name)
+        children = []
+        for entry in dirs:
+            child = None
+            if node is not None:
+                child = TreeNode(entry.name)
+                node.children.append(child)
+            # Like os.walk, list symlinked directories without following them
+            if not entry.is_symlink():
+                child_rel = entry.name if rel_subdir == "." else os.path.join(rel_subdir, entry.name)
+                children.append((entry.path, child_rel, depth + 1, child, summary))
+        pending.extend(reversed(children))
+
+def walk_directories(config: ScanConfig, stats: Optional[ScanStats] = None,
+                     throttle: Optional[IOThrottle] = None,
+                     structures: Optional[Dict[str, str]] = None,
+                     file_stats: Optional[Dict[Tuple[str, str], os.stat_result]] = None
+                     ) -> List[Tuple[str, str, str]]:
     """
     Walk through directories and collect file contents, respecting depth limits and exclusions.
 
     Args:
         config: ScanConfig object with paths and exclusion rules.
+        stats: Optional ScanStats updated as files are read.
+        throttle: Optional IOThrottle limiting read throughput.
+        structures: Optional dict that receives the rendered structure of each
+            directory root, built during the same walk.
+        file_stats: Optional dict that receives the stat of each file read,
+            keyed by (root_path, relative file path), for build_manifest().
 
     Returns:
         List of tuples: (root_path, relative file path, file contents).
         For single files: (full_file_path, filename, content)
         For directory files: (directory_path, relative_path_from_dir, content)
+        For archive members: (archive_path, member_path, content)
     """
     file_data = []
     
@@ -176,139 +1112,247 @@ def walk_directories(config: ScanConfig) -> List[Tuple[str, str, str]]:
     for path in config.paths:
         path = os.path.abspath(path)
         
-        # Handle single files
-        if os.path.isfile(path):
-            logger.info(f"Processing single file: {path}")
-            file_name = os.path.basename(path)
-            
-            # Check if the file should be excluded
-            if not is_excluded(file_name, False, config):
-                content = get_file_contents(path)
-                # FIXED: Store full file path as root_path for single files
-                file_data.append((path, file_name, content))
+        # Handle archives like directories, streaming their members
+        if is_archive(path):
+            listing: List[Tuple[str, int]] = []
+            file_data.extend(scan_archive(path, config, stats, throttle, listing))
+            if structures is not None:
+                structures[path] = get_directory_structure(path, config, listing)
             continue
-            
-        # Handle directories
-        logger.info(f"Scanning directory: {path}")
         
-        # Check if we have a depth limit for this path
-        depth_limit = config.depth_specs.get(path)
-        if depth_limit is not None:
-            logger.info(f"Depth limit set to {depth_limit} for {path}")
-            
-            # Special handling for depth=0 to get files directly in the root directory
-            if depth_limit == 0:
-                try:
-                    # List all entries in the directory
-                    entries = os.listdir(path)
-                    logger.info(f"Found {len(entries)} entries in root directory {path}")
-                    
-                    # Process only files (not subdirectories)
-                    for entry in entries:
-                        entry_path = os.path.join(path, entry)
-                        if os.path.isfile(entry_path):
-                            rel_path = os.path.basename(entry_path)
-                            if not is_excluded(rel_path, False, config):
-                                logger.info(f"Reading root file: {rel_path}")
-                                content = get_file_contents(entry_path)
-                                file_data.append((path, rel_path, content))
-                except Exception as e:
-                    logger.error(f"Error reading root directory {path}: {e}")
-                
-                # Skip normal directory walk when depth=0
-                continue
-            
-        # Normal directory walk for depth > 0 or no depth limit
-        for subdir, dirs, files in os.walk(path):
-            # Calculate the current depth relative to the starting path
-            rel_subdir = os.path.relpath(subdir, path) if subdir != path else "."
-            current_depth = 0 if rel_subdir == "." else rel_subdir.count(os.sep) + 1
-            
-            logger.debug(f"Processing directory at depth {current_depth}: {subdir}")
-            
-            # Check depth limit
-            if depth_limit is not None and current_depth > depth_limit:
-                logger.debug(f"Skipping {subdir} - exceeds depth limit of {depth_limit}")
-                dirs[:] = []  # Skip subdirectories
-                continue
-                
-            # Check if the directory should be excluded
-            if is_excluded(rel_subdir, True, config):
-                logger.debug(f"Excluding directory: {rel_subdir}")
-                dirs[:] = []  # Skip subdirectories
-                continue
-                
-            # Filter out excluded directories from the list to walk
-            dirs[:] = [d for d in dirs if not is_excluded(os.path.join(rel_subdir, d), True, config)]
-            
-            # Process files in the current directory
-            for file in files:
-                file_path = os.path.join(subdir, file)
-                rel_path = os.path.relpath(file_path, path)
-                
-                if not is_excluded(rel_path, False, config):
-                    logger.debug(f"Reading: {rel_path}")
-                    content = get_file_contents(file_path)
-                    file_data.append((path, rel_path, content))
+        tree = TreeNode(os.path.basename(path)) if structures is not None and os.path.isdir(path) else None
+        on_directory = throttle.before_listing if throttle is not None else None
+        for root_path, rel_path, file_path in iter_root_files(path, config, on_directory, tree):
+            content, st = read_file_and_stat(file_path, config, stats, throttle)
+            file_data.append((root_path, rel_path, content))
+            if file_stats is not None and st is not None:
+                file_stats[(root_path, rel_path)] = st
+        if tree is not None:
+            structures[path] = render_directory_tree(tree)
     
     logger.info(f"Total files collected: {len(file_data)}")
     return file_data
 
-def get_directory_structure(root_path: str, config: ScanConfig) -> str:
+@dataclass
+class TreeNode:
+    """A directory in the rendered structure, with the counts needed to summarize it."""
+    name: str
+    files: List[str] = field(default_factory=list)
+    children: List["TreeNode"] = field(default_factory=list)
+    collapsed: bool = False
+    file_count: int = 0  # Files in the subtree (collapsed nodes only)
+    total_size: int = 0  # Bytes in the subtree (collapsed nodes only)
+    extensions: Dict[str, int] = field(default_factory=dict)
+    samples: List[str] = field(default_factory=list)
+
+def format_size(size: int) -> str:
+    """Format a byte count for display."""
+    for unit in ("B", "KB", "MB", "GB"):
+        if size < 1024 or unit == "GB":
+            return f"{size:.0f} {unit}" if unit == "B" else f"{size:.1f} {unit}"
+        size /= 1024
+    return f"{size:.1f} TB"
+
+def _list_directory(dir_path: str, rel_path: str, config: ScanConfig) -> Tuple[List[os.DirEntry], List[os.DirEntry]]:
+    """Return the non-excluded (files, directories) directly inside dir_path."""
+    files, dirs = [], []
+    try:
+        with os.scandir(dir_path) as it:
+            for entry in it:
+                entry_rel = os.path.join(rel_path, entry.name)
+                try:
+                    is_dir = entry.is_dir()
+                except OSError:
+                    is_dir = False
+                if not is_excluded(entry_rel, is_dir, config):
+                    (dirs if is_dir else files).append(entry)
+    except OSError as e:
+        logger.debug(f"Cannot list {dir_path}: {e}")
+    return files, dirs
+
+def _entry_size(entry: os.DirEntry) -> int:
+    try:
+        return entry.stat(follow_symlinks=False).st_size
+    except OSError:
+        return 0
+
+def _add_to_summary(node: TreeNode, name: str, size: int) -> None:
+    """Account for a file in a collapsed node, keeping only bounded state."""
+    node.file_count += 1
+    node.total_size += size
+    ext = os.path.splitext(name)[1].lower() or "(none)"
+    node.extensions[ext] = node.extensions.get(ext, 0) + 1
+    if len(node.samples) < TREE_SAMPLE_NAMES or name < node.samples[-1]:
+        bisect.insort(node.samples, name)
+        del node.samples[TREE_SAMPLE_NAMES:]
+
+def build_directory_tree(root_path: str, config: ScanConfig) -> TreeNode:
     """
-    Generate a string representation of the directory structure, excluding specified items.
+    Walk a directory once and build the tree to render, collapsing oversized directories.
+
+    A directory with more than config.collapse_threshold entries is not expanded;
+    its subtree is reduced to a file count, total size, extension histogram and
+    a few sample names, so memory and render time stay bounded. Callers that also
+    need the files pass a TreeNode to iter_root_files instead of walking twice.
 
     Args:
         root_path: Root directory to scan.
+        config: ScanConfig object with exclusion rules and the collapse threshold.
+
+    Returns:
+        TreeNode: The root of the tree.
+    """
+    root = TreeNode(os.path.basename(root_path))
+    for _ in iter_root_files(root_path, config, tree=root):
+        pass
+    return root
+
+def render_directory_tree(root: TreeNode) -> str:
+    """
+    Render a TreeNode as an indented listing.
+
+    Chains of directories that only contain a single subdirectory are folded
+    into one `a/b/c/` line, and collapsed directories become a summary line.
+
+    Args:
+        root: Tree built by build_directory_tree.
+
+    Returns:
+        str: Formatted directory structure.
+    """
+    lines = []
+    pending = [(root, 0, True)]
+
+    while pending:
+        node, level, is_root = pending.pop()
+        name = node.name
+        if not is_root:
+            while not node.collapsed and not node.files and len(node.children) == 1:
+                node = node.children[0]
+                name = f"{name}/{node.name}"
+
+        indent = ' ' * 4 * level
+        if node.collapsed:
+            top_exts = sorted(node.extensions.items(), key=lambda item: (-item[1], item[0]))[:TREE_TOP_EXTENSIONS]
+            exts = ", ".join(f"{ext} {count}" for ext, count in top_exts)
+            samples = ", ".join(node.samples)
+            lines.append(
+                f"{indent}{name}/ [collapsed: {node.file_count} files, {format_size(node.total_size)}"
+                f"; {exts}; e.g. {samples}]" if node.file_count else
+                f"{indent}{name}/ [collapsed: 0 files]"
+            )
+            continue
+
+        lines.append(f"{indent}{name}/")
+        sub_indent = ' ' * 4 * (level + 1)
+        lines.extend(f"{sub_indent}{file}" for file in node.files)
+        pending.extend((child, level + 1, False) for child in reversed(node.children))
+
+    return "\n".join(lines)
+
+def build_tree_from_paths(root_name: str, members: List[Tuple[str, int]], config: ScanConfig) -> TreeNode:
+    """
+    Build the tree to render from a flat list of already-filtered relative paths.
+
+    Used for archives, whose member list is gathered during the single streaming
+    pass instead of walking a directory.
+
+    Args:
+        root_name: Name shown for the root.
+        members: (relative path, size) pairs.
+        config: ScanConfig object with the collapse threshold.
+
+    Returns:
+        TreeNode: The root of the tree.
+    """
+    # Nested mapping: name -> subtree for directories, name -> size for files
+    index: Dict[str, Any] = {}
+    for rel_path, size in members:
+        parts = rel_path.split(os.sep)
+        level = index
+        for part in parts[:-1]:
+            level = level.setdefault(part, {})
+            if not isinstance(level, dict):
+                break
+        else:
+            level[parts[-1]] = size
+
+    def summarize(node: TreeNode, level: Dict[str, Any]) -> None:
+        node.collapsed = True
+        pending = [level]
+        while pending:
+            for name, value in pending.pop().items():
+                if isinstance(value, dict):
+                    pending.append(value)
+                else:
+                    _add_to_summary(node, name, value)
+
+    root = TreeNode(root_name)
+    pending = [(root, index)]
+    while pending:
+        node, level = pending.pop()
+        if config.collapse_threshold and len(level) > config.collapse_threshold:
+            summarize(node, level)
+            continue
+        node.files = sorted(name for name, value in level.items() if not isinstance(value, dict))
+        for name in sorted(name for name, value in level.items() if isinstance(value, dict)):
+            child = TreeNode(name)
+            node.children.append(child)
+            pending.append((child, level[name]))
+
+    return root
+
+def get_directory_structure(root_path: str, config: ScanConfig,
+                            members: Optional[List[Tuple[str, int]]] = None) -> str:
+    """
+    Generate a string representation of the directory structure, excluding specified items.
+
+    Args:
+        root_path: Root directory or archive to scan.
         config: ScanConfig object with exclusion rules.
+        members: (relative path, size) pairs for archive roots, which are not walked again.
 
     Returns:
         str: Formatted directory structure.
     """
+    if members is not None:
+        return render_directory_tree(build_tree_from_paths(os.path.basename(root_path), members, config))
+
     if os.path.isfile(root_path):
         return os.path.basename(root_path)
-        
-    structure = []
-    root_name = os.path.basename(root_path)
-    
-    for root, dirs, files in os.walk(root_path):
-        rel_path = os.path.relpath(root, root_path) if root != root_path else "."
-        
-        # Check depth limit
-        depth_limit = config.depth_specs.get(root_path)
-        current_depth = 0 if rel_path == "." else rel_path.count(os.sep) + 1
-        
-        if depth_limit is not None and current_depth > depth_limit:
-            dirs[:] = []  # Skip subdirectories
-            continue
-            
-        # Skip excluded directories
-        if rel_path != "." and is_excluded(rel_path, True, config):
-            dirs[:] = []  # Skip subdirectories
-            continue
-            
-        # Filter dirs list in place
-        dirs[:] = [d for d in dirs if not is_excluded(os.path.join(rel_path, d), True, config)]
-        
-        # Format the current directory line
-        level = rel_path.count(os.sep) if rel_path != "." else 0
-        indent = ' ' * 4 * level
-        
-        if rel_path == ".":
-            structure.append(f"{indent}{root_name}/")
-        else:
-            structure.append(f"{indent}{os.path.basename(root)}/")
-        
-        # Format the files
-        sub_indent = ' ' * 4 * (level + 1)
-        for file in sorted(files):
-            file_rel_path = os.path.join(rel_path, file)
-            if not is_excluded(file_rel_path, False, config):
-                structure.append(f"{sub_indent}{file}")
-    
-    return "\n".join(structure)
 
-def write_txt_output(f: Any, file_data: List[Tuple[str, str, str]], config: ScanConfig) -> None:
+    return render_directory_tree(build_directory_tree(root_path, config))
+
+def archive_members(root_path: str, dir_files: List[Tuple[str, str]]) -> Optional[List[Tuple[str, int]]]:
+    """
+    Return the (path, stored size) list used to render an archive root, or None for directories.
+
+    Scans collect this listing while reading the archive and pass the rendered
+    structure along; this fallback reads the member headers again for callers
+    that only have the emitted file data.
+    """
+    if not is_archive(root_path):
+        return None
+    emitted = {rel_path for rel_path, _ in dir_files}
+    members = []
+    try:
+        for member_path, size, _ in iter_archive_members(root_path):
+            rel_path = member_rel_path(member_path)
+            if rel_path is not None and rel_path in emitted:
+                members.append((rel_path, size))
+    except (OSError, EOFError, ValueError, tarfile.TarError, zipfile.BadZipFile, lzma.LZMAError) as e:
+        logger.error(f"Error reading archive {root_path}: {e}")
+    return members
+
+def root_structure(root_path: str, dir_files: List[Tuple[str, str]], config: ScanConfig,
+                   structures: Optional[Dict[str, str]] = None) -> str:
+    """Return the rendered structure of a root, reusing one from structures when given."""
+    if structures is not None and root_path in structures:
+        return structures[root_path]
+    return get_directory_structure(root_path, config, archive_members(root_path, dir_files))
+
+def write_txt_output(f: Any, file_data: List[Tuple[str, str, str]], config: ScanConfig,
+                     structures: Optional[Dict[str, str]] = None) -> None:
     """Write output in text format."""
     # Get list of unique root paths for the header
     root_paths = sorted(set(root_path for root_path, _, _ in file_data))
@@ -326,25 +1370,26 @@ def write_txt_output(f: Any, file_data: List[Tuple[str, str, str]], config: Scan
         if root_path not in paths_seen:
             paths_seen.add(root_path)
             
-            if os.path.isfile(root_path):
+            if is_single_file_root(root_path):
                 # It's a single file
                 f.write(f"\n*File: {os.path.basename(root_path)}*\n")
                 f.write(f"Words: {count_words(content)}\n\n")
             else:
-                # It's a directory
+                # It's a directory or archive
                 dir_name = os.path.basename(root_path)
                 dir_files = [(r, c) for rp, r, c in file_data if rp == root_path]
                 total_words = sum(count_words(c) for _, c in dir_files)
                 
-                f.write(f"\n*Directory: {dir_name}*\n")
+                kind = "Archive" if is_archive(root_path) else "Directory"
+                f.write(f"\n*{kind}: {dir_name}*\n")
                 f.write(f"Total words: {total_words}\n\n")
                 f.write("File structure:\n\n")
-                f.write(get_directory_structure(root_path, config))
+                f.write(root_structure(root_path, dir_files, config, structures))
                 f.write("\n\n")
     
     # Write all file contents
     for root_path, rel_path, content in file_data:
-        if os.path.isfile(root_path):
+        if is_single_file_root(root_path):
             # Single file case, use the root_path as the full file path
             file_path = root_path
         else:
@@ -353,7 +1398,8 @@ def write_txt_output(f: Any, file_data: List[Tuple[str, str, str]], config: Scan
             
         f.write(f"'''--- {file_path} ---\n{content}\n'''\n\n")
 
-def write_md_output(f: Any, file_data: List[Tuple[str, str, str]], config: ScanConfig) -> None:
+def write_md_output(f: Any, file_data: List[Tuple[str, str, str]], config: ScanConfig,
+                    structures: Optional[Dict[str, str]] = None) -> None:
     """Write output in markdown format."""
     f.write("# Directory Scan Results\n\n")
     
@@ -371,27 +1417,28 @@ def write_md_output(f: Any, file_data: List[Tuple[str, str, str]], config: ScanC
         if root_path not in paths_seen:
             paths_seen.add(root_path)
             
-            if os.path.isfile(root_path):
+            if is_single_file_root(root_path):
                 # It's a single file
                 f.write(f"## File: {os.path.basename(root_path)}\n\n")
                 f.write(f"**Words:** {count_words(content)}\n\n")
             else:
-                # It's a directory
+                # It's a directory or archive
                 dir_name = os.path.basename(root_path)
                 dir_files = [(r, c) for rp, r, c in file_data if rp == root_path]
                 total_words = sum(count_words(c) for _, c in dir_files)
                 
-                f.write(f"## Directory: {dir_name}\n\n")
+                kind = "Archive" if is_archive(root_path) else "Directory"
+                f.write(f"## {kind}: {dir_name}\n\n")
                 f.write(f"**Total words:** {total_words}\n\n")
                 f.write("### File structure\n\n")
                 f.write("```\n")
-                f.write(get_directory_structure(root_path, config))
+                f.write(root_structure(root_path, dir_files, config, structures))
                 f.write("\n```\n\n")
     
     # Write all file contents
     f.write("## File Contents\n\n")
     for root_path, rel_path, content in file_data:
-        if os.path.isfile(root_path):
+        if is_single_file_root(root_path):
             # Single file case - use the root_path as the full file path
             file_path = root_path
         else:
@@ -403,34 +1450,804 @@ def write_md_output(f: Any, file_data: List[Tuple[str, str, str]], config: ScanC
         f.write(content)
         f.write("\n```\n\n")
 
-def write_analysis_files(file_data: List[Tuple[str, str, str]], config: ScanConfig) -> None:
+def write_jsonl_output(f: Any, file_data: List[Tuple[str, str, str]], config: ScanConfig,
+                       structures: Optional[Dict[str, str]] = None) -> None:
+    """Write output as JSON lines: one "root" record per root, then one "file" record per file."""
+    paths_seen = set()
+    for root_path, _, _ in file_data:
+        if root_path not in paths_seen:
+            paths_seen.add(root_path)
+            dir_files = [(r, c) for rp, r, c in file_data if rp == root_path]
+            record = {
+                "type": "root",
+                "root": root_path,
+                "kind": "file" if is_single_file_root(root_path) else "archive" if is_archive(root_path) else "directory",
+                "files": len(dir_files),
+                "words": sum(count_words(c) for _, c in dir_files),
+            }
+            if not is_single_file_root(root_path):
+                record["structure"] = root_structure(root_path, dir_files, config, structures)
+            f.write(json.dumps(record) + "\n")
+    
+    for root_path, rel_path, content in file_data:
+        file_path = root_path if is_single_file_root(root_path) else os.path.join(root_path, rel_path)
+        f.write(json.dumps({
+            "type": "file", "root": root_path, "path": rel_path, "file": file_path,
+            "words": count_words(content), "content": content,
+        }) + "\n")
+
+def get_output_path(config: ScanConfig) -> str:
+    """Return the output file path with the extension matching the output format."""
+    output_file = config.output_file
+    
+    # Adjust output file extension if needed
+    extension = '.' + config.output_format
+    if not output_file.endswith(extension):
+        output_file = os.path.splitext(output_file)[0] + extension
+    return output_file
+
+def write_output(f: Any, file_data: List[Tuple[str, str, str]], config: ScanConfig,
+                 structures: Optional[Dict[str, str]] = None) -> None:
+    """Write output in the configured format."""
+    if config.output_format == 'md':
+        write_md_output(f, file_data, config, structures)
+    elif config.output_format == 'jsonl':
+        write_jsonl_output(f, file_data, config, structures)
+    else:
+        write_txt_output(f, file_data, config, structures)
+
+def write_analysis_files(file_data: List[Tuple[str, str, str]], config: ScanConfig,
+                         structures: Optional[Dict[str, str]] = None) -> None:
     """
     Write the directory structure, total word count, and file contents to the output file.
 
     Args:
         file_data: List of (root_path, relative file path, content) tuples.
         config: ScanConfig object with paths and exclusion rules.
+        structures: Optional rendered structures of directory roots, from walk_directories.
     """
-    output_file = config.output_file
+    output_file = get_output_path(config)
     
-    # Adjust output file extension if needed
-    if config.output_format == 'md' and not output_file.endswith('.md'):
-        output_file = os.path.splitext(output_file)[0] + '.md'
-    elif config.output_format == 'txt' and not output_file.endswith('.txt'):
-        output_file = os.path.splitext(output_file)[0] + '.txt'
+    try:
+        with open(output_file, 'w', encoding='utf-8') as f:
+            write_output(f, file_data, config, structures)
+                
+        logger.info(f"Analysis file saved: {output_file}")
+    except Exception as e:
+        logger.error(f"Error writing output file: {e}")
+        raise
+
+@dataclass
+class RootDiff:
+    """Changes under one scan root since a manifest was written."""
+    root_path: str
+    added: List[Tuple[str, str]] = field(default_factory=list)  # (relative path, content)
+    modified: List[Tuple[str, str]] = field(default_factory=list)  # (relative path, content)
+    removed: List[str] = field(default_factory=list)  # Relative paths
+    unchanged: int = 0
+    words_before: int = 0  # Words under the root in the manifest
+    words_after: int = 0  # Words under the root now
+
+def _stat_or_none(file_path: str) -> Optional[os.stat_result]:
+    try:
+        return os.stat(file_path)
+    except OSError:
+        return None
+
+def fingerprint(content: str, st: Optional[os.stat_result] = None) -> Dict[str, Any]:
+    """
+    Build the manifest entry for one emitted file.
+
+    Size and mtime come from the file's stat, so later diffs can skip reading
+    it. The hash and word count are of the emitted content, after minification.
+    Archive members have no stat of their own and use the content length.
+    """
+    return {
+        "size": st.st_size if st is not None else len(content.encode("utf-8")),
+        "mtime_ns": st.st_mtime_ns if st is not None else None,
+        "sha256": hashlib.sha256(content.encode("utf-8")).hexdigest(),
+        "words": count_words(content),
+    }
+
+def _manifest_root(root_path: str) -> Dict[str, Any]:
+    entry: Dict[str, Any] = {"files": {}}
+    if is_archive(root_path):
+        st = os.stat(root_path)
+        entry["archive"] = {"size": st.st_size, "mtime_ns": st.st_mtime_ns}
+    return entry
+
+def build_manifest(file_data: List[Tuple[str, str, str]], config: ScanConfig,
+                   file_stats: Dict[Tuple[str, str], os.stat_result]) -> Dict[str, Any]:
+    """
+    Build a manifest of a finished scan for later --diff runs.
+
+    Args:
+        file_data: List of (root_path, relative file path, content) tuples.
+        config: ScanConfig the scan ran with.
+        file_stats: Stats recorded by walk_directories() as each file was read.
+            A file without one gets no mtime, so the next diff reads it again.
+
+    Returns:
+        Dict with the manifest version, the minify setting and a per-root map of file fingerprints.
+    """
+    roots: Dict[str, Dict[str, Any]] = {}
+    for root_path, rel_path, content in file_data:
+        if root_path not in roots:
+            roots[root_path] = _manifest_root(root_path)
+        roots[root_path]["files"][rel_path] = fingerprint(content, file_stats.get((root_path, rel_path)))
+    return {"version": MANIFEST_VERSION, "minify": config.minify, "roots": roots}
+
+def load_manifest(manifest_path: str) -> Dict[str, Any]:
+    """Load a manifest written by --write-manifest, checking its version."""
+    with open(manifest_path, 'r', encoding='utf-8') as f:
+        manifest = json.load(f)
+    if not isinstance(manifest, dict) or manifest.get("version") != MANIFEST_VERSION:
+        raise ValueError(f"{manifest_path} is not a version {MANIFEST_VERSION} scan manifest")
+    return manifest
+
+def write_manifest(manifest: Dict[str, Any], manifest_path: str) -> None:
+    """Write a manifest atomically, so an interrupted scan leaves the previous one in place."""
+    tmp_path = f"{manifest_path}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+        f.write("\n")
+    os.replace(tmp_path, manifest_path)
+    logger.info(f"Manifest saved: {manifest_path}")
+
+def _record_change(diff: RootDiff, entry: Dict[str, Any], old: Optional[Dict[str, Any]],
+                   rel_path: str, content: str, st: Optional[os.stat_result]) -> None:
+    new = fingerprint(content, st)
+    entry["files"][rel_path] = new
+    if old is None:
+        diff.added.append((rel_path, content))
+    elif old["sha256"] != new["sha256"]:
+        diff.modified.append((rel_path, content))
+
+def diff_against_manifest(config: ScanConfig, manifest: Dict[str, Any], stats: Optional[ScanStats] = None,
+                          throttle: Optional[IOThrottle] = None) -> Tuple[List[RootDiff], Dict[str, Any]]:
+    """
+    Compare the configured roots against a previous manifest.
+
+    A file whose size and mtime match its manifest entry is taken as unchanged
+    without being read. Other files are read and compared by content hash, so
+    a touched but identical file is not reported. An archive root is only
+    read again when the archive itself changed.
+
+    Args:
+        config: ScanConfig object with paths and exclusion rules.
+        manifest: Manifest loaded with load_manifest().
+        stats: Optional ScanStats updated as files are read.
+        throttle: Optional IOThrottle limiting read throughput.
+
+    Returns:
+        Tuple of (one RootDiff per root, the manifest of the current tree).
+    """
+    if manifest.get("minify", False) != config.minify:
+        raise ValueError(
+            f"Manifest was written with minify={'on' if manifest.get('minify') else 'off'}; "
+            "diff with the same --minify setting"
+        )
+
+    diffs = []
+    roots: Dict[str, Dict[str, Any]] = {}
+    for path in config.paths:
+        path = os.path.abspath(path)
+        previous = manifest["roots"].get(path)
+        if previous is None:
+            logger.info(f"Not in the manifest, all files are new: {path}")
+        old_files = previous["files"] if previous else {}
+        entry = _manifest_root(path)
+        diff = RootDiff(path)
+        seen = set()
+
+        if is_archive(path):
+            if previous is not None and previous.get("archive") == entry["archive"]:
+                logger.info(f"Archive unchanged: {path}")
+                entry["files"] = dict(old_files)
+                seen.update(old_files)
+            else:
+                for _, rel_path, content in scan_archive(path, config, stats, throttle):
+                    seen.add(rel_path)
+                    _record_change(diff, entry, old_files.get(rel_path), rel_path, content, None)
+        else:
+            on_directory = throttle.before_listing if throttle is not None else None
+            for _, rel_path, file_path in iter_root_files(path, config, on_directory):
+                seen.add(rel_path)
+                old = old_files.get(rel_path)
+                st = _stat_or_none(file_path)
+                if old is not None and st is not None and \
+                        old["size"] == st.st_size and old["mtime_ns"] == st.st_mtime_ns:
+                    entry["files"][rel_path] = old
+                    continue
+                content, st = read_file_and_stat(file_path, config, stats, throttle)
+                _record_change(diff, entry, old, rel_path, content, st)
+
+        diff.added.sort()
+        diff.modified.sort()
+        diff.removed = sorted(set(old_files) - seen)
+        diff.unchanged = len(entry["files"]) - len(diff.added) - len(diff.modified)
+        diff.words_before = sum(f["words"] for f in old_files.values())
+        diff.words_after = sum(f["words"] for f in entry["files"].values())
+        diffs.append(diff)
+        roots[path] = entry
+
+    return diffs, {"version": MANIFEST_VERSION, "minify": config.minify, "roots": roots}
+
+def _root_kind(root_path: str) -> str:
+    if is_single_file_root(root_path):
+        return "File"
+    return "Archive" if is_archive(root_path) else "Directory"
+
+def _display_path(root_path: str, rel_path: str) -> str:
+    return root_path if is_single_file_root(root_path) else os.path.join(root_path, rel_path)
+
+def _changed_files(diff: RootDiff) -> List[Tuple[str, str, str]]:
+    """(display path, change, content) for the added and modified files of a root."""
+    changed = [(rel_path, "added", content) for rel_path, content in diff.added]
+    changed += [(rel_path, "modified", content) for rel_path, content in diff.modified]
+    return [(_display_path(diff.root_path, rel_path), change, content)
+            for rel_path, change, content in sorted(changed)]
+
+def write_txt_diff(f: Any, diffs: List[RootDiff]) -> None:
+    """Write a diff in text format."""
+    root_paths_str = "\n- ".join([""] + [diff.root_path for diff in diffs])
+    f.write(
+        f"The below represents the changes since the manifest under the root paths:{root_paths_str}\n\n"
+        "Each added or modified file is separated by '''--- followed by the file path and its change, "
+        "ending with ---.\n"
+        "File content begins immediately after its path and extends until the next '''---\n\n"
+    )
+    
+    for diff in diffs:
+        f.write(f"\n*{_root_kind(diff.root_path)}: {os.path.basename(diff.root_path)}*\n")
+        f.write(
+            f"Added: {len(diff.added)}, modified: {len(diff.modified)}, "
+            f"removed: {len(diff.removed)}, unchanged: {diff.unchanged}\n"
+        )
+        f.write(f"Total words: {diff.words_before} -> {diff.words_after} "
+                f"({diff.words_after - diff.words_before:+d})\n\n")
+        if diff.removed:
+            f.write("Removed files:\n")
+            for rel_path in diff.removed:
+                f.write(f"- {_display_path(diff.root_path, rel_path)}\n")
+            f.write("\n")
+    
+    for diff in diffs:
+        for file_path, change, content in _changed_files(diff):
+            f.write(f"'''--- {file_path} ({change}) ---\n{content}\n'''\n\n")
+
+def write_md_diff(f: Any, diffs: List[RootDiff]) -> None:
+    """Write a diff in markdown format."""
+    f.write("# Directory Scan Changes\n\n")
+    f.write("This document contains the changes since the manifest under the following paths:\n\n")
+    for diff in diffs:
+        f.write(f"- `{diff.root_path}`\n")
+    f.write("\n")
+    
+    for diff in diffs:
+        f.write(f"## {_root_kind(diff.root_path)}: {os.path.basename(diff.root_path)}\n\n")
+        f.write(
+            f"**Added:** {len(diff.added)}, **modified:** {len(diff.modified)}, "
+            f"**removed:** {len(diff.removed)}, **unchanged:** {diff.unchanged}\n\n"
+        )
+        f.write(f"**Total words:** {diff.words_before} -> {diff.words_after} "
+                f"({diff.words_after - diff.words_before:+d})\n\n")
+        if diff.removed:
+            f.write("### Removed files\n\n")
+            for rel_path in diff.removed:
+                f.write(f"- `{_display_path(diff.root_path, rel_path)}`\n")
+            f.write("\n")
+    
+    f.write("## Changed Files\n\n")
+    for diff in diffs:
+        for file_path, change, content in _changed_files(diff):
+            f.write(f"### {file_path} ({change})\n\n")
+            f.write("```\n")
+            f.write(content)
+            f.write("\n```\n\n")
+
+def write_jsonl_diff(f: Any, diffs: List[RootDiff]) -> None:
+    """Write a diff as JSON lines: one "root" record per root, then one "file" record per added or modified file."""
+    for diff in diffs:
+        f.write(json.dumps({
+            "type": "root", "root": diff.root_path, "added": len(diff.added), "modified": len(diff.modified),
+            "removed": diff.removed, "unchanged": diff.unchanged,
+            "words_before": diff.words_before, "words_after": diff.words_after,
+        }) + "\n")
+    for diff in diffs:
+        for file_path, change, content in _changed_files(diff):
+            f.write(json.dumps({"type": "file", "root": diff.root_path, "file": file_path,
+                                "change": change, "content": content}) + "\n")
+
+def write_diff_files(diffs: List[RootDiff], config: ScanConfig) -> None:
+    """
+    Write the changes since a manifest to the output file.
+
+    Args:
+        diffs: One RootDiff per scanned root.
+        config: ScanConfig object with the output format and file.
+    """
+    output_file = get_output_path(config)
     
     try:
         with open(output_file, 'w', encoding='utf-8') as f:
             if config.output_format == 'md':
-                write_md_output(f, file_data, config)
+                write_md_diff(f, diffs)
+            elif config.output_format == 'jsonl':
+                write_jsonl_diff(f, diffs)
             else:
-                write_txt_output(f, file_data, config)
+                write_txt_diff(f, diffs)
                 
-        logger.info(f"Analysis file saved: {output_file}")
+        logger.info(f"Diff file saved: {output_file}")
     except Exception as e:
         logger.error(f"Error writing output file: {e}")
         raise
 
+class BlockCache:
+    """
+    Byte-bounded LRU of scanned file blocks for the scan service.
+
+    Each entry carries a stamp, (size, mtime_ns) for files, so lookups can
+    check it against a fresh stat. Entries are evicted least recently used
+    first once their total size passes max_bytes. The generation counter
+    changes on every invalidation, so a block read while it was invalidated
+    is not cached.
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.entries: "collections.OrderedDict[Any, Tuple[Any, Any, int]]" = collections.OrderedDict()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.generation = 0
+        self.lock = threading.Lock()
+
+    def get(self, key: Any, stamp: Any = None) -> Optional[Any]:
+        """Return the cached value, or None if missing or, when stamp is given, stale."""
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None or (stamp is not None and entry[0] != stamp):
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key: Any, stamp: Any, value: Any, size: int, generation: int) -> None:
+        """Cache a value read at the given generation, evicting older entries to stay under max_bytes."""
+        with self.lock:
+            if generation != self.generation or size > self.max_bytes:
+                return
+            self._remove(key)
+            self.entries[key] = (stamp, value, size)
+            self.bytes += size
+            while self.bytes > self.max_bytes:
+                _, (_, _, evicted) = self.entries.popitem(last=False)
+                self.bytes -= evicted
+                self.evictions += 1
+
+    def _remove(self, key: Any) -> None:
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            self.bytes -= entry[2]
+
+    def invalidate(self, path: str, prefix: bool = False) -> None:
+        """Drop the blocks of a file, or with prefix, of everything under a directory."""
+        with self.lock:
+            self.generation += 1
+            if prefix:
+                for key in [k for k in self.entries if k[0].startswith(path + os.sep)]:
+                    self._remove(key)
+            else:
+                for key in [k for k in self.entries if k[0] == path]:
+                    self._remove(key)
+
+    def clear(self) -> None:
+        with self.lock:
+            self.generation += 1
+            self.entries.clear()
+            self.bytes = 0
+
+class InotifyWatcher:
+    """
+    Directory watches through the Linux inotify API, read on a background thread.
+
+    The callback gets (directory, path, is_dir) for each change, with path
+    None when the directory itself went away, and (None, None, False) when
+    the kernel queue overflowed and any change may have been missed.
+    """
+
+    IN_MODIFY = 0x2
+    IN_ATTRIB = 0x4
+    IN_CLOSE_WRITE = 0x8
+    IN_MOVED_FROM = 0x40
+    IN_MOVED_TO = 0x80
+    IN_CREATE = 0x100
+    IN_DELETE = 0x200
+    IN_DELETE_SELF = 0x400
+    IN_MOVE_SELF = 0x800
+    IN_Q_OVERFLOW = 0x4000
+    IN_IGNORED = 0x8000
+    IN_ONLYDIR = 0x01000000
+    IN_ISDIR = 0x40000000
+    WATCH_MASK = (IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE |
+                  IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF | IN_ONLYDIR)
+    EVENT_HEADER = struct.Struct("iIII")
+
+    def __init__(self, callback: Any):
+        self.callback = callback
+        self.dirs: Dict[int, str] = {}
+        self.wds: Dict[str, int] = {}
+        self.lock = threading.Lock()
+        self.libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        self.fd = self.libc.inotify_init1(os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), f"inotify_init1: {os.strerror(ctypes.get_errno())}")
+        threading.Thread(target=self._read_events, name="inotify", daemon=True).start()
+
+    def watch(self, directory: str) -> None:
+        """Watch a directory; raises OSError when the watch limit is reached."""
+        with self.lock:
+            if directory in self.wds:
+                return
+            wd = self.libc.inotify_add_watch(self.fd, os.fsencode(directory), self.WATCH_MASK)
+            if wd < 0:
+                errno = ctypes.get_errno()
+                raise OSError(errno, f"inotify_add_watch {directory}: {os.strerror(errno)}")
+            self.dirs[wd] = directory
+            self.wds[directory] = wd
+
+    def watch_count(self) -> int:
+        return len(self.wds)
+
+    def _read_events(self) -> None:
+        while True:
+            try:
+                data = os.read(self.fd, 64 * 1024)
+            except OSError as e:
+                logger.error(f"Reading inotify events failed, stopping the watcher: {e}")
+                self.callback(None, None, False)
+                return
+            offset = 0
+            while offset < len(data):
+                wd, mask, _, length = self.EVENT_HEADER.unpack_from(data, offset)
+                offset += self.EVENT_HEADER.size
+                name = data[offset:offset + length].rstrip(b"\0")
+                offset += length
+                if mask & self.IN_Q_OVERFLOW:
+                    logger.warning("inotify queue overflowed, dropping all cached state")
+                    self.callback(None, None, False)
+                    continue
+                with self.lock:
+                    directory = self.dirs.get(wd)
+                    if mask & self.IN_IGNORED and directory is not None:
+                        del self.dirs[wd]
+                        self.wds.pop(directory, None)
+                if directory is None:
+                    continue
+                if mask & (self.IN_IGNORED | self.IN_DELETE_SELF | self.IN_MOVE_SELF):
+                    self.callback(directory, None, True)
+                else:
+                    path = os.path.join(directory, os.fsdecode(name)) if name else directory
+                    self.callback(directory, path, bool(mask & self.IN_ISDIR))
+
+@dataclass
+class RootIndex:
+    """The file list and rendered structure of one directory root, as cached by the scan service."""
+    root_path: str
+    files: List[Tuple[str, str, str]] = field(default_factory=list)  # (root_path, rel_path, file_path)
+    structure: str = ""
+    watched: bool = False  # All listed directories are under inotify watches
+    dirty: bool = False  # A change was seen since the index was built
+
+class ScanService:
+    """
+    Long-running scanner that keeps tree indexes and file blocks of registered roots in memory.
+
+    Requests may name any path inside a registered root, after resolving
+    symlinks. File blocks are validated by size and mtime on every request.
+    With inotify, a directory root whose watches saw no change since its
+    index was built is served without walking or stat-ing it again. At most
+    max_indexes indexes are kept, least recently used evicted first.
+    """
+
+    def __init__(self, roots: List[str], cache_bytes: int = SERVE_CACHE_BYTES, use_inotify: bool = True,
+                 max_indexes: int = SERVE_MAX_INDEXES):
+        self.roots = [os.path.realpath(r) for r in roots]
+        self.cache = BlockCache(cache_bytes)
+        self.max_indexes = max_indexes
+        self.indexes: "collections.OrderedDict[Any, RootIndex]" = collections.OrderedDict()
+        self.index_lock = threading.Lock()
+        self.metrics_lock = threading.Lock()
+        self.latencies: "collections.deque[float]" = collections.deque(maxlen=SERVE_LATENCY_SAMPLES)
+        self.requests = 0
+        self.errors = 0
+        self.started = time.monotonic()
+        self.watcher: Optional[InotifyWatcher] = None
+        if use_inotify:
+            try:
+                self.watcher = InotifyWatcher(self._on_change)
+            except (OSError, AttributeError) as e:
+                logger.warning(f"inotify unavailable, validating by mtime only: {e}")
+
+    def _on_change(self, directory: Optional[str], path: Optional[str], is_dir: bool) -> None:
+        if directory is None:
+            self.cache.clear()
+            with self.index_lock:
+                for index in self.indexes.values():
+                    index.dirty = True
+            return
+        changed = path or directory
+        self.cache.invalidate(changed)
+        if is_dir:
+            self.cache.invalidate(changed, prefix=True)
+        with self.index_lock:
+            for index in self.indexes.values():
+                if directory == index.root_path or directory.startswith(index.root_path + os.sep):
+                    index.dirty = True
+
+    def request_config(self, request: Dict[str, Any]) -> ScanConfig:
+        """Build the ScanConfig for a request, refusing paths outside the registered roots."""
+        # Resolve symlinks first, so a link inside a root cannot point the scan outside it
+        paths = [os.path.realpath(p) for p in request.get("paths") or []]
+        if not paths:
+            raise ValueError("request has no paths")
+        for path in paths:
+            if not any(path == root or path.startswith(root + os.sep) for root in self.roots):
+                raise ValueError(f"not under a registered root: {path}")
+            if not os.path.exists(path):
+                raise ValueError(f"path does not exist: {path}")
+        output_format = request.get("format", "txt")
+        if output_format not in ("txt", "md", "jsonl"):
+            raise ValueError(f"unknown format: {output_format}")
+        exclude_dirs, exclude_files = get_default_exclusions()
+        return ScanConfig(
+            paths=paths,
+            exclude_paths=set(os.path.normpath(p) for p in request.get("exclude", [])),
+            exclude_patterns=set(request.get("exclude_patterns", [])),
+            exclude_dirs=exclude_dirs,
+            exclude_files=exclude_files,
+            depth_specs={os.path.realpath(p): int(d) for p, d in (request.get("depth_specs") or {}).items()},
+            output_format=output_format,
+            minify=bool(request.get("minify", False)),
+            collapse_threshold=int(request.get("collapse_threshold", 200)),
+        )
+
+    def _index(self, path: str, config: ScanConfig) -> RootIndex:
+        """Return a current index of a directory root, rebuilding it when needed."""
+        key = (path, config.depth_specs.get(path), tuple(sorted(config.exclude_paths)),
+               tuple(sorted(config.exclude_patterns)), config.collapse_threshold)
+        with self.index_lock:
+            index = self.indexes.get(key)
+            if index is not None and index.watched and not index.dirty:
+                self.indexes.move_to_end(key)
+                return index
+            # Register before walking, so changes during the walk mark it dirty
+            index = RootIndex(path)
+            self.indexes[key] = index
+            self.indexes.move_to_end(key)
+            while len(self.indexes) > self.max_indexes:
+                self.indexes.popitem(last=False)
+        watched = self.watcher is not None
+
+        def watch(directory: str) -> None:
+            # Watch before listing: a change after the listing then always marks the index dirty
+            nonlocal watched
+            if not watched:
+                return
+            try:
+                self.watcher.watch(directory)
+            except OSError as e:
+                logger.warning(f"Falling back to mtime validation for {path}: {e}")
+                watched = False
+
+        tree = TreeNode(os.path.basename(path))
+        files = list(iter_root_files(path, config, watch, tree))
+        structure = render_directory_tree(tree)
+        with self.index_lock:
+            index.files, index.structure, index.watched = files, structure, watched
+        return index
+
+    def _read_block(self, file_path: str, config: ScanConfig, stats: ScanStats, trusted: bool) -> Tuple[str, bool]:
+        """Return a file's processed content and whether it came from the cache."""
+        key = (file_path, config.minify)
+        st = None
+        if not trusted:
+            st = _stat_or_none(file_path)
+            stamp = (st.st_size, st.st_mtime_ns) if st is not None else None
+            content = self.cache.get(key, stamp) if stamp is not None else None
+        else:
+            content = self.cache.get(key)
+        if content is not None:
+            return content, True
+        generation = self.cache.generation
+        if st is None:
+            st = _stat_or_none(file_path)
+        content = read_file(file_path, config, stats)
+        if st is not None:
+            self.cache.put(key, (st.st_size, st.st_mtime_ns), content, len(content.encode("utf-8")), generation)
+        return content, False
+
+    def collect(self, config: ScanConfig) -> Tuple[List[Tuple[str, str, str]], Dict[str, str], Dict[str, int]]:
+        """
+        Gather file data for a request from the cache, reading only what changed.
+
+        Returns:
+            Tuple of (file_data, rendered structures of the roots, per-request counters).
+        """
+        stats = ScanStats()
+        counters = {"hits": 0, "misses": 0}
+        file_data: List[Tuple[str, str, str]] = []
+        structures: Dict[str, str] = {}
+        for path in config.paths:
+            if is_archive(path):
+                st = os.stat(path)
+                key = (path, config.minify, tuple(sorted(config.exclude_paths)),
+                       tuple(sorted(config.exclude_patterns)), config.depth_specs.get(path))
+                generation = self.cache.generation
+                cached = self.cache.get(key, (st.st_size, st.st_mtime_ns))
+                if cached is None:
+                    counters["misses"] += 1
+                    listing: List[Tuple[str, int]] = []
+                    members = scan_archive(path, config, stats, listing=listing)
+                    size = sum(len(content.encode("utf-8")) for _, _, content in members)
+                    self.cache.put(key, (st.st_size, st.st_mtime_ns), (members, listing), size, generation)
+                else:
+                    counters["hits"] += 1
+                    members, listing = cached
+                file_data.extend(members)
+                structures[path] = get_directory_structure(path, config, listing)
+                continue
+            if os.path.isdir(path):
+                index = self._index(path, config)
+                files, trusted = index.files, index.watched and not index.dirty
+                structures[path] = index.structure
+            else:
+                files, trusted = list(iter_root_files(path, config)), False
+            for root_path, rel_path, file_path in files:
+                content, hit = self._read_block(file_path, config, stats, trusted)
+                counters["hits" if hit else "misses"] += 1
+                file_data.append((root_path, rel_path, content))
+        return file_data, structures, counters
+
+    def render(self, request: Dict[str, Any]) -> Tuple[bytes, Dict[str, Any]]:
+        """Render a request in its format, returning the output and the response header."""
+        start = time.monotonic()
+        try:
+            config = self.request_config(request)
+            file_data, structures, counters = self.collect(config)
+            out = io.StringIO()
+            write_output(out, file_data, config, structures)
+            payload = out.getvalue().encode("utf-8")
+        except Exception:
+            with self.metrics_lock:
+                self.requests += 1
+                self.errors += 1
+            raise
+        latency_ms = (time.monotonic() - start) * 1000
+        with self.metrics_lock:
+            self.requests += 1
+            self.latencies.append(latency_ms)
+        header = {"ok": True, "bytes": len(payload), "files": len(file_data),
+                  "latency_ms": round(latency_ms, 3), **counters}
+        logger.info(
+            f"Served {config.output_format} for {len(config.paths)} paths: {len(file_data)} files, "
+            f"{format_size(len(payload))} in {latency_ms:.1f} ms ({counters['hits']} cached, {counters['misses']} read)"
+        )
+        return payload, header
+
+    def metrics(self) -> Dict[str, Any]:
+        """Request latency percentiles and cache counters since start."""
+        with self.metrics_lock:
+            latencies = sorted(self.latencies)
+            requests, errors = self.requests, self.errors
+
+        def pct(p: float) -> Optional[float]:
+            if not latencies:
+                return None
+            return round(latencies[min(len(latencies) - 1, max(0, int(round(p / 100 * len(latencies))) - 1))], 3)
+
+        return {
+            "uptime_s": round(time.monotonic() - self.started, 1),
+            "roots": self.roots,
+            "requests": requests,
+            "errors": errors,
+            "latency_ms": {"p50": pct(50), "p95": pct(95), "p99": pct(99),
+                           "max": round(latencies[-1], 3) if latencies else None,
+                           "samples": len(latencies)},
+            "cache": {"entries": len(self.cache.entries), "bytes": self.cache.bytes, "max_bytes": self.cache.max_bytes,
+                      "hits": self.cache.hits, "misses": self.cache.misses, "evictions": self.cache.evictions},
+            "indexes": len(self.indexes),
+            "inotify_watches": self.watcher.watch_count() if self.watcher is not None else None,
+        }
+
+class ScanRequestHandler(socketserver.StreamRequestHandler):
+    """
+    One request per connection: a JSON line in, a JSON header line and the rendered output back.
+
+    A request is {"paths": [...], "format": "txt"|"md"|"jsonl", "minify": bool,
+    "depth_specs": {...}, "exclude": [...], "exclude_patterns": [...],
+    "collapse_threshold": N}, or {"command": "metrics"}. The header has
+    "ok", and "bytes" of output following it, or "error".
+    """
+
+    def handle(self) -> None:
+        service: ScanService = self.server.service
+        try:
+            request = json.loads(self.rfile.readline())
+            if request.get("command") == "metrics":
+                payload, header = b"", {"ok": True, "bytes": 0, "metrics": service.metrics()}
+            else:
+                payload, header = service.render(request)
+        except Exception as e:
+            logger.error(f"Request failed: {e}")
+            payload, header = b"", {"ok": False, "bytes": 0, "error": str(e)}
+        try:
+            self.wfile.write(json.dumps(header).encode("utf-8") + b"\n" + payload)
+        except OSError as e:
+            logger.debug(f"Client went away: {e}")
+
+class ScanServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, socket_path: str, service: ScanService):
+        super().__init__(socket_path, ScanRequestHandler)
+        self.service = service
+
+def serve(socket_path: str, service: ScanService) -> None:
+    """Serve scan requests on a Unix socket until interrupted or terminated."""
+    if os.path.exists(socket_path):
+        probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            probe.connect(socket_path)
+            raise RuntimeError(f"Another scan service is already listening on {socket_path}")
+        except (ConnectionRefusedError, FileNotFoundError):
+            os.unlink(socket_path)
+        finally:
+            probe.close()
+    server = ScanServer(socket_path, service)
+    signal.signal(signal.SIGTERM, lambda *_: threading.Thread(target=server.shutdown).start())
+    logger.info(f"Scan service listening on {socket_path} for {', '.join(service.roots)}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        os.unlink(socket_path)
+        logger.info(f"Scan service stopped: {json.dumps(service.metrics())}")
+
+def request_scan(socket_path: str, request: Dict[str, Any]) -> Tuple[Dict[str, Any], bytes]:
+    """
+    Send one request to a scan service and return its header and output.
+
+    Raises:
+        RuntimeError: If the service reports an error.
+    """
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.connect(socket_path)
+        sock.sendall(json.dumps(request).encode("utf-8") + b"\n")
+        with sock.makefile("rb") as stream:
+            header = json.loads(stream.readline())
+            payload = stream.read(header.get("bytes", 0))
+    if not header.get("ok"):
+        raise RuntimeError(f"Scan service error: {header.get('error')}")
+    return header, payload
+
+def scan_request(config: ScanConfig) -> Dict[str, Any]:
+    """The scan service request equivalent to scanning with config."""
+    return {
+        "paths": config.paths,
+        "format": config.output_format,
+        "minify": config.minify,
+        "depth_specs": config.depth_specs,
+        "exclude": sorted(config.exclude_paths),
+        "exclude_patterns": sorted(config.exclude_patterns),
+        "collapse_threshold": config.collapse_threshold,
+    }
+
 def get_default_exclusions() -> Tuple[Set[str], Set[str]]:
     """
     Get the default directory and file exclusion patterns.
@@ -471,6 +2288,20 @@ def main():
           
           # Combined example
           python folderscanner.py -p /path/to/src/root+0 /path/to/database /path/to/package.json -o output.md -f md
+          
+          # Strip comments and blank lines from the emitted content
+          python folderscanner.py -p /path/to/project -o analysis.txt --minify
+          
+          # Gentle scan on a live database host (idle I/O class, 2 MB/s, 50 files/s)
+          python folderscanner.py -p /etc/postgresql-custom /etc/pgbouncer -o config.txt --low-impact --max-bytes-per-sec 2M --max-files-per-sec 50
+          
+          # Record a manifest, then later output only what changed since (and move the manifest forward)
+          python folderscanner.py -p /path/to/project -o analysis.txt --write-manifest scan.json
+          python folderscanner.py -p /path/to/project -o changes.txt --diff scan.json --write-manifest scan.json
+          
+          # Keep a checkout indexed in memory and serve renders of it over a Unix socket
+          python folderscanner.py -p /path/to/checkout --serve /run/folderscanner.sock --cache-bytes 512M
+          python folderscanner.py -p /path/to/checkout/src -o analysis.jsonl -f jsonl --socket /run/folderscanner.sock
         ''')
     )
     
@@ -480,14 +2311,40 @@ def main():
                         help='Specific paths to exclude (space-separated)')
     parser.add_argument('-ep', '--exclude-patterns', nargs='+', default=[],
                         help='Patterns to exclude (space-separated)')
-    parser.add_argument('-f', '--format', choices=['txt', 'md'], default='txt',
-                        help='Output format (txt or md)')
+    parser.add_argument('-f', '--format', choices=['txt', 'md', 'jsonl'], default='txt',
+                        help='Output format (txt, md or jsonl)')
     parser.add_argument('-o', '--output', default='scan_output.txt',
                         help='Output file path')
+    parser.add_argument('-m', '--minify', action='store_true',
+                        help='Strip comments and collapse whitespace in Python, shell, YAML, Nix and SQL files')
+    parser.add_argument('--collapse-threshold', type=int, default=200,
+                        help='Summarize directories with more entries than this in the structure tree (0 disables)')
+    parser.add_argument('--low-impact', action='store_true',
+                        help='Lower CPU/I/O priority, drop read files from the page cache and apply rate limits')
+    parser.add_argument('--max-bytes-per-sec', type=parse_rate, default=None,
+                        help=f'Read limit, e.g. 512K or 10M (default: unlimited, {LOW_IMPACT_BYTES_PER_SEC // (1024 * 1024)}M with --low-impact; 0 = unlimited)')
+    parser.add_argument('--max-files-per-sec', type=parse_rate, default=None,
+                        help=f'Limit on files read and directories listed per second (default: unlimited, {LOW_IMPACT_FILES_PER_SEC} with --low-impact; 0 = unlimited)')
+    parser.add_argument('--write-manifest', metavar='MANIFEST',
+                        help='Write a JSON manifest of sizes, mtimes, hashes and word counts of the scanned files')
+    parser.add_argument('--diff', metavar='MANIFEST',
+                        help='Output only files added, modified or removed since MANIFEST, and word count changes per root')
+    parser.add_argument('--serve', metavar='SOCKET',
+                        help='Run as a service on this Unix socket, keeping the given paths indexed and cached in memory')
+    parser.add_argument('--cache-bytes', type=parse_rate, default=SERVE_CACHE_BYTES,
+                        help=f'File block cache size for --serve, e.g. 512M (default: {SERVE_CACHE_BYTES // (1024 * 1024)}M)')
+    parser.add_argument('--no-inotify', action='store_true',
+                        help='In --serve mode, validate cached files by mtime on every request instead of watching them')
+    parser.add_argument('--socket', metavar='SOCKET',
+                        help='Request the scan from a --serve service on this socket instead of scanning here')
     parser.add_argument('-v', '--verbose', action='store_true',
                         help='Enable verbose logging')
     
     args = parser.parse_args()
+    if args.serve and args.socket:
+        parser.error('--serve and --socket cannot be combined')
+    if args.diff and (args.serve or args.socket):
+        parser.error('--diff runs locally and cannot be combined with --serve or --socket')
     
     # Configure logging level based on verbosity
     if args.verbose:
@@ -557,22 +2414,73 @@ def main():
             exclude_files=exclude_files,
             depth_specs=depth_specs,
             output_format=args.format,
-            output_file=args.output
+            output_file=args.output,
+            minify=args.minify,
+            collapse_threshold=args.collapse_threshold
         )
         
+        if args.serve:
+            serve(args.serve, ScanService(valid_paths, int(args.cache_bytes), not args.no_inotify))
+            return
+        
+        if args.socket:
+            header, payload = request_scan(args.socket, scan_request(config))
+            output_file = get_output_path(config)
+            with open(output_file, 'wb') as f:
+                f.write(payload)
+            logger.info(
+                f"Analysis file saved: {output_file} ({header['files']} files, {header['latency_ms']} ms in the service, "
+                f"{header['hits']} cached, {header['misses']} read)"
+            )
+            return
+        
+        if args.low_impact:
+            lower_process_priority()
+        throttle = throttle_from_args(args)
+        
+        stats = ScanStats()
+        if args.diff:
+            # Only read what changed since the manifest
+            diffs, manifest = diff_against_manifest(config, load_manifest(args.diff), stats, throttle)
+            if throttle is not None:
+                logger.info(throttle.report())
+            write_diff_files(diffs, config)
+            for diff in diffs:
+                logger.info(
+                    f"{diff.root_path}: {len(diff.added)} added, {len(diff.modified)} modified, "
+                    f"{len(diff.removed)} removed, {diff.unchanged} unchanged, "
+                    f"words {diff.words_after - diff.words_before:+d}"
+                )
+            logger.info(f"Diff complete. Read {stats.files_read} files.")
+            if args.write_manifest:
+                write_manifest(manifest, args.write_manifest)
+            return
+        
         # Execute the scan
-        file_data = walk_directories(config)
+        structures: Dict[str, str] = {}
+        file_stats: Dict[Tuple[str, str], os.stat_result] = {}
+        file_data = walk_directories(config, stats, throttle, structures, file_stats)
+        if throttle is not None:
+            logger.info(throttle.report())
         
         if not file_data:
             logger.warning("No files were found that match your criteria.")
             return
             
         # Write the output
-        write_analysis_files(file_data, config)
+        write_analysis_files(file_data, config, structures)
+        if args.write_manifest:
+            write_manifest(build_manifest(file_data, config, file_stats), args.write_manifest)
         
         # Print summary
         grand_total_words = sum(count_words(content) for _, _, content in file_data)
         logger.info(f"Analysis complete. Found {len(file_data)} files with {grand_total_words} words in total.")
+        if config.minify and stats.words_before_minify:
+            saved = stats.words_before_minify - stats.words_after_minify
+            logger.info(
+                f"Minification: {stats.words_before_minify} words before, {stats.words_after_minify} after "
+                f"({saved / stats.words_before_minify:.1%} removed)"
+            )
         
     except Exception as e:
         logger.error(f"Error during execution: {e}")
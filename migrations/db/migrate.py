@@ -0,0 +1,229 @@
+#!/usr/bin/env python3
+"""
+Drop-in replacement for the psql path of migrate.sh.
+
+migrate.sh starts a new psql process, and so a new connection, for every
+file. This runner keeps one psql session open per role (postgres for
+init-scripts, capitala_admin for migrations) and feeds the files to it with
+\\i. It runs them in the same order as migrate.sh, with the same
+ON_ERROR_STOP semantics. `DISCARD ALL` between files resets session state,
+so every file starts as if it had its own connection.
+
+Applied files are recorded with their sha256 in
+supabase_migrations.migration_ledger. Files already in the ledger with the
+same checksum are skipped. A file whose checksum changed after it was
+applied is an error. Per-file timings are printed, and written as JSON with
+--timings.
+
+Uses the same environment as migrate.sh:
+    POSTGRES_DB        defaults to postgres
+    POSTGRES_HOST      defaults to localhost
+    POSTGRES_PORT      defaults to 5432
+    POSTGRES_PASSWORD  defaults to ""
+Exit code:
+    0 if migration succeeds, non-zero on error.
+"""
+
+import argparse
+import glob
+import hashlib
+import json
+import os
+import subprocess
+import sys
+import time
+
+DB_DIR = os.path.dirname(os.path.abspath(__file__))
+POSTINIT = "/etc/postgresql.schema.sql"
+
+LEDGER_SQL = """
+create schema if not exists supabase_migrations;
+create table if not exists supabase_migrations.migration_ledger (
+  filename text primary key,
+  checksum text not null,
+  duration_ms numeric not null,
+  applied_at timestamptz not null default now()
+);
+"""
+
+# \\gexec runs the generated statements after the query, so both conditions
+# are evaluated before the role is created
+BOOTSTRAP_SQL = """
+-- postgres role is pre-created during AMI build
+select format('create role postgres superuser login password %L', :'pgpassword')
+  where not exists (select from pg_roles where rolname = 'postgres')
+union all
+select 'alter database postgres owner to postgres'
+  where not exists (select from pg_roles where rolname = 'postgres')
+\\gexec
+"""
+
+
+class MigrationError(Exception):
+    pass
+
+
+def psql_quote(value):
+    """Quote a value for use as a psql meta-command argument."""
+    return "'" + value.replace("\\", "\\\\").replace("'", "\\'") + "'"
+
+
+class PsqlSession:
+    """
+    One long-lived psql process logged in as `role`.
+
+    Commands are written to psql's stdin, followed by an \\echo of a unique
+    marker. Everything psql prints before the marker is the output of those
+    commands. psql runs with ON_ERROR_STOP, so an error makes it exit and
+    the session raises MigrationError.
+    """
+
+    def __init__(self, role, password=""):
+        self.role = role
+        self.counter = 0
+        self.process = subprocess.Popen(
+            [
+                "psql", "-v", "ON_ERROR_STOP=1", "--no-password", "--no-psqlrc",
+                "--quiet", "--no-align", "--tuples-only", "-U", role,
+            ],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            text=True,
+            bufsize=1,
+        )
+        self.set("pgpassword", password)
+
+    def set(self, name, value):
+        self.run(f"\\set {name} {psql_quote(value)}")
+
+    def run(self, commands):
+        """Run psql input and return the lines it printed."""
+        self.counter += 1
+        marker = f"__migrate_done_{os.getpid()}_{self.counter}__"
+        try:
+            self.process.stdin.write(f"{commands}\n\\echo {marker}\n")
+            self.process.stdin.flush()
+        except BrokenPipeError:
+            raise MigrationError(f"psql session for {self.role} exited ({self.process.wait()})")
+
+        lines = []
+        for line in self.process.stdout:
+            line = line.rstrip("\n")
+            if line == marker:
+                return lines
+            lines.append(line)
+        raise MigrationError(f"psql session for {self.role} exited ({self.process.wait()})")
+
+    def close(self):
+        if self.process.poll() is None:
+            self.process.stdin.close()
+            self.process.wait()
+
+
+def checksum(path):
+    with open(path, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def load_ledger(admin):
+    admin.run(LEDGER_SQL)
+    ledger = {}
+    for line in admin.run("select filename, checksum from supabase_migrations.migration_ledger;"):
+        filename, _, digest = line.partition("|")
+        ledger[filename] = digest
+    return ledger
+
+
+def apply_files(session, admin, directory, ledger, timings):
+    """Run every *.sql file in `directory` through `session`, skipping files in the ledger."""
+    for path in sorted(glob.glob(os.path.join(DB_DIR, directory, "*.sql"))):
+        name = os.path.relpath(path, DB_DIR)
+        digest = checksum(path)
+        if name in ledger:
+            if ledger[name] != digest:
+                raise MigrationError(f"{name} changed after it was applied (ledger {ledger[name]}, file {digest})")
+            print(f"{sys.argv[0]}: skipping {path} (already applied)")
+            continue
+
+        print(f"{sys.argv[0]}: running {path}")
+        start = time.monotonic()
+        try:
+            output = session.run(f"\\i {psql_quote(path)}\nDISCARD ALL;")
+        except MigrationError as e:
+            raise MigrationError(f"{name} failed: {e}")
+        elapsed_ms = round((time.monotonic() - start) * 1000, 1)
+        for line in output:
+            print(line)
+
+        admin.set("filename", name)
+        admin.set("checksum", digest)
+        admin.run(
+            "insert into supabase_migrations.migration_ledger (filename, checksum, duration_ms)"
+            f" values (:'filename', :'checksum', {elapsed_ms});"
+        )
+        ledger[name] = digest
+        timings.append({"file": name, "role": session.role, "ms": elapsed_ms})
+
+
+def migrate(password, timings_path=None):
+    timings = []
+    start = time.monotonic()
+    admin = PsqlSession("capitala_admin", password)
+    postgres = None
+    try:
+        admin.run(BOOTSTRAP_SQL)
+        ledger = load_ledger(admin)
+
+        # run init scripts as postgres user
+        postgres = PsqlSession("postgres", password)
+        apply_files(postgres, admin, "init-scripts", ledger, timings)
+        postgres.run("ALTER USER capitala_admin WITH PASSWORD :'pgpassword';")
+        postgres.close()
+
+        # run migrations as super user - postgres user demoted in post-setup
+        apply_files(admin, admin, "migrations", ledger, timings)
+
+        # run any post migration script to update role passwords
+        if os.path.exists(POSTINIT):
+            print(f"{sys.argv[0]}: running {POSTINIT}")
+            for line in admin.run(f"\\i {psql_quote(POSTINIT)}"):
+                print(line)
+
+        # once done with everything, reset stats from init
+        admin.run(
+            "\\set ON_ERROR_STOP 0\n"
+            "SELECT extensions.pg_stat_statements_reset(); SELECT pg_stat_reset();"
+        )
+    finally:
+        admin.close()
+        if postgres is not None:
+            postgres.close()
+
+    total = round(time.monotonic() - start, 3)
+    for entry in sorted(timings, key=lambda t: t["ms"], reverse=True)[:10]:
+        print(f"{sys.argv[0]}: {entry['ms']:>10.1f} ms  {entry['file']}")
+    print(f"{sys.argv[0]}: applied {len(timings)} files in {total}s")
+    if timings_path:
+        with open(timings_path, "w") as f:
+            json.dump({"total_s": total, "files": timings}, f, indent=2)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run init-scripts and migrations over one psql session per role")
+    parser.add_argument("--timings", help="Write per-file timings as JSON to this path")
+    args = parser.parse_args()
+
+    os.environ["PGDATABASE"] = os.environ.get("POSTGRES_DB", "postgres")
+    os.environ["PGHOST"] = os.environ.get("POSTGRES_HOST", "localhost")
+    os.environ["PGPORT"] = os.environ.get("POSTGRES_PORT", "5432")
+    os.environ["PGPASSWORD"] = os.environ.get("POSTGRES_PASSWORD", "")
+
+    try:
+        migrate(os.environ["PGPASSWORD"], args.timings)
+    except MigrationError as e:
+        print(f"{sys.argv[0]}: {e}", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -9,6 +9,8 @@ set -eu
 #   POSTGRES_PORT      defaults to 5432
 #   POSTGRES_PASSWORD  defaults to ""
 #   USE_DBMATE         defaults to ""
+#   USE_MIGRATE_PY     defaults to ""; if set, run migrate.py, which reuses
+#                      one connection per role and skips applied files
 # Exit code:
 #   0 if migration succeeds, non-zero on error.
 #######################################
@@ -27,6 +29,9 @@ if [ "$#" -ne 0 ]; then
 fi
 
 db=$( cd -- "$( dirname -- "$0" )" > /dev/null 2>&1 && pwd )
+if [ -n "${USE_MIGRATE_PY:-}" ] && [ -z "${USE_DBMATE:-}" ]; then
+    exec python3 "$db/migrate.py"
+fi
 if [ -z "${USE_DBMATE:-}" ]; then
     psql -v ON_ERROR_STOP=1 --no-password --no-psqlrc -U capitala_admin <<EOSQL
 do \$\$
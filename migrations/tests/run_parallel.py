@@ -0,0 +1,291 @@
+#!/usr/bin/env python3
+"""
+Run the migration test suite concurrently, one cloned database per test file.
+
+test.sql runs every extension test and then the database and storage pgTAP
+tests one after another through a single pg_prove session. This
+orchestrator does the same work in parallel:
+
+1. Apply the test.sql prelude (OrioleDB) to the already migrated source
+   database, then snapshot it as a template database.
+2. Run each unit concurrently in its own `CREATE DATABASE ... TEMPLATE`
+   clone. A unit is either one extensions/NN-*.sql file, or database/ or
+   storage/ wrapped in pgTAP with fixtures.sql, the same way test.sql
+   wraps them.
+3. Drop the clones and the template, then report TAP on stdout, JUnit XML
+   with --junit, and per-file timings.
+
+Some units cannot run in a clone. pg_cron only allows its extension in
+cron.database_name, for example. Those units run against the source
+database itself, which is safe because every extension test rolls back.
+
+Connection options follow psql (-h/-p/-U/-d or the PG* environment).
+"""
+
+import argparse
+import os
+import re
+import subprocess
+import sys
+import time
+import uuid
+import xml.etree.ElementTree as ET
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import List, Optional
+
+TESTS_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# the statements test.sql runs before the extension tests
+PRELUDE_SQL = """
+DO $$
+BEGIN
+    IF EXISTS (SELECT 1 FROM pg_available_extensions WHERE name = 'orioledb') THEN
+        IF NOT EXISTS (SELECT 1 FROM pg_extension WHERE extname = 'orioledb') THEN
+            CREATE EXTENSION orioledb;
+        END IF;
+    END IF;
+END $$;
+"""
+
+PGTAP_WRAPPER = """
+BEGIN;
+CREATE EXTENSION IF NOT EXISTS pgtap;
+SELECT no_plan();
+\\ir fixtures.sql
+\\ir {suite}/test.sql
+SELECT * FROM finish();
+ROLLBACK;
+"""
+
+# units that must run in the source database rather than a clone
+RUN_IN_SOURCE = ["extensions/04-pg_cron.sql"]
+
+TAP_RESULT_RE = re.compile(r"^(not )?ok\b")
+
+
+@dataclass
+class Unit:
+    name: str
+    sql: str
+    tap: bool
+    in_source: bool = False
+
+
+@dataclass
+class Result:
+    unit: Unit
+    passed: bool
+    seconds: float
+    output: str
+    tests: int = 0
+    failures: List[str] = field(default_factory=list)
+
+
+def discover_units(in_source: List[str]) -> List[Unit]:
+    """Extension files enabled in extensions/test.sql, then the pgTAP suites."""
+    units = []
+    with open(os.path.join(TESTS_DIR, "extensions", "test.sql")) as f:
+        for line in f:
+            match = re.match(r"^\\ir (\S+)", line.strip())
+            if match:
+                name = f"extensions/{match.group(1)}"
+                units.append(Unit(name, f"\\ir {name}\n", tap=False, in_source=name in in_source))
+    for suite in ("database", "storage"):
+        name = f"{suite}/test.sql"
+        units.append(Unit(name, PGTAP_WRAPPER.format(suite=suite), tap=True, in_source=name in in_source))
+    return units
+
+
+class Cluster:
+    """psql invocations against one server."""
+
+    def __init__(self, host: Optional[str], port: Optional[str], user: Optional[str]):
+        self.args = []
+        if host:
+            self.args += ["-h", host]
+        if port:
+            self.args += ["-p", str(port)]
+        if user:
+            self.args += ["-U", user]
+
+    def psql(self, dbname: str, sql: str, check: bool = True) -> subprocess.CompletedProcess:
+        # the same flags pg_prove uses
+        proc = subprocess.run(
+            [
+                "psql", *self.args, "-d", dbname, "--no-psqlrc", "--no-align", "--quiet",
+                "--pset", "pager=off", "--pset", "tuples_only=true", "--set", "ON_ERROR_STOP=1",
+            ],
+            input=sql,
+            capture_output=True,
+            text=True,
+            cwd=TESTS_DIR,
+        )
+        if check and proc.returncode != 0:
+            raise RuntimeError(f"psql -d {dbname} failed: {proc.stderr.strip()}")
+        return proc
+
+
+def quote_ident(name: str) -> str:
+    return '"' + name.replace('"', '""') + '"'
+
+
+def quote_literal(value: str) -> str:
+    return "'" + value.replace("'", "''") + "'"
+
+
+def create_template(cluster: Cluster, source: str, template: str, attempts: int = 5):
+    """
+    Snapshot `source` as `template`.
+
+    CREATE DATABASE ... TEMPLATE needs the source to have no other sessions,
+    but background workers such as pg_cron's launcher stay connected. So
+    new connections are refused while the snapshot is taken, and the
+    remaining sessions are terminated.
+    """
+    src, tpl = quote_ident(source), quote_ident(template)
+    try:
+        cluster.psql("template1", f"ALTER DATABASE {src} WITH ALLOW_CONNECTIONS false;")
+        for attempt in range(attempts):
+            proc = cluster.psql(
+                "template1",
+                f"SELECT pg_terminate_backend(pid) FROM pg_stat_activity"
+                f" WHERE datname = {quote_literal(source)} AND pid <> pg_backend_pid();\n"
+                f"CREATE DATABASE {tpl} TEMPLATE {src};",
+                check=False,
+            )
+            if proc.returncode == 0:
+                break
+            if attempt == attempts - 1:
+                raise RuntimeError(f"could not snapshot {source}: {proc.stderr.strip()}")
+            time.sleep(1)
+    finally:
+        cluster.psql("template1", f"ALTER DATABASE {src} WITH ALLOW_CONNECTIONS true;")
+    # nothing may connect to the template while clones are being created from it
+    cluster.psql(
+        "template1",
+        f"ALTER DATABASE {tpl} WITH IS_TEMPLATE true ALLOW_CONNECTIONS false;",
+    )
+
+
+def drop_database(cluster: Cluster, name: str, is_template: bool = False):
+    sql = ""
+    if is_template:
+        sql += f"ALTER DATABASE {quote_ident(name)} WITH IS_TEMPLATE false;\n"
+    sql += f"DROP DATABASE IF EXISTS {quote_ident(name)} WITH (FORCE);"
+    cluster.psql("template1", sql, check=False)
+
+
+def evaluate(unit: Unit, proc: subprocess.CompletedProcess, seconds: float) -> Result:
+    output = proc.stdout + proc.stderr
+    failures = []
+    tests = 0
+    if unit.tap:
+        for line in proc.stdout.splitlines():
+            if TAP_RESULT_RE.match(line):
+                tests += 1
+                if line.startswith("not ok"):
+                    failures.append(line)
+        if tests == 0 and proc.returncode == 0:
+            failures.append("no TAP results")
+    if proc.returncode != 0:
+        failures.append(f"psql exited with {proc.returncode}: {proc.stderr.strip()}")
+    return Result(unit, not failures, seconds, output, tests, failures)
+
+
+def run_unit(cluster: Cluster, unit: Unit, source: str, template: str, prefix: str) -> Result:
+    start = time.monotonic()
+    if unit.in_source:
+        proc = cluster.psql(source, unit.sql, check=False)
+        return evaluate(unit, proc, time.monotonic() - start)
+
+    clone = f"{prefix}_{re.sub(r'[^a-z0-9]+', '_', unit.name.lower())}"[:63]
+    try:
+        cluster.psql("template1", f"CREATE DATABASE {quote_ident(clone)} TEMPLATE {quote_ident(template)};")
+        proc = cluster.psql(clone, unit.sql, check=False)
+    finally:
+        drop_database(cluster, clone)
+    return evaluate(unit, proc, time.monotonic() - start)
+
+
+def write_tap(results: List[Result], stream):
+    stream.write(f"1..{len(results)}\n")
+    for n, result in enumerate(results, 1):
+        status = "ok" if result.passed else "not ok"
+        stream.write(f"{status} {n} - {result.unit.name} ({result.seconds:.2f}s)\n")
+        for failure in result.failures:
+            for line in failure.splitlines():
+                stream.write(f"#   {line}\n")
+
+
+def write_junit(results: List[Result], path: str, elapsed: float):
+    suite = ET.Element(
+        "testsuite",
+        name="migrations",
+        tests=str(len(results)),
+        failures=str(sum(not r.passed for r in results)),
+        time=f"{elapsed:.3f}",
+    )
+    for result in results:
+        case = ET.SubElement(
+            suite,
+            "testcase",
+            classname=os.path.dirname(result.unit.name),
+            name=result.unit.name,
+            time=f"{result.seconds:.3f}",
+        )
+        if not result.passed:
+            failure = ET.SubElement(case, "failure", message="; ".join(result.failures)[:500])
+            failure.text = result.output
+        ET.SubElement(case, "system-out").text = result.output
+    ET.ElementTree(suite).write(path, encoding="utf-8", xml_declaration=True)
+
+
+def main():
+    # -h is the host, as for psql and pg_prove
+    parser = argparse.ArgumentParser(
+        description="Run migrations/tests in parallel template-database clones", add_help=False
+    )
+    parser.add_argument("-h", "--host", default=os.environ.get("PGHOST"))
+    parser.add_argument("-p", "--port", default=os.environ.get("PGPORT"))
+    parser.add_argument("-U", "--username", default=os.environ.get("PGUSER", "capitala_admin"))
+    parser.add_argument("-d", "--dbname", default=os.environ.get("PGDATABASE", "postgres"),
+                        help="Migrated database to snapshot")
+    parser.add_argument("-j", "--jobs", type=int, default=os.cpu_count() or 4)
+    parser.add_argument("--junit", help="Write JUnit XML to this path")
+    parser.add_argument("--in-source", action="append", default=None,
+                        help=f"Run this unit in the source database (default: {', '.join(RUN_IN_SOURCE)})")
+    parser.add_argument("--help", action="help", help="Show this help message and exit")
+    args = parser.parse_args()
+
+    cluster = Cluster(args.host, args.port, args.username)
+    units = discover_units(args.in_source if args.in_source is not None else RUN_IN_SOURCE)
+    prefix = f"pgtap_{uuid.uuid4().hex[:8]}"
+    template = f"{prefix}_template"
+
+    start = time.monotonic()
+    cluster.psql(args.dbname, PRELUDE_SQL)
+    create_template(cluster, args.dbname, template)
+    snapshot_seconds = time.monotonic() - start
+    try:
+        with ThreadPoolExecutor(max_workers=args.jobs) as pool:
+            results = list(
+                pool.map(lambda unit: run_unit(cluster, unit, args.dbname, template, prefix), units)
+            )
+    finally:
+        drop_database(cluster, template, is_template=True)
+    elapsed = time.monotonic() - start
+
+    write_tap(results, sys.stdout)
+    serial = sum(r.seconds for r in results)
+    sys.stdout.write(
+        f"# snapshot {snapshot_seconds:.2f}s, {len(results)} units in {elapsed:.2f}s wall"
+        f" ({serial:.2f}s summed over units, {args.jobs} jobs)\n"
+    )
+    if args.junit:
+        write_junit(results, args.junit, elapsed)
+    sys.exit(0 if all(r.passed for r in results) else 1)
+
+
+if __name__ == "__main__":
+    main()
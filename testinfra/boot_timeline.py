@@ -0,0 +1,154 @@
+"""
+Boot timeline for the AMI test instance.
+
+The `host` fixture marks milestones as the instance comes up: instance
+running, public IP assigned, port 22 open, SSH usable, and each health
+check turning green. It also attaches `systemd-analyze` output from the
+host. The timeline is written as a JSON artefact and compared against a
+stored baseline, so boot-time regressions in the image show up in CI.
+"""
+
+import json
+import re
+import time
+from datetime import datetime, timezone
+from typing import Dict, List, Optional
+
+TIMELINE_VERSION = 1
+
+# systemd-analyze prints spans such as "1min 2.345s", "850ms" or "1h 2min"
+DURATION_UNITS = {
+    "us": 1e-6,
+    "ms": 1e-3,
+    "s": 1.0,
+    "min": 60.0,
+    "h": 3600.0,
+}
+DURATION_TOKEN_RE = re.compile(r"^(\d+(?:\.\d+)?)(us|ms|s|min|h)$")
+SPAN = r"[\d.]+(?:us|ms|s|min|h)(?: [\d.]+(?:us|ms|s|min|h))*"
+STARTUP_PHASE_RE = re.compile(rf"({SPAN}) \((\w+)\)")
+STARTUP_TOTAL_RE = re.compile(rf"= ({SPAN})\s*$", re.MULTILINE)
+
+
+def parse_duration(text: str) -> Optional[float]:
+    """Convert a systemd time span like "1min 2.345s" to seconds, or None."""
+    total = 0.0
+    tokens = text.split()
+    if not tokens:
+        return None
+    for token in tokens:
+        match = DURATION_TOKEN_RE.match(token)
+        if not match:
+            return None
+        total += float(match.group(1)) * DURATION_UNITS[match.group(2)]
+    return total
+
+
+def parse_blame(output: str) -> List[Dict[str, float]]:
+    """Parse `systemd-analyze blame` into [{unit, seconds}], slowest first."""
+    units = []
+    for line in output.splitlines():
+        parts = line.split()
+        if len(parts) < 2:
+            continue
+        seconds = parse_duration(" ".join(parts[:-1]))
+        if seconds is not None:
+            units.append({"unit": parts[-1], "seconds": round(seconds, 3)})
+    return units
+
+
+def parse_startup_time(output: str) -> Dict[str, float]:
+    """
+    Parse `systemd-analyze time` into phase -> seconds.
+
+    "Startup finished in 2.1s (kernel) + 20.4s (userspace) = 22.5s" becomes
+    {"kernel": 2.1, "userspace": 20.4, "total": 22.5}.
+    """
+    phases = {}
+    for span, phase in STARTUP_PHASE_RE.findall(output):
+        phases[phase] = round(parse_duration(span), 3)
+    total = STARTUP_TOTAL_RE.search(output)
+    if total:
+        phases["total"] = round(parse_duration(total.group(1)), 3)
+    return phases
+
+
+class BootTimeline:
+    """
+    Milestones in seconds since the timeline was created.
+
+    Args:
+        clock: Monotonic clock, injectable for tests.
+    """
+
+    def __init__(self, clock=time.monotonic):
+        self.clock = clock
+        self.start = clock()
+        self.started_at = datetime.now(timezone.utc).isoformat()
+        self.events: Dict[str, float] = {}
+        self.systemd: Dict[str, object] = {}
+
+    def mark(self, event: str) -> float:
+        """Record the first time `event` happened; later marks are ignored."""
+        if event not in self.events:
+            self.events[event] = round(self.clock() - self.start, 3)
+        return self.events[event]
+
+    def attach_systemd_analyze(self, time_output: str, blame_output: str, critical_chain: str):
+        self.systemd = {
+            "startup": parse_startup_time(time_output),
+            "blame": parse_blame(blame_output),
+            "critical_chain": critical_chain.splitlines(),
+        }
+
+    def to_dict(self) -> dict:
+        return {
+            "version": TIMELINE_VERSION,
+            "started_at": self.started_at,
+            "events": self.events,
+            "systemd": self.systemd,
+        }
+
+    def write(self, path: str):
+        with open(path, "w") as f:
+            json.dump(self.to_dict(), f, indent=2)
+            f.write("\n")
+
+
+def compare_timelines(
+    current: dict,
+    baseline: dict,
+    tolerance: float = 0.25,
+    min_delta: float = 10.0,
+) -> List[Dict[str, object]]:
+    """
+    List the milestones that got slower than the baseline.
+
+    A milestone regresses when it is more than `tolerance` (a fraction) and
+    more than `min_delta` seconds slower than the baseline. The absolute floor
+    keeps noise on fast milestones from being reported. systemd startup
+    phases are compared the same way. Milestones missing from the current
+    timeline are reported with `current` set to None.
+
+    Returns:
+        [{name, baseline, current, delta}] sorted by name.
+    """
+    regressions = []
+
+    def check(name, expected, actual):
+        if actual is None:
+            regressions.append({"name": name, "baseline": expected, "current": None, "delta": None})
+            return
+        delta = actual - expected
+        if delta > min_delta and delta > expected * tolerance:
+            regressions.append({"name": name, "baseline": expected, "current": actual, "delta": round(delta, 3)})
+
+    for name, expected in baseline.get("events", {}).items():
+        check(name, expected, current.get("events", {}).get(name))
+
+    current_startup = current.get("systemd", {}).get("startup", {})
+    for phase, expected in baseline.get("systemd", {}).get("startup", {}).items():
+        if current_startup:
+            check(f"systemd:{phase}", expected, current_startup.get(phase))
+
+    return sorted(regressions, key=lambda r: r["name"])
@@ -0,0 +1,106 @@
+"""
+Replay benchmark for ansible/files/admin_api_scripts/pg_egress_collect.pl.
+
+The synthetic captures in fixtures/pg_egress_collect exist both as pcap and
+in the `tcpdump -nn -tt -vv` text format the collector parses by default; see
+generate.py there. This script
+repeats a capture until it holds --packets records, replays it through the
+collector in text mode and in --pcap mode, and prints the throughput of
+each and the speedup:
+
+    python3 testinfra/egress_replay_bench.py --capture ethernet_ipv4 --packets 500000
+
+Only the collector is measured. On an instance, the text mode also pays for
+tcpdump formatting every packet with -vv, which this leaves out.
+"""
+
+import argparse
+import json
+import os
+import re
+import struct
+import subprocess
+import tempfile
+import time
+from typing import Dict
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+COLLECTOR = os.path.join(REPO_ROOT, "ansible", "files", "admin_api_scripts", "pg_egress_collect.pl")
+FIXTURES = os.path.join(REPO_ROOT, "testinfra", "fixtures", "pg_egress_collect")
+
+REPLAYED_RE = re.compile(r"replayed (\d+) packets, (\d+) bytes of egress in ([\d.]+)s")
+
+
+def pcap_records(data: bytes):
+    """Split a pcap file into its 24 byte header and its records."""
+    order = "<" if struct.unpack("<I", data[:4])[0] in (0xA1B2C3D4, 0xA1B23C4D) else ">"
+    header, offset, records = data[:24], 24, []
+    while offset + 16 <= len(data):
+        captured = struct.unpack(order + "I", data[offset + 8:offset + 12])[0]
+        records.append(data[offset:offset + 16 + captured])
+        offset += 16 + captured
+    return header, records
+
+
+def text_records(text: str):
+    """Split tcpdump -vv text into one chunk per packet (IPv4 packets take two lines)."""
+    return re.findall(r"^\d.*\n(?:    .*\n)?", text, re.MULTILINE)
+
+
+def build_inputs(capture: str, packets: int, directory: str) -> Dict[str, str]:
+    with open(os.path.join(FIXTURES, f"{capture}.pcap"), "rb") as f:
+        header, records = pcap_records(f.read())
+    with open(os.path.join(FIXTURES, f"{capture}.txt")) as f:
+        lines = text_records(f.read())
+
+    paths = {"pcap": os.path.join(directory, "replay.pcap"), "text": os.path.join(directory, "replay.txt")}
+    with open(paths["pcap"], "wb") as f:
+        f.write(header)
+        for n in range(packets):
+            f.write(records[n % len(records)])
+    with open(paths["text"], "w") as f:
+        for n in range(packets):
+            f.write(lines[n % len(lines)])
+    return paths
+
+
+def replay(path: str, pcap: bool, directory: str, records: int) -> Dict[str, float]:
+    command = ["perl", COLLECTOR, "--replay", path, "-o", os.path.join(directory, "egress.txt"),
+               "--json-output", os.path.join(directory, "egress.json")]
+    if pcap:
+        command.append("--pcap")
+    start = time.monotonic()
+    proc = subprocess.run(command, capture_output=True, text=True, check=True)
+    wall = time.monotonic() - start
+    match = REPLAYED_RE.search(proc.stderr)
+    packets, egress, seconds = int(match.group(1)), int(match.group(2)), float(match.group(3))
+    # records, not accounted packets: the pcap also holds packets the collector skips
+    return {
+        "records": records,
+        "accounted_packets": packets,
+        "egress_bytes": egress,
+        "parse_s": round(seconds, 3),
+        "wall_s": round(wall, 3),
+        "records_per_s": round(records / seconds) if seconds else None,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay the fixture captures through pg_egress_collect.pl")
+    parser.add_argument("--capture", default="ethernet_ipv4", help="Fixture name in fixtures/pg_egress_collect")
+    parser.add_argument("--packets", type=int, default=200000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        inputs = build_inputs(args.capture, args.packets, directory)
+        report = {
+            "capture": args.capture,
+            "text": replay(inputs["text"], False, directory, args.packets),
+            "pcap": replay(inputs["pcap"], True, directory, args.packets),
+        }
+    report["speedup"] = round(report["text"]["parse_s"] / report["pcap"]["parse_s"], 2) if report["pcap"]["parse_s"] else None
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
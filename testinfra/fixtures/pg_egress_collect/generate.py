@@ -0,0 +1,171 @@
+"""
+Regenerate the pg_egress_collect pcap fixtures and their expected counters.
+
+The captures are synthetic but shaped like what `tcpdump -s 128 -Q out`
+records on an instance: outgoing TCP segments from 5432 and 6543 to a
+handful of clients, cut at the 128 byte snap length. They also include
+VLAN tags, a Linux cooked capture with IPv6, and packets the collector must
+skip. The expected counters are computed here from the same packet list,
+independently of the Perl decoder. Each capture also gets a .txt rendition
+written in the `tcpdump -nn -tt -vv` format that the text mode parses.
+
+Neither file was recorded by tcpdump, so replaying them checks each mode's
+decoder against these counters, not against real tcpdump output.
+
+    python3 testinfra/fixtures/pg_egress_collect/generate.py
+"""
+
+import ipaddress
+import json
+import os
+import random
+import struct
+
+FIXTURES = os.path.dirname(os.path.abspath(__file__))
+SNAPLEN = 128
+LOCAL_V4 = "10.112.101.122"
+LOCAL_V6 = "2406:da18:4fd:9b00:959:c52:ce68:10c8"
+REMOTES_V4 = ["220.235.16.223", "54.12.33.1", "3.104.88.17", "10.112.4.9"]
+REMOTES_V6 = ["2406:da12:d78:f501:1273:296c:2482:c7a7", "2600:1f18:abc::5"]
+
+
+def tcp_header(src_port, dst_port, options=12):
+    # data offset counts 32-bit words, including the options (e.g. timestamps)
+    offset = (20 + options) // 4
+    return struct.pack("!HHIIBBHHH", src_port, dst_port, 1, 1, offset << 4, 0x18, 490, 0, 0) + b"\x01" * options
+
+
+def ipv4(src, dst, payload, protocol=6):
+    header = struct.pack(
+        "!BBHHHBBH4s4s", 0x45, 0, 20 + len(payload), 0, 0x4000, 64, protocol, 0,
+        ipaddress.ip_address(src).packed, ipaddress.ip_address(dst).packed,
+    )
+    return header + payload
+
+
+def ipv6(src, dst, payload, next_header=6):
+    header = struct.pack("!IHBB", 0x60000000, len(payload), next_header, 64)
+    return header + ipaddress.ip_address(src).packed + ipaddress.ip_address(dst).packed + payload
+
+
+def ethernet(packet, ethertype, vlan=None):
+    header = b"\x02" * 6 + b"\x04" * 6
+    if vlan is not None:
+        header += struct.pack("!HH", 0x8100, vlan)
+    return header + struct.pack("!H", ethertype) + packet
+
+
+def linux_sll(packet, ethertype):
+    return struct.pack("!HHH8sH", 4, 1, 6, b"\x04" * 8, ethertype) + packet
+
+
+def write_pcap(path, linktype, frames, big_endian=False, nanoseconds=False):
+    order = ">" if big_endian else "<"
+    magic = 0xA1B23C4D if nanoseconds else 0xA1B2C3D4
+    with open(path, "wb") as f:
+        f.write(struct.pack(order + "IHHiIII", magic, 2, 4, 0, 0, SNAPLEN, linktype))
+        for n, frame in enumerate(frames):
+            captured = frame[:SNAPLEN]
+            f.write(struct.pack(order + "IIII", 1706483718 + n // 100, (n % 100) * 1000, len(captured), len(frame)))
+            f.write(captured)
+
+
+class Expected:
+    def __init__(self):
+        self.doc = {"bytes": 0, "packets": 0, "undecoded_packets": 0, "ports": {}, "remotes": {}}
+
+    def add(self, port, remote, length):
+        self.doc["bytes"] += length
+        self.doc["packets"] += 1
+        for table, key in (("ports", str(port)), ("remotes", remote)):
+            counter = self.doc[table].setdefault(key, {"bytes": 0, "packets": 0})
+            counter["bytes"] += length
+            counter["packets"] += 1
+
+    def skip(self):
+        self.doc["undecoded_packets"] += 1
+
+
+def tcpdump_text(n, src, dst, port, remote_port, length):
+    """The line(s) `tcpdump -nn -tt -vv` prints for an outgoing segment."""
+    timestamp = f"{1706483718 + n // 100}.{(n % 100) * 1000:06d}"
+    flags = f"Flags [P.], seq 1:{length + 1}, ack 1, win 490, options [nop,nop,TS val 1026340732 ecr 1935666426], length {length}"
+    if ":" in src:
+        return (
+            f"{timestamp} IP6 (flowlabel 0x0bf27, hlim 64, next-header TCP (6) payload length: {length + 32})"
+            f" {src}.{port} > {dst}.{remote_port}: {flags}\n"
+        )
+    return (
+        f"{timestamp} IP (tos 0x0, ttl 64, id 0, offset 0, flags [DF], proto TCP (6), length {length + 52})\n"
+        f"    {src}.{port} > {dst}.{remote_port}: {flags}\n"
+    )
+
+
+def segment(rng, expected, text, src, dst, ports, build):
+    port = rng.choice(ports)
+    remote_port = rng.randint(30000, 65000)
+    length = rng.choice([0, 0, 5, 93, 119, 469, 1448, 8948])
+    options = rng.choice([0, 12])
+    frame = build(tcp_header(port, remote_port, options) + b"\x00" * length)
+    expected.add(port, dst, length)
+    text.append(tcpdump_text(len(text), src, dst, port, remote_port, length))
+    return frame
+
+
+def ethernet_ipv4(rng):
+    expected = Expected()
+    frames, text = [], []
+    for n in range(400):
+        remote = rng.choice(REMOTES_V4)
+        vlan = 12 if n % 10 == 0 else None
+        frames.append(segment(
+            rng, expected, text, LOCAL_V4, remote, [5432, 6543],
+            lambda tcp: ethernet(ipv4(LOCAL_V4, remote, tcp), 0x0800, vlan),
+        ))
+        if n % 50 == 0:
+            # a UDP datagram and an ARP frame that the capture filter would normally drop
+            frames.append(ethernet(ipv4(LOCAL_V4, remote, b"\x00" * 40, protocol=17), 0x0800))
+            expected.skip()
+            frames.append(ethernet(b"\x00" * 28, 0x0806))
+            expected.skip()
+    return frames, text, expected.doc
+
+
+def sll_mixed(rng):
+    expected = Expected()
+    frames, text = [], []
+    for n in range(300):
+        if n % 3:
+            remote = rng.choice(REMOTES_V6)
+            frames.append(segment(
+                rng, expected, text, LOCAL_V6, remote, [5432, 6543],
+                lambda tcp: linux_sll(ipv6(LOCAL_V6, remote, tcp), 0x86DD),
+            ))
+        else:
+            remote = rng.choice(REMOTES_V4)
+            frames.append(segment(
+                rng, expected, text, LOCAL_V4, remote, [6543],
+                lambda tcp: linux_sll(ipv4(LOCAL_V4, remote, tcp), 0x0800),
+            ))
+    return frames, text, expected.doc
+
+
+def main():
+    rng = random.Random(5432)
+    expected = {}
+    for name, build, linktype, options in (
+        ("ethernet_ipv4", ethernet_ipv4, 1, {}),
+        ("sll_mixed", sll_mixed, 113, {"big_endian": True, "nanoseconds": True}),
+    ):
+        frames, text, expected[name] = build(rng)
+        write_pcap(os.path.join(FIXTURES, f"{name}.pcap"), linktype, frames, **options)
+        # the capture filter drops the packets the decoder has to skip, so they have no text
+        with open(os.path.join(FIXTURES, f"{name}.txt"), "w") as f:
+            f.writelines(text)
+    with open(os.path.join(FIXTURES, "expected.json"), "w") as f:
+        json.dump(expected, f, indent=2, sort_keys=True)
+        f.write("\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,292 @@
+"""
+Per-service memory and CPU footprint of the image's service stack.
+
+A small sampler program reads each systemd unit's cgroup v2 files while the
+host is idle and again while it is under load:
+
+    memory.current   sampled every interval: max, mean and last value
+    memory.peak      the unit's lifetime peak, where the kernel has it (5.19+)
+    memory.stat      anon and file at the end of the phase
+    cpu.stat         usage_usec over the phase, as percent of one CPU
+
+The sampler only needs the system python3, so it runs the same way on the
+test host over ssh (like remote_batch.py) or locally:
+
+    python3 testinfra/footprint.py --idle 60 --load 60 \
+        --load-command 'pgbench -c 16 -T 60 -S postgres' -o footprint.json
+
+The report is compared against a baseline with compare_footprints().
+test_ami_nix.py takes the same measurements when FOOTPRINT_DURATION is set,
+driving the load phase through http_bench.py.
+"""
+
+import argparse
+import base64
+import json
+import shlex
+import subprocess
+import sys
+import threading
+from typing import Callable, Dict, List, Optional
+
+# postgres is the postgresql unit; pg_egress_collect and the exporters are left out
+SERVICES = [
+    "postgresql",
+    "pgbouncer",
+    "postgrest",
+    "gotrue",
+    "kong",
+    "envoy",
+    "nginx",
+    "vector",
+    "adminapi",
+    "fail2ban",
+]
+
+# Runs on the host being measured. It only uses the standard library of the system python3.
+SAMPLER = r"""
+import base64, json, os, subprocess, sys, time
+
+spec = json.loads(base64.b64decode(sys.argv[1]))
+root = spec.get("root", "/sys/fs/cgroup")
+
+def read(path):
+    try:
+        with open(path) as f:
+            return f.read()
+    except OSError:
+        return None
+
+def stat(text):
+    return {k: int(v) for k, v in (line.split() for line in (text or "").splitlines())}
+
+if not os.path.exists(os.path.join(root, "cgroup.controllers")):
+    sys.exit("cgroup v2 is not mounted at " + root)
+
+cgroups = spec.get("cgroups") or {}
+for unit in spec["units"]:
+    if unit not in cgroups:
+        proc = subprocess.run(["systemctl", "show", "-p", "ControlGroup", "--value", unit],
+                              stdout=subprocess.PIPE, universal_newlines=True)
+        cgroups[unit] = proc.stdout.strip()
+
+units = {}
+for unit in spec["units"]:
+    path = os.path.join(root, cgroups[unit].lstrip("/")) if cgroups[unit] else None
+    if path and read(os.path.join(path, "memory.current")) is not None:
+        units[unit] = {"path": path, "samples": [], "cpu": stat(read(os.path.join(path, "cpu.stat")))}
+
+start = time.monotonic()
+deadline = start + spec["duration"]
+while True:
+    for unit in units.values():
+        value = read(os.path.join(unit["path"], "memory.current"))
+        if value is not None:
+            unit["samples"].append(int(value))
+    now = time.monotonic()
+    if now >= deadline:
+        break
+    time.sleep(min(spec["interval"], deadline - now))
+elapsed = time.monotonic() - start
+
+report = {}
+for name in spec["units"]:
+    unit = units.get(name)
+    if unit is None:
+        report[name] = {"error": "not running" if not cgroups[name] else "no cgroup v2 memory accounting"}
+        continue
+    samples = unit["samples"] or [0]
+    cpu = stat(read(os.path.join(unit["path"], "cpu.stat")))
+    memory = stat(read(os.path.join(unit["path"], "memory.stat")))
+    peak = read(os.path.join(unit["path"], "memory.peak"))
+    usage = cpu.get("usage_usec", 0) - unit["cpu"].get("usage_usec", 0)
+    report[name] = {
+        "cgroup": cgroups[name],
+        "memory_current_max": max(samples),
+        "memory_current_mean": sum(samples) // len(samples),
+        "memory_current_last": samples[-1],
+        "memory_peak": int(peak) if peak else None,
+        "anon": memory.get("anon"),
+        "file": memory.get("file"),
+        "cpu_usage_usec": usage,
+        "cpu_percent": round(usage / (elapsed * 1e6) * 100, 2) if elapsed else 0.0,
+    }
+print(json.dumps({"elapsed": elapsed, "units": report}))
+"""
+
+
+class FootprintError(RuntimeError):
+    """Raised when the sampler itself fails."""
+
+
+def sampler_payload(units: List[str], duration: float, interval: float, **extra) -> str:
+    spec = {"units": units, "duration": duration, "interval": interval, **extra}
+    return base64.b64encode(json.dumps(spec).encode()).decode()
+
+
+def sample_host(host, units: List[str], duration: float, interval: float = 1.0) -> Dict[str, object]:
+    """Sample `units` on a testinfra host for `duration` seconds, in one round trip."""
+    program = base64.b64encode(SAMPLER.encode()).decode()
+    payload = sampler_payload(units, duration, interval)
+    result = host.run(f"echo {program} | base64 -d | python3 - {shlex.quote(payload)}")
+    if result.rc != 0:
+        raise FootprintError(f"footprint sampler failed ({result.rc}): {result.stderr.strip()}")
+    return json.loads(result.stdout)
+
+
+def sample_local(units: List[str], duration: float, interval: float = 1.0, **extra) -> Dict[str, object]:
+    """Sample `units` on this machine. `extra` is passed to the sampler, e.g. root or cgroups."""
+    proc = subprocess.run(
+        [sys.executable, "-c", SAMPLER, sampler_payload(units, duration, interval, **extra)],
+        capture_output=True,
+        text=True,
+    )
+    if proc.returncode != 0:
+        raise FootprintError(f"footprint sampler failed ({proc.returncode}): {proc.stderr.strip()}")
+    return json.loads(proc.stdout)
+
+
+def measure(
+    sample: Callable[[float], Dict[str, object]],
+    idle: float,
+    load: float,
+    generate_load: Optional[Callable[[float], object]] = None,
+) -> Dict[str, object]:
+    """
+    Run an idle phase, then a load phase with `generate_load(load)` running alongside the sampler.
+
+    `sample(duration)` takes one phase's samples. Returns the report:
+    {"phases": {"idle": ..., "load": ...}} with the sampler output per phase,
+    and the load generator's return value under "load_result".
+    """
+    report = {"phases": {}}
+    if idle:
+        report["phases"]["idle"] = sample(idle)
+    if load and generate_load:
+        outcome = {}
+
+        def run_load():
+            try:
+                outcome["result"] = generate_load(load)
+            except Exception as e:
+                outcome["error"] = f"{type(e).__name__}: {e}"
+
+        thread = threading.Thread(target=run_load)
+        thread.start()
+        try:
+            report["phases"]["load"] = sample(load)
+        finally:
+            thread.join()
+        if "error" in outcome:
+            raise FootprintError(f"load generator failed: {outcome['error']}")
+        report["load_result"] = outcome.get("result")
+    return report
+
+
+def compare_footprints(
+    current: Dict[str, object],
+    baseline: Dict[str, object],
+    tolerance: float = 0.2,
+    min_memory_delta: int = 16 * 1024 * 1024,
+    min_cpu_delta: float = 5.0,
+) -> List[Dict[str, object]]:
+    """
+    Units that use noticeably more than in `baseline`, per phase.
+
+    Memory (the sampled max of memory.current) regresses when it grows by
+    more than `tolerance` and by more than `min_memory_delta` bytes. CPU
+    regresses when it grows by more than `tolerance` and by more than
+    `min_cpu_delta` percentage points. The floors keep small services from
+    being flagged for noise. A unit that was running in the baseline but
+    not now is reported too.
+    """
+    regressions = []
+    for phase, expected_phase in baseline.get("phases", {}).items():
+        actual_units = current.get("phases", {}).get(phase, {}).get("units", {})
+        for unit, expected in expected_phase.get("units", {}).items():
+            if "error" in expected:
+                continue
+            actual = actual_units.get(unit)
+            if actual is None:
+                continue
+            if "error" in actual:
+                regressions.append({"phase": phase, "unit": unit, "metric": "running", "baseline": True, "current": actual["error"]})
+                continue
+            for metric, floor in (("memory_current_max", min_memory_delta), ("cpu_percent", min_cpu_delta)):
+                delta = actual[metric] - expected[metric]
+                if delta > floor and delta > expected[metric] * tolerance:
+                    regressions.append({
+                        "phase": phase, "unit": unit, "metric": metric,
+                        "baseline": expected[metric], "current": actual[metric],
+                    })
+    return sorted(regressions, key=lambda r: (r["phase"], r["unit"], r["metric"]))
+
+
+def format_report(report: Dict[str, object]) -> str:
+    lines = []
+    for phase, result in report["phases"].items():
+        lines.append(f"{phase} ({result['elapsed']:.0f}s)")
+        for unit, values in result["units"].items():
+            if "error" in values:
+                lines.append(f"  {unit:<12} {values['error']}")
+            else:
+                lines.append(
+                    f"  {unit:<12} {values['memory_current_max'] / 2**20:8.1f} MiB max"
+                    f" {values['memory_current_mean'] / 2**20:8.1f} MiB mean"
+                    f" {values['cpu_percent']:6.1f}% cpu"
+                )
+    return "\n".join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Sample per-unit cgroup v2 memory and CPU on this host")
+    parser.add_argument("--unit", action="append", help=f"Unit to sample (repeatable, default: {' '.join(SERVICES)})")
+    parser.add_argument("--idle", type=float, default=60, help="Idle phase seconds (0 to skip)")
+    parser.add_argument("--load", type=float, default=0, help="Load phase seconds (needs --load-command)")
+    parser.add_argument("--load-command", help="Shell command that generates load during the load phase")
+    parser.add_argument("--interval", type=float, default=1.0)
+    parser.add_argument("--baseline", help="Flag regressions against this report")
+    parser.add_argument("-o", "--output", help="Write the JSON report here")
+    args = parser.parse_args()
+    if args.load and not args.load_command:
+        parser.error("--load needs --load-command")
+
+    def generate_load(duration):
+        proc = subprocess.run(args.load_command, shell=True, capture_output=True, text=True, timeout=duration * 3)
+        if proc.returncode != 0:
+            raise RuntimeError(f"exited with {proc.returncode}: {proc.stderr.strip()}")
+        return {"command": args.load_command}
+
+    try:
+        report = measure(
+            lambda duration: sample_local(args.unit or SERVICES, duration, args.interval),
+            args.idle,
+            args.load,
+            generate_load if args.load_command else None,
+        )
+    except FootprintError as e:
+        print(f"{sys.argv[0]}: {e}", file=sys.stderr)
+        sys.exit(2)
+
+    regressions = []
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare_footprints(report, json.load(f))
+    report["regressions"] = regressions
+
+    print(format_report(report))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+            f.write("\n")
+    for regression in regressions:
+        print(
+            f"REGRESSION {regression['phase']} {regression['unit']} {regression['metric']}:"
+            f" {regression['baseline']} -> {regression['current']}",
+            file=sys.stderr,
+        )
+    sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
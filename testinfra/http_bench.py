@@ -0,0 +1,229 @@
+"""
+HTTP load and latency benchmark for the Kong -> PostgREST -> pgbouncer -> Postgres path.
+
+Workers share one pooled keep-alive requests.Session and cycle through a set
+of request shapes as fast as responses come back (closed loop) for a fixed
+duration. The report holds requests/sec and p50/p95/p99 latency overall and
+per shape, as JSON, so two images can be compared before release.
+
+    python testinfra/http_bench.py --base-url http://<host> \
+        --anon-key <jwt> --service-key <jwt> --duration 30 --concurrency 16
+
+test_ami_nix.py runs the same benchmark against the test host when
+HTTP_BENCH_DURATION is set.
+"""
+
+import argparse
+import json
+import os
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import requests
+from requests.adapters import HTTPAdapter
+
+
+@dataclass
+class RequestShape:
+    name: str
+    path: str
+    headers: Dict[str, str] = field(default_factory=dict)
+    # a list rather than a dict: parameter order matters for the apikey stripping cases
+    params: List[Tuple[str, str]] = field(default_factory=list)
+
+
+def postgrest_shapes(anon_key: str, service_key: str) -> List[RequestShape]:
+    """The request mix: the OpenAPI root, a storage table read, and the apikey/empty-key query cases."""
+    storage = {"accept-profile": "storage"}
+    return [
+        RequestShape(
+            "root",
+            "/rest/v1/",
+            {"apikey": anon_key, "authorization": f"Bearer {anon_key}"},
+        ),
+        RequestShape(
+            "buckets",
+            "/rest/v1/buckets",
+            {"apikey": service_key, "authorization": f"Bearer {service_key}", **storage},
+        ),
+        RequestShape(
+            "buckets_filtered",
+            "/rest/v1/buckets",
+            {"apikey": service_key, "authorization": f"Bearer {service_key}", **storage},
+            [("id", "eq.absent"), ("name", "eq.absent")],
+        ),
+        RequestShape(
+            "apikey_query_start",
+            "/rest/v1/buckets",
+            storage,
+            [("apikey", service_key), ("id", "eq.absent"), ("name", "eq.absent")],
+        ),
+        RequestShape(
+            "apikey_query_middle",
+            "/rest/v1/buckets",
+            storage,
+            [("id", "eq.absent"), ("apikey", service_key), ("name", "eq.absent")],
+        ),
+        RequestShape(
+            "apikey_query_end",
+            "/rest/v1/buckets",
+            storage,
+            [("id", "eq.absent"), ("name", "eq.absent"), ("apikey", service_key)],
+        ),
+        RequestShape(
+            "empty_key_query",
+            "/rest/v1/buckets",
+            storage,
+            [("apikey", service_key), ("", "empty_key"), ("id", "eq.absent")],
+        ),
+    ]
+
+
+def make_session(pool_size: int) -> requests.Session:
+    """A Session whose connection pool holds one keep-alive connection per worker."""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+def percentile(sorted_samples: Sequence[float], pct: float) -> Optional[float]:
+    """Nearest-rank percentile of already sorted samples."""
+    if not sorted_samples:
+        return None
+    rank = max(int(-(-pct * len(sorted_samples) // 100)), 1)
+    return sorted_samples[min(rank, len(sorted_samples)) - 1]
+
+
+def summarize(latencies: List[float], errors: int, elapsed: float) -> Dict[str, object]:
+    samples = sorted(latencies)
+
+    def ms(value):
+        return None if value is None else round(value * 1000, 2)
+
+    return {
+        "requests": len(samples) + errors,
+        "errors": errors,
+        "requests_per_sec": round((len(samples) + errors) / elapsed, 1) if elapsed else 0.0,
+        "p50_ms": ms(percentile(samples, 50)),
+        "p95_ms": ms(percentile(samples, 95)),
+        "p99_ms": ms(percentile(samples, 99)),
+        "max_ms": ms(samples[-1] if samples else None),
+    }
+
+
+def run_benchmark(
+    base_url: str,
+    shapes: List[RequestShape],
+    concurrency: int = 16,
+    duration: float = 30.0,
+    warmup: float = 2.0,
+    timeout: float = 10.0,
+    session: Optional[requests.Session] = None,
+) -> Dict[str, object]:
+    """
+    Drive closed-loop load against `base_url` and return the JSON-ready report.
+
+    Requests made during the first `warmup` seconds open the pooled
+    connections and are not counted. A response with status >= 400 or a
+    request that raises counts as an error; only successful requests
+    contribute latency samples. A `session` passed in is left open for the
+    caller; one created here is closed before returning.
+    """
+    owns_session = session is None
+    if owns_session:
+        session = make_session(concurrency)
+    base_url = base_url.rstrip("/")
+    lock = threading.Lock()
+    latencies = {shape.name: [] for shape in shapes}
+    errors = {shape.name: 0 for shape in shapes}
+    error_samples: List[str] = []
+
+    start = time.monotonic()
+    measure_from = start + warmup
+    stop_at = measure_from + duration
+
+    def worker(offset: int):
+        i = offset
+        while True:
+            shape = shapes[i % len(shapes)]
+            i += 1
+            sent = time.monotonic()
+            if sent >= stop_at:
+                return
+            try:
+                response = session.get(
+                    base_url + shape.path,
+                    headers=shape.headers,
+                    params=shape.params,
+                    timeout=timeout,
+                )
+                response.content
+                failure = None if response.status_code < 400 else f"HTTP {response.status_code}"
+            except requests.RequestException as e:
+                failure = f"{type(e).__name__}: {e}"
+            latency = time.monotonic() - sent
+            if sent < measure_from:
+                continue
+            with lock:
+                if failure:
+                    errors[shape.name] += 1
+                    if len(error_samples) < 10:
+                        error_samples.append(f"{shape.name}: {failure}")
+                else:
+                    latencies[shape.name].append(latency)
+
+    threads = [threading.Thread(target=worker, args=(n,)) for n in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = min(time.monotonic(), stop_at + timeout) - measure_from
+    if owns_session:
+        session.close()
+
+    every_latency = [value for values in latencies.values() for value in values]
+    return {
+        "base_url": base_url,
+        "concurrency": concurrency,
+        "duration_s": round(elapsed, 3),
+        "total": summarize(every_latency, sum(errors.values()), elapsed),
+        "shapes": {
+            shape.name: summarize(latencies[shape.name], errors[shape.name], elapsed)
+            for shape in shapes
+        },
+        "error_samples": error_samples,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the PostgREST path through Kong")
+    parser.add_argument("--base-url", required=True, help="Kong endpoint, e.g. http://<host>")
+    parser.add_argument("--anon-key", default=os.environ.get("ANON_KEY"), required="ANON_KEY" not in os.environ)
+    parser.add_argument("--service-key", default=os.environ.get("SERVICE_ROLE_KEY"), required="SERVICE_ROLE_KEY" not in os.environ)
+    parser.add_argument("-c", "--concurrency", type=int, default=16)
+    parser.add_argument("-d", "--duration", type=float, default=30.0, help="Measured seconds")
+    parser.add_argument("--warmup", type=float, default=2.0)
+    parser.add_argument("--shape", action="append", help="Only run the named shape (repeatable)")
+    parser.add_argument("-o", "--output", help="Write the JSON report here as well as to stdout")
+    args = parser.parse_args()
+
+    shapes = postgrest_shapes(args.anon_key, args.service_key)
+    if args.shape:
+        shapes = [shape for shape in shapes if shape.name in args.shape]
+        if not shapes:
+            parser.error(f"no shapes matched {args.shape}")
+
+    report = run_benchmark(args.base_url, shapes, args.concurrency, args.duration, args.warmup)
+    text = json.dumps(report, indent=2)
+    print(text)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+
+
+if __name__ == "__main__":
+    main()
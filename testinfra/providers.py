@@ -0,0 +1,506 @@
+"""
+Where the AMI tests get their host from.
+
+The `host` fixture in test_ami_nix.py used to be hard-wired to EC2. It now
+asks a provider for a machine booted with the test cloud-init user-data,
+then runs the same readiness checks and tests against whatever it gets:
+
+    ec2     An instance of AMI_NAME, reached over EC2 Instance Connect (CI default).
+    qemu    The qcow2 image built by qemu-arm64-nix.pkr.hcl, booted locally with a
+            NoCloud seed holding the same user-data, reached over a forwarded ssh port.
+    docker  A systemd-capable container image; the user-data is run through the
+            image's own cloud-init, and commands go through the docker:// backend.
+    local   The machine running pytest (local://), e.g. from inside a VM that is
+            already provisioned. The user-data is not applied.
+
+Select one with TESTINFRA_PROVIDER. Only the ec2 provider needs boto3 and
+AWS credentials.
+"""
+
+import logging
+import os
+import shutil
+import signal
+import socket
+import subprocess
+import tempfile
+import time
+from typing import List
+
+import testinfra
+
+logger = logging.getLogger("ami-tests")
+
+# if GITHUB_RUN_ID is not set, use a default value that includes the user and hostname
+RUN_ID = os.environ.get(
+    "GITHUB_RUN_ID",
+    "unknown-ci-run-"
+    + os.environ.get("USER", "unknown-user")
+    + "@"
+    + socket.gethostname(),
+)
+
+
+def wait_for_port(address: str, port: int, interval: float = 10.0, timeout: float = 900.0, check=None):
+    """
+    Wait until address:port accepts connections.
+
+    check, if given, is called before every attempt and may raise to give up
+    early, e.g. when the process that should open the port has died.
+    """
+    deadline = time.monotonic() + timeout
+    while True:
+        if check is not None:
+            check()
+        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+            if sock.connect_ex((address, port)) == 0:
+                return
+        if time.monotonic() >= deadline:
+            raise TimeoutError(f"{address}:{port} did not open within {timeout}s")
+        logger.warning(f"waiting for {address}:{port} to be available")
+        time.sleep(interval)
+
+
+def free_local_port() -> int:
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def get_ssh_connection(spec: str, ssh_identity_file: str, max_retries: int = 10):
+    for attempt in range(max_retries):
+        try:
+            # paramiko is an ssh backend
+            return testinfra.get_host(spec, ssh_identity_file=ssh_identity_file)
+        except Exception:
+            if attempt == max_retries - 1:
+                raise
+            logger.warning(
+                f"Ssh connection failed, retrying: {attempt + 1}/{max_retries} failed, retrying ..."
+            )
+            time.sleep(5)
+
+
+class HostProvider:
+    """
+    Base class for the ways of getting a host to test.
+
+    Subclasses boot the machine in start(), return a testinfra host from
+    connect() (called again to reconnect), expose the HTTP endpoint that
+    Kong listens on as base_url, and tear everything down in stop().
+
+    describe() returns a JSON-serialisable description of a started host
+    and attach() points a fresh provider at one, so pytest-xdist workers
+    can share a single host (see shared_resource.py).
+    """
+
+    name = ""
+
+    def __init__(self, timeline):
+        self.timeline = timeline
+
+    @property
+    def ssh_authorized_keys(self) -> List[str]:
+        """Public keys to add to the cloud-init user-data."""
+        return []
+
+    def start(self, user_data: str):
+        raise NotImplementedError
+
+    def connect(self):
+        raise NotImplementedError
+
+    @property
+    def base_url(self) -> str:
+        raise NotImplementedError
+
+    def describe(self) -> dict:
+        return {}
+
+    def attach(self, description: dict) -> "HostProvider":
+        return self
+
+    def stop(self):
+        pass
+
+
+class Ec2Provider(HostProvider):
+    name = "ec2"
+
+    def __init__(self, timeline):
+        super().__init__(timeline)
+        import boto3
+
+        self.boto3 = boto3
+        self.ami_name = os.environ.get("AMI_NAME")
+        self.instance = None
+        self.temp_key = None
+
+    def start(self, user_data: str):
+        from ec2instanceconnectcli.EC2InstanceConnectKey import EC2InstanceConnectKey
+        from ec2instanceconnectcli.EC2InstanceConnectLogger import EC2InstanceConnectLogger
+
+        ec2 = self.boto3.resource("ec2", region_name="ap-southeast-1")
+        images = list(
+            ec2.images.filter(
+                Filters=[{"Name": "name", "Values": [self.ami_name]}],
+            )
+        )
+        assert len(images) == 1
+        image = images[0]
+
+        self.timeline.mark("instance_requested")
+        self.instance = list(
+            ec2.create_instances(
+                BlockDeviceMappings=[
+                    {
+                        "DeviceName": "/dev/sda1",
+                        "Ebs": {
+                            "VolumeSize": 8,  # gb
+                            "Encrypted": True,
+                            "DeleteOnTermination": True,
+                            "VolumeType": "gp3",
+                        },
+                    },
+                ],
+                MetadataOptions={
+                    "HttpTokens": "required",
+                    "HttpEndpoint": "enabled",
+                },
+                IamInstanceProfile={"Name": "pg-ap-southeast-1"},
+                InstanceType="t4g.micro",
+                MinCount=1,
+                MaxCount=1,
+                ImageId=image.id,
+                NetworkInterfaces=[
+                    {
+                        "DeviceIndex": 0,
+                        "AssociatePublicIpAddress": True,
+                        "Groups": ["sg-0a883ca614ebfbae0", "sg-014d326be5a1627dc"],
+                    }
+                ],
+                UserData=user_data,
+                TagSpecifications=[
+                    {
+                        "ResourceType": "instance",
+                        "Tags": [
+                            {"Key": "Name", "Value": "ci-ami-test-nix"},
+                            {"Key": "creator", "Value": "testinfra-ci"},
+                            {"Key": "testinfra-run-id", "Value": RUN_ID},
+                        ],
+                    }
+                ],
+            )
+        )[0]
+        self.instance.wait_until_running()
+        self.timeline.mark("instance_running")
+
+        ec2logger = EC2InstanceConnectLogger(debug=False)
+        self.temp_key = EC2InstanceConnectKey(ec2logger.get_logger())
+        ec2ic = self.boto3.client("ec2-instance-connect", region_name="us-east-1")
+        response = ec2ic.send_ssh_public_key(
+            InstanceId=self.instance.id,
+            InstanceOSUser="ubuntu",
+            SSHPublicKey=self.temp_key.get_pub_key(),
+        )
+        assert response["Success"]
+
+        # instance doesn't have public ip yet
+        while not self.instance.public_ip_address:
+            logger.warning("waiting for ip to be available")
+            time.sleep(5)
+            self.instance.reload()
+        self.timeline.mark("public_ip_assigned")
+
+        wait_for_port(self.instance.public_ip_address, 22)
+        self.timeline.mark("port_22_open")
+
+    def describe(self) -> dict:
+        return {"instance_id": self.instance.id}
+
+    def attach(self, description: dict) -> "HostProvider":
+        from ec2instanceconnectcli.EC2InstanceConnectKey import EC2InstanceConnectKey
+        from ec2instanceconnectcli.EC2InstanceConnectLogger import EC2InstanceConnectLogger
+
+        ec2 = self.boto3.resource("ec2", region_name="ap-southeast-1")
+        self.instance = ec2.Instance(description["instance_id"])
+        # keys pushed through Instance Connect only last 60 seconds, so every
+        # attaching worker pushes its own
+        ec2logger = EC2InstanceConnectLogger(debug=False)
+        self.temp_key = EC2InstanceConnectKey(ec2logger.get_logger())
+        ec2ic = self.boto3.client("ec2-instance-connect", region_name="us-east-1")
+        response = ec2ic.send_ssh_public_key(
+            InstanceId=self.instance.id,
+            InstanceOSUser="ubuntu",
+            SSHPublicKey=self.temp_key.get_pub_key(),
+        )
+        assert response["Success"]
+        return self
+
+    def connect(self):
+        return get_ssh_connection(
+            f"paramiko://ubuntu@{self.instance.public_ip_address}?timeout=60",
+            self.temp_key.get_priv_key_file(),
+        )
+
+    @property
+    def base_url(self) -> str:
+        return f"http://{self.instance.public_ip_address}"
+
+    def stop(self):
+        if self.instance is not None:
+            self.instance.terminate()
+            self.instance = None
+
+
+class QemuProvider(HostProvider):
+    """
+    Boots the qemu-arm64-nix.pkr.hcl image on a throwaway overlay disk.
+
+    ssh and Kong's HTTP port are forwarded to free ports on 127.0.0.1.
+    QEMU_IMAGE points at the built qcow2; QEMU_BINARY, QEMU_ACCEL, QEMU_MEMORY
+    and QEMU_CPUS tune the VM. The guest gets the host CPU under kvm and
+    QEMU's emulated "max" CPU otherwise, since tcg has no host CPU to pass
+    through.
+    """
+
+    name = "qemu"
+
+    def __init__(self, timeline):
+        super().__init__(timeline)
+        self.image = os.path.abspath(
+            os.environ.get("QEMU_IMAGE", "output-cloudimg/packer-cloudimg")
+        )
+        self.workdir = None
+        self.key_file = None
+        self.ssh_port = None
+        self.http_port = None
+        self.process = None
+        self.pid = None
+
+    def prepare(self):
+        if self.workdir is None:
+            self.workdir = tempfile.mkdtemp(prefix="testinfra-qemu-")
+            self.key_file = os.path.join(self.workdir, "id_ed25519")
+            subprocess.run(
+                ["ssh-keygen", "-q", "-t", "ed25519", "-N", "", "-f", self.key_file],
+                check=True,
+            )
+            self.ssh_port = free_local_port()
+            self.http_port = free_local_port()
+
+    @property
+    def ssh_authorized_keys(self) -> List[str]:
+        self.prepare()
+        with open(self.key_file + ".pub") as f:
+            return [f.read().strip()]
+
+    def start(self, user_data: str):
+        self.prepare()
+        overlay = os.path.join(self.workdir, "disk.qcow2")
+        seed = os.path.join(self.workdir, "seed.iso")
+        vars_fd = os.path.join(self.workdir, "AAVMF_VARS.fd")
+        with open(os.path.join(self.workdir, "user-data"), "w") as f:
+            f.write(user_data)
+        with open(os.path.join(self.workdir, "meta-data"), "w") as f:
+            f.write("instance-id: testinfra\nlocal-hostname: db-aaaaaaaaaaaaaaaaaaaa\n")
+
+        subprocess.run(
+            ["qemu-img", "create", "-q", "-f", "qcow2", "-F", "qcow2", "-b", self.image, overlay],
+            check=True,
+        )
+        subprocess.run(
+            ["cloud-localds", seed, "user-data", "meta-data"], cwd=self.workdir, check=True
+        )
+        shutil.copy("/usr/share/AAVMF/AAVMF_VARS.fd", vars_fd)
+
+        accel = os.environ.get("QEMU_ACCEL", "kvm")
+        self.timeline.mark("instance_requested")
+        # Popen hands the child its own copy of the descriptor, so ours can be closed
+        with open(os.path.join(self.workdir, "console.log"), "wb") as console:
+            self.process = subprocess.Popen(
+                [
+                    os.environ.get("QEMU_BINARY", "qemu-system-aarch64"),
+                    "-machine", "virt,gic-version=3",
+                    "-cpu", "host" if accel == "kvm" else "max",
+                    "-accel", accel,
+                    "-m", os.environ.get("QEMU_MEMORY", "4096"),
+                    "-smp", os.environ.get("QEMU_CPUS", "2"),
+                    "-nographic",
+                    "-drive", "if=pflash,format=raw,readonly=on,file=/usr/share/AAVMF/AAVMF_CODE.fd",
+                    "-drive", f"if=pflash,format=raw,file={vars_fd}",
+                    "-drive", f"file={overlay},format=qcow2,if=virtio",
+                    "-drive", f"file={seed},format=raw,if=virtio",
+                    "-netdev", f"user,id=net0,hostfwd=tcp:127.0.0.1:{self.ssh_port}-:22,hostfwd=tcp:127.0.0.1:{self.http_port}-:80",
+                    "-device", "virtio-net-pci,netdev=net0",
+                ],
+                stdin=subprocess.DEVNULL,
+                stdout=console,
+                stderr=subprocess.STDOUT,
+            )
+        self.pid = self.process.pid
+        self.timeline.mark("instance_running")
+        # qemu's user networking accepts forwarded connections straight away,
+        # so "port 22 open" only says the VM process is up; ssh_usable is the
+        # milestone that means anything here
+        wait_for_port("127.0.0.1", self.ssh_port, interval=1, check=self.check_running)
+        self.timeline.mark("port_22_open")
+
+    def check_running(self):
+        returncode = self.process.poll()
+        if returncode is not None:
+            raise RuntimeError(
+                f"qemu exited with code {returncode} before the VM came up, "
+                f"see {os.path.join(self.workdir, 'console.log')}"
+            )
+
+    def describe(self) -> dict:
+        return {
+            "workdir": self.workdir,
+            "key_file": self.key_file,
+            "ssh_port": self.ssh_port,
+            "http_port": self.http_port,
+            "pid": self.pid,
+        }
+
+    def attach(self, description: dict) -> "HostProvider":
+        for key, value in description.items():
+            setattr(self, key, value)
+        return self
+
+    def connect(self):
+        return get_ssh_connection(
+            f"paramiko://ubuntu@127.0.0.1:{self.ssh_port}?timeout=60", self.key_file
+        )
+
+    @property
+    def base_url(self) -> str:
+        return f"http://127.0.0.1:{self.http_port}"
+
+    def stop(self):
+        if self.process is not None:
+            self.process.terminate()
+            try:
+                self.process.wait(timeout=30)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+            self.process = None
+        elif self.pid is not None:
+            # attached from another worker: the VM is not our child
+            try:
+                os.kill(self.pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+        self.pid = None
+        if self.workdir is not None:
+            shutil.rmtree(self.workdir, ignore_errors=True)
+
+
+class DockerProvider(HostProvider):
+    """
+    Runs an image with systemd as PID 1 and cloud-init fed from a NoCloud seed.
+
+    The image must carry the same stack as the AMI (systemd, cloud-init and
+    the services in HEALTH_CHECKS); the postgres-only images built from
+    Dockerfile-15 do not. Unless DOCKER_IMAGE names one, testinfra/Dockerfile.ami
+    is built from this checkout, so the tests run against the tree under test.
+    """
+
+    name = "docker"
+    BUILD_TAG = "postgres-testinfra:ami"
+
+    def __init__(self, timeline):
+        super().__init__(timeline)
+        self.image = os.environ.get("DOCKER_IMAGE")
+        self.container = None
+
+    def docker(self, *args, **kwargs):
+        return subprocess.run(["docker", *args], check=True, capture_output=True, text=True, **kwargs)
+
+    def build(self):
+        """Build testinfra/Dockerfile.ami from the repository root and return its tag."""
+        repo_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        logger.info(f"building {self.BUILD_TAG} from {repo_root}")
+        self.docker(
+            "build", "--file", os.path.join(repo_root, "testinfra", "Dockerfile.ami"),
+            "--tag", self.BUILD_TAG, repo_root,
+        )
+        return self.BUILD_TAG
+
+    def start(self, user_data: str):
+        if self.image is None:
+            self.image = self.build()
+        self.timeline.mark("instance_requested")
+        self.container = self.docker(
+            "run", "--detach", "--privileged", "--cgroupns=host",
+            "--volume", "/sys/fs/cgroup:/sys/fs/cgroup:rw",
+            "--hostname", "db-aaaaaaaaaaaaaaaaaaaa",
+            "--publish", "127.0.0.1::80",
+            "--label", "creator=testinfra",
+            self.image, "/sbin/init",
+        ).stdout.strip()
+        self.timeline.mark("instance_running")
+
+        seed = "/var/lib/cloud/seed/nocloud"
+        self.docker("exec", self.container, "mkdir", "-p", seed)
+        self.docker("exec", "-i", self.container, "sh", "-c", f"cat > {seed}/user-data", input=user_data)
+        self.docker(
+            "exec", "-i", self.container, "sh", "-c", f"cat > {seed}/meta-data",
+            input="instance-id: testinfra\n",
+        )
+        # cloud-init normally runs these stages during boot; the container booted
+        # before its seed existed, so run them explicitly
+        self.docker(
+            "exec", self.container, "sh", "-c",
+            "cloud-init init && cloud-init modules --mode=config && cloud-init modules --mode=final",
+        )
+
+    def describe(self) -> dict:
+        return {"container": self.container}
+
+    def attach(self, description: dict) -> "HostProvider":
+        self.container = description["container"]
+        return self
+
+    def connect(self):
+        return testinfra.get_host(f"docker://{self.container}")
+
+    @property
+    def base_url(self) -> str:
+        address = self.docker("port", self.container, "80/tcp").stdout.splitlines()[0]
+        return f"http://{address}"
+
+    def stop(self):
+        if self.container is not None:
+            subprocess.run(["docker", "rm", "--force", self.container], capture_output=True)
+            self.container = None
+
+
+class LocalProvider(HostProvider):
+    """Tests the machine pytest runs on. TESTINFRA_BASE_URL overrides the Kong endpoint."""
+
+    name = "local"
+
+    def start(self, user_data: str):
+        logger.info("local provider: host is expected to be provisioned already")
+
+    def connect(self):
+        return testinfra.get_host("local://")
+
+    @property
+    def base_url(self) -> str:
+        return os.environ.get("TESTINFRA_BASE_URL", "http://localhost")
+
+
+PROVIDERS = {
+    provider.name: provider
+    for provider in (Ec2Provider, QemuProvider, DockerProvider, LocalProvider)
+}
+
+
+def get_provider(name: str, timeline) -> HostProvider:
+    try:
+        provider = PROVIDERS[name]
+    except KeyError:
+        raise ValueError(f"unknown TESTINFRA_PROVIDER {name!r}, expected one of {sorted(PROVIDERS)}")
+    return provider(timeline)
@@ -0,0 +1,164 @@
+"""
+Readiness polling for the services on a freshly booted instance.
+
+Every service is probed concurrently, either on threads or through a
+single batched probe per round. A service that has come up is not
+probed again. A service that is still down is retried with capped
+exponential backoff plus jitter, and the whole wait is bounded by a
+deadline. This module only depends on the standard library so it can be
+unit tested without an instance.
+"""
+
+import logging
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Callable, Dict, Iterable, List, Optional, Union
+
+logger = logging.getLogger("ami-tests")
+
+
+class ReadinessTimeout(TimeoutError):
+    """Raised when some services are still not ready at the deadline."""
+
+    def __init__(self, pending: List["ServiceState"]):
+        self.pending = pending
+        details = ", ".join(
+            f"{state.name} ({state.attempts} attempts, last error: {state.last_error})"
+            for state in pending
+        )
+        super().__init__(f"services not ready before deadline: {details}")
+
+
+@dataclass
+class ServiceState:
+    name: str
+    ready: bool = False
+    attempts: int = 0
+    next_probe: float = 0.0
+    ready_at: Optional[float] = None
+    last_error: Optional[str] = None
+
+
+def backoff_delay(
+    attempts: int, base_delay: float, max_delay: float, rng: random.Random
+) -> float:
+    """
+    Delay before the next probe after `attempts` consecutive failures.
+
+    Uses "equal jitter": half of the capped exponential delay is fixed and
+    the other half is random, so retries of different services spread out
+    without ever dropping to zero.
+    """
+    capped = min(max_delay, base_delay * (2 ** max(attempts - 1, 0)))
+    return capped / 2 + rng.uniform(0, capped / 2)
+
+
+def _probe_concurrently(pool, probes, names):
+    futures = {name: pool.submit(probes[name]) for name in names}
+    outcomes = {}
+    for name, future in futures.items():
+        try:
+            outcomes[name] = bool(future.result())
+        except Exception as e:
+            outcomes[name] = e
+    return outcomes
+
+
+def _probe_batch(batch_probe, names):
+    try:
+        results = batch_probe(names)
+    except Exception as e:
+        return {name: e for name in names}
+    return {name: results.get(name, False) for name in names}
+
+
+def wait_until_ready(
+    probes: Union[Dict[str, Callable[[], bool]], Iterable[str]],
+    deadline: float = 600.0,
+    base_delay: float = 1.0,
+    max_delay: float = 30.0,
+    on_ready: Optional[Callable[[ServiceState], None]] = None,
+    on_error: Optional[Callable[[Dict[str, BaseException]], None]] = None,
+    clock: Callable[[], float] = time.monotonic,
+    sleep: Callable[[float], None] = time.sleep,
+    rng: Optional[random.Random] = None,
+    batch_probe: Optional[
+        Callable[[List[str]], Dict[str, Union[bool, BaseException]]]
+    ] = None,
+) -> Dict[str, ServiceState]:
+    """
+    Probe every service until all of them report ready.
+
+    Args:
+        probes: Service name -> callable that returns True once the service is ready.
+            A probe that raises counts as not ready. With `batch_probe`
+            only the service names are used.
+        deadline: Seconds to wait in total before raising ReadinessTimeout.
+        base_delay: Backoff delay after the first failure.
+        max_delay: Upper bound for the backoff delay.
+        on_ready: Called once per service, when it first reports ready.
+        on_error: Called after a round in which any probe raised, with
+            service name -> exception. The AMI fixture uses this to reconnect.
+        clock, sleep, rng: Injection points for tests.
+        batch_probe: Probes every due service at once. It takes the list of
+            due service names and returns name -> ready (or the exception the
+            probe raised). If it raises, every due service counts as failed
+            with that exception.
+
+    Returns:
+        Service name -> final ServiceState.
+    """
+    rng = rng or random.Random()
+    start = clock()
+    states = {name: ServiceState(name=name, next_probe=start) for name in probes}
+
+    with ThreadPoolExecutor(max_workers=max(len(states), 1)) as pool:
+        while True:
+            now = clock()
+            due = [s.name for s in states.values() if not s.ready and s.next_probe <= now]
+
+            if not due:
+                outcomes = {}
+            elif batch_probe:
+                outcomes = _probe_batch(batch_probe, due)
+            else:
+                outcomes = _probe_concurrently(pool, probes, due)
+
+            errors = {}
+            for name, outcome in outcomes.items():
+                state = states[name]
+                state.attempts += 1
+                if isinstance(outcome, BaseException):
+                    ok = False
+                    state.last_error = f"{type(outcome).__name__}: {outcome}"
+                    errors[name] = outcome
+                else:
+                    ok = bool(outcome)
+                    state.last_error = None if ok else "probe failed"
+
+                if ok:
+                    state.ready = True
+                    state.ready_at = clock() - start
+                    logger.info(f"{name} ready after {state.ready_at:.1f}s")
+                    if on_ready:
+                        on_ready(state)
+                else:
+                    state.next_probe = clock() + backoff_delay(
+                        state.attempts, base_delay, max_delay, rng
+                    )
+                    logger.warning(f"{name} not ready ({state.last_error})")
+
+            if errors and on_error:
+                on_error(errors)
+
+            pending = [s for s in states.values() if not s.ready]
+            if not pending:
+                return states
+
+            now = clock()
+            if now - start >= deadline:
+                raise ReadinessTimeout(pending)
+            wake = min(min(s.next_probe for s in pending), start + deadline)
+            sleep(max(wake - now, 0))
@@ -0,0 +1,148 @@
+"""
+Run many shell commands on a testinfra host in a single round trip.
+
+Each `host.run()` over the paramiko backend is a separate SSH exec, so a
+poll of six health checks costs six round trips. BatchRunner ships one
+small Python program to the host that runs a whole set of commands
+(concurrently by default) and prints exit codes, output and timings as one
+JSON document.
+
+BatchRunner also records how many round trips it made and an estimate of
+what the same commands would have cost one `host.run()` at a time.
+"""
+
+import base64
+import json
+import shlex
+import time
+from dataclasses import dataclass
+from typing import Dict, List
+
+# Runs on the remote host. It only uses the standard library of the system python3.
+REMOTE_RUNNER = r"""
+import base64, json, subprocess, sys, time
+from concurrent.futures import ThreadPoolExecutor
+
+spec = json.loads(base64.b64decode(sys.argv[1]))
+
+def run(item):
+    name, command = item
+    start = time.monotonic()
+    try:
+        proc = subprocess.run(command, shell=True, executable="/bin/bash",
+                              stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                              timeout=spec["timeout"])
+        rc, stdout, stderr = proc.returncode, proc.stdout, proc.stderr
+    except subprocess.TimeoutExpired as e:
+        rc, stdout, stderr = 124, e.stdout or b"", (e.stderr or b"") + b"timed out"
+    return name, {
+        "rc": rc,
+        "stdout": stdout.decode("utf-8", "replace"),
+        "stderr": stderr.decode("utf-8", "replace"),
+        "duration": time.monotonic() - start,
+    }
+
+start = time.monotonic()
+items = list(spec["commands"].items())
+if spec["parallel"] and items:
+    with ThreadPoolExecutor(max_workers=len(items)) as pool:
+        results = dict(pool.map(run, items))
+else:
+    results = dict(map(run, items))
+print(json.dumps({"results": results, "elapsed": time.monotonic() - start}))
+"""
+
+
+class BatchError(RuntimeError):
+    """Raised when the remote runner itself fails, as opposed to one of its commands."""
+
+
+@dataclass
+class CommandResult:
+    name: str
+    command: str
+    rc: int
+    stdout: str
+    stderr: str
+    duration: float
+
+    @property
+    def succeeded(self) -> bool:
+        return self.rc == 0
+
+    @property
+    def failed(self) -> bool:
+        return self.rc != 0
+
+
+class BatchRunner:
+    """
+    Runs named command sets on `host` with one `host.run()` per set.
+
+    Args:
+        host: A testinfra host, or anything with a compatible `run()`.
+        parallel: Run the commands of a set concurrently on the host.
+        timeout: Per-command timeout in seconds, enforced on the host.
+    """
+
+    def __init__(self, host, parallel: bool = True, timeout: float = 120.0):
+        self.host = host
+        self.parallel = parallel
+        self.timeout = timeout
+        self.round_trips = 0
+        self.commands = 0
+        self.elapsed = 0.0
+        self.transport_overhead: List[float] = []
+        self.remote_command_time = 0.0
+
+    def build_command(self, commands: Dict[str, str]) -> str:
+        spec = {"commands": commands, "parallel": self.parallel, "timeout": self.timeout}
+        runner = base64.b64encode(REMOTE_RUNNER.encode()).decode()
+        payload = base64.b64encode(json.dumps(spec).encode()).decode()
+        return f"echo {runner} | base64 -d | python3 - {shlex.quote(payload)}"
+
+    def run(self, commands: Dict[str, str]) -> Dict[str, CommandResult]:
+        """Run every command in one round trip and return name -> CommandResult."""
+        start = time.monotonic()
+        result = self.host.run(self.build_command(commands))
+        wall = time.monotonic() - start
+        if result.rc != 0:
+            raise BatchError(f"remote batch runner failed ({result.rc}): {result.stderr.strip()}")
+        try:
+            document = json.loads(result.stdout)
+        except ValueError as e:
+            raise BatchError(f"remote batch runner printed invalid JSON: {e}") from e
+
+        self.round_trips += 1
+        self.commands += len(commands)
+        self.elapsed += wall
+        self.transport_overhead.append(max(wall - document["elapsed"], 0.0))
+        results = {
+            name: CommandResult(name=name, command=commands[name], **fields)
+            for name, fields in document["results"].items()
+        }
+        self.remote_command_time += sum(r.duration for r in results.values())
+        return results
+
+    def report(self) -> Dict[str, float]:
+        """
+        Round trips made versus one `host.run()` per command.
+
+        The sequential estimate charges every command its remote duration
+        plus the mean transport overhead observed for a batch.
+        """
+        overhead = (
+            sum(self.transport_overhead) / len(self.transport_overhead)
+            if self.transport_overhead
+            else 0.0
+        )
+        sequential = self.remote_command_time + self.commands * overhead
+        return {
+            "round_trips": self.round_trips,
+            "commands": self.commands,
+            "round_trips_saved": self.commands - self.round_trips,
+            "mean_round_trip_overhead_s": round(overhead, 3),
+            "elapsed_s": round(self.elapsed, 3),
+            "estimated_sequential_s": round(sequential, 3),
+            "estimated_saved_s": round(max(sequential - self.elapsed, 0.0), 3),
+        }
@@ -0,0 +1,96 @@
+"""
+Share one expensive resource between pytest-xdist workers.
+
+Session-scoped fixtures run once per xdist worker, so `pytest -n 4` would
+provision four instances. shared_across_workers() lets the first worker
+create the resource and publish a JSON description of it. The other
+workers attach to that description, and the last worker to finish
+destroys it. Coordination uses an flock()ed state file in the temp
+directory that all workers of a run share. Without xdist the resource is
+simply created and destroyed.
+"""
+
+import fcntl
+import json
+import os
+from contextlib import contextmanager
+from typing import Callable, Iterator
+
+
+@contextmanager
+def _locked(path: str):
+    with open(path, "a+") as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            f.seek(0)
+            yield f
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def _read(f) -> dict:
+    text = f.read()
+    return json.loads(text) if text else {}
+
+
+def _write(f, state: dict):
+    f.seek(0)
+    f.truncate()
+    json.dump(state, f)
+    f.flush()
+
+
+@contextmanager
+def shared_across_workers(
+    name: str,
+    tmp_path_factory,
+    create: Callable[[], dict],
+    destroy: Callable[[dict], None],
+) -> Iterator[dict]:
+    """
+    Yield the description of a resource that is created once per test run.
+
+    Args:
+        name: Key for the resource, used for the state file name.
+        tmp_path_factory: The pytest fixture; its base temp dir's parent is
+            shared by all workers of one run.
+        create: Creates the resource and returns a JSON-serialisable description.
+            It runs while holding the lock, so other workers wait for it.
+        destroy: Tears the resource down given its description.
+    """
+    # xdist sets PYTEST_XDIST_WORKER in its workers only
+    if "PYTEST_XDIST_WORKER" not in os.environ:
+        description = create()
+        try:
+            yield description
+        finally:
+            destroy(description)
+        return
+
+    path = str(tmp_path_factory.getbasetemp().parent / f"{name}.json")
+    with _locked(path) as f:
+        state = _read(f)
+        if "error" in state:
+            raise RuntimeError(f"{name} could not be created by another worker: {state['error']}")
+        if "description" not in state:
+            try:
+                state = {"description": create(), "users": 0}
+            except Exception as e:
+                _write(f, {"error": f"{type(e).__name__}: {e}"})
+                raise
+        state["users"] += 1
+        _write(f, state)
+
+    try:
+        yield state["description"]
+    finally:
+        with _locked(path) as f:
+            state = _read(f)
+            state["users"] -= 1
+            if state["users"]:
+                _write(f, state)
+            else:
+                # destroy under the lock, so a worker that arrives late creates
+                # a new resource instead of attaching to one being torn down
+                _write(f, {})
+                destroy(state["description"])
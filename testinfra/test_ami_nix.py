@@ -1,25 +1,22 @@
 import base64
-import boto3
 import gzip
+import json
 import logging
 import os
 import pytest
 import requests
-import socket
-import testinfra
-from ec2instanceconnectcli.EC2InstanceConnectLogger import EC2InstanceConnectLogger
-from ec2instanceconnectcli.EC2InstanceConnectKey import EC2InstanceConnectKey
-from time import sleep
-
-# if GITHUB_RUN_ID is not set, use a default value that includes the user and hostname
-RUN_ID = os.environ.get(
-    "GITHUB_RUN_ID",
-    "unknown-ci-run-"
-    + os.environ.get("USER", "unknown-user")
-    + "@"
-    + socket.gethostname(),
-)
-AMI_NAME = os.environ.get("AMI_NAME")
+import time
+from boot_timeline import BootTimeline, compare_timelines
+from concurrent.futures import ThreadPoolExecutor
+from footprint import SERVICES, compare_footprints, format_report, measure, sample_host
+from http_bench import RequestShape, make_session, postgrest_shapes, run_benchmark
+from providers import get_provider
+from readiness import wait_until_ready
+from remote_batch import BatchRunner
+from shared_resource import shared_across_workers
+
+# ec2 (default), qemu, docker or local; see providers.py
+TESTINFRA_PROVIDER = os.environ.get("TESTINFRA_PROVIDER", "ec2")
 postgresql_schema_sql_content = """
 ALTER DATABASE postgres SET "app.settings.jwt_secret" TO  'my_jwt_secret_which_is_not_so_secret';
 ALTER DATABASE postgres SET "app.settings.jwt_exp" TO 3600;
@@ -162,6 +159,36 @@ init_json_content = f"""
 }}
 """
 
+# service -> command that exits 0 once the service is ready
+HEALTH_CHECKS = {
+    "postgres": "sudo -u postgres /usr/bin/pg_isready -U postgres",
+    "adminapi": f"curl -sf -k --connect-timeout 30 --max-time 60 https://localhost:8085/health -H 'apikey: {capitala_admin_key}'",
+    "postgrest": "curl -sf --connect-timeout 30 --max-time 60 http://localhost:3001/ready",
+    "gotrue": "curl -sf --connect-timeout 30 --max-time 60 http://localhost:8081/health",
+    "kong": "sudo kong health",
+    "fail2ban": "sudo fail2ban-client status",
+}
+HEALTH_CHECK_DEADLINE = float(os.environ.get("HEALTH_CHECK_DEADLINE", 900))
+
+BOOT_TIMELINE_OUTPUT = os.environ.get("BOOT_TIMELINE_OUTPUT", "boot-timeline.json")
+BOOT_TIMELINE_BASELINE = os.environ.get(
+    "BOOT_TIMELINE_BASELINE",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "boot_timeline_baseline.json"),
+)
+
+# set HTTP_BENCH_DURATION (seconds) to benchmark the PostgREST path; see http_bench.py
+HTTP_BENCH_DURATION = float(os.environ.get("HTTP_BENCH_DURATION", 0))
+HTTP_BENCH_CONCURRENCY = int(os.environ.get("HTTP_BENCH_CONCURRENCY", 16))
+HTTP_BENCH_OUTPUT = os.environ.get("HTTP_BENCH_OUTPUT", "http-bench.json")
+
+# set FOOTPRINT_DURATION (seconds per phase) to measure per-service memory and CPU; see footprint.py
+FOOTPRINT_DURATION = float(os.environ.get("FOOTPRINT_DURATION", 0))
+FOOTPRINT_OUTPUT = os.environ.get("FOOTPRINT_OUTPUT", "footprint.json")
+FOOTPRINT_BASELINE = os.environ.get(
+    "FOOTPRINT_BASELINE",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "footprint_baseline.json"),
+)
+
 logger = logging.getLogger("ami-tests")
 handler = logging.StreamHandler()
 formatter = logging.Formatter("%(asctime)s %(name)-12s %(levelname)-8s %(message)s")
@@ -170,52 +197,18 @@ logger.addHandler(handler)
 logger.setLevel(logging.DEBUG)
 
 
-# scope='session' uses the same container for all the tests;
-# scope='function' uses a new container per test function.
 @pytest.fixture(scope="session")
-def host():
-    ec2 = boto3.resource("ec2", region_name="ap-southeast-1")
-    images = list(
-        ec2.images.filter(
-            Filters=[{"Name": "name", "Values": [AMI_NAME]}],
-        )
-    )
-    assert len(images) == 1
-    image = images[0]
-
-    def gzip_then_base64_encode(s: str) -> str:
-        return base64.b64encode(gzip.compress(s.encode())).decode()
-
-    instance = list(
-        ec2.create_instances(
-            BlockDeviceMappings=[
-                {
-                    "DeviceName": "/dev/sda1",
-                    "Ebs": {
-                        "VolumeSize": 8,  # gb
-                        "Encrypted": True,
-                        "DeleteOnTermination": True,
-                        "VolumeType": "gp3",
-                    },
-                },
-            ],
-            MetadataOptions={
-                "HttpTokens": "required",
-                "HttpEndpoint": "enabled",
-            },
-            IamInstanceProfile={"Name": "pg-ap-southeast-1"},
-            InstanceType="t4g.micro",
-            MinCount=1,
-            MaxCount=1,
-            ImageId=image.id,
-            NetworkInterfaces=[
-                {
-                    "DeviceIndex": 0,
-                    "AssociatePublicIpAddress": True,
-                    "Groups": ["sg-0a883ca614ebfbae0", "sg-014d326be5a1627dc"],
-                }
-            ],
-            UserData=f"""#cloud-config
+def boot_timeline():
+    return BootTimeline()
+
+
+def gzip_then_base64_encode(s: str) -> str:
+    return base64.b64encode(gzip.compress(s.encode())).decode()
+
+
+def render_user_data(ssh_authorized_keys=()) -> str:
+    """cloud-init user-data that every provider boots the host with."""
+    user_data = f"""#cloud-config
 hostname: db-aaaaaaaaaaaaaaaaaaaa
 write_files:
     - {{path: /etc/postgresql.schema.sql, content: {gzip_then_base64_encode(postgresql_schema_sql_content)}, permissions: '0600', encoding: gz+b64}}
@@ -231,123 +224,126 @@ runcmd:
     - 'cd /tmp && aws s3 cp --region ap-southeast-1 s3://init-scripts-staging/project/init.sh .'
     - 'bash init.sh "staging"'
     - 'rm -rf /tmp/*'
-""",
-            TagSpecifications=[
-                {
-                    "ResourceType": "instance",
-                    "Tags": [
-                        {"Key": "Name", "Value": "ci-ami-test-nix"},
-                        {"Key": "creator", "Value": "testinfra-ci"},
-                        {"Key": "testinfra-run-id", "Value": RUN_ID},
-                    ],
-                }
-            ],
+"""
+    if ssh_authorized_keys:
+        user_data += "ssh_authorized_keys:\n" + "".join(
+            f"    - '{key}'\n" for key in ssh_authorized_keys
+        )
+    return user_data
+
+
+def wait_for_services(provider, boot_timeline):
+    """Wait for every health check to pass, then record the boot timeline."""
+    # every poll runs all pending health checks in one ssh round trip
+    runner = BatchRunner(provider.connect())
+
+    def probe(services):
+        results = runner.run({service: HEALTH_CHECKS[service] for service in services})
+        boot_timeline.mark("ssh_usable")
+        return {service: result.succeeded for service, result in results.items()}
+
+    def reconnect(errors):
+        logger.warning(
+            f"Connection failed during {', '.join(sorted(errors))} check, attempting reconnect..."
         )
-    )[0]
-    instance.wait_until_running()
-
-    ec2logger = EC2InstanceConnectLogger(debug=False)
-    temp_key = EC2InstanceConnectKey(ec2logger.get_logger())
-    ec2ic = boto3.client("ec2-instance-connect", region_name="us-east-1")
-    response = ec2ic.send_ssh_public_key(
-        InstanceId=instance.id,
-        InstanceOSUser="ubuntu",
-        SSHPublicKey=temp_key.get_pub_key(),
+        runner.host = provider.connect()
+
+    wait_until_ready(
+        HEALTH_CHECKS,
+        deadline=HEALTH_CHECK_DEADLINE,
+        on_error=reconnect,
+        batch_probe=probe,
+        on_ready=lambda state: boot_timeline.mark(f"{state.name}_ready"),
     )
-    assert response["Success"]
-
-    # instance doesn't have public ip yet
-    while not instance.public_ip_address:
-        logger.warning("waiting for ip to be available")
-        sleep(5)
-        instance.reload()
-
-    while True:
-        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        if sock.connect_ex((instance.public_ip_address, 22)) == 0:
-            break
-        else:
-            logger.warning("waiting for ssh to be available")
-            sleep(10)
-
-    def get_ssh_connection(instance_ip, ssh_identity_file, max_retries=10):
-        for attempt in range(max_retries):
-            try:
-                return testinfra.get_host(
-                    f"paramiko://ubuntu@{instance_ip}?timeout=60",
-                    ssh_identity_file=ssh_identity_file,
-                )
-            except Exception as e:
-                if attempt == max_retries - 1:
-                    raise
-                logger.warning(
-                    f"Ssh connection failed, retrying: {attempt + 1}/{max_retries} failed, retrying ..."
-                )
-                sleep(5)
-
-    host = get_ssh_connection(
-        # paramiko is an ssh backend
-        instance.public_ip_address,
-        temp_key.get_priv_key_file(),
+    logger.info(f"health check round trips: {runner.report()}")
+
+    analyze = runner.run(
+        {
+            "time": "systemd-analyze time",
+            "blame": "systemd-analyze blame",
+            "critical_chain": "systemd-analyze critical-chain --no-pager",
+        }
     )
+    boot_timeline.attach_systemd_analyze(
+        analyze["time"].stdout, analyze["blame"].stdout, analyze["critical_chain"].stdout
+    )
+    boot_timeline.write(BOOT_TIMELINE_OUTPUT)
+    logger.info(f"boot timeline written to {BOOT_TIMELINE_OUTPUT}: {boot_timeline.events}")
+
+
+@pytest.fixture(scope="session")
+def provisioned(boot_timeline, tmp_path_factory):
+    """
+    Description of the booted, healthy host.
+
+    Under pytest-xdist the first worker provisions the host and the others
+    attach to it; the last worker to finish destroys it.
+    """
+
+    def create():
+        provider = get_provider(TESTINFRA_PROVIDER, boot_timeline)
+        try:
+            provider.start(render_user_data(provider.ssh_authorized_keys))
+            wait_for_services(provider, boot_timeline)
+        except BaseException:
+            provider.stop()
+            raise
+        return {"provider": provider.name, **provider.describe()}
 
-    def is_healthy(host, instance_ip, ssh_identity_file) -> bool:
-        health_checks = [
-            (
-                "postgres",
-                lambda h: h.run("sudo -u postgres /usr/bin/pg_isready -U postgres"),
-            ),
-            (
-                "adminapi",
-                lambda h: h.run(
-                    f"curl -sf -k --connect-timeout 30 --max-time 60 https://localhost:8085/health -H 'apikey: {capitala_admin_key}'"
-                ),
-            ),
-            (
-                "postgrest",
-                lambda h: h.run(
-                    "curl -sf --connect-timeout 30 --max-time 60 http://localhost:3001/ready"
-                ),
-            ),
-            (
-                "gotrue",
-                lambda h: h.run(
-                    "curl -sf --connect-timeout 30 --max-time 60 http://localhost:8081/health"
-                ),
-            ),
-            ("kong", lambda h: h.run("sudo kong health")),
-            ("fail2ban", lambda h: h.run("sudo fail2ban-client status")),
-        ]
-
-        for service, check in health_checks:
-            try:
-                cmd = check(host)
-                if cmd.failed is True:
-                    logger.warning(f"{service} not ready")
-                    return False
-            except Exception:
-                logger.warning(
-                    f"Connection failed during {service} check, attempting reconnect..."
-                )
-                host = get_ssh_connection(instance_ip, ssh_identity_file)
-                return False
-
-        return True
-
-    while True:
-        if is_healthy(
-            host=host,
-            instance_ip=instance.public_ip_address,
-            ssh_identity_file=temp_key.get_priv_key_file(),
-        ):
-            break
-        sleep(1)
+    def destroy(description):
+        # at the end of the test suite, destroy the instance
+        get_provider(description["provider"], boot_timeline).attach(description).stop()
 
+    with shared_across_workers("ami-host", tmp_path_factory, create, destroy) as description:
+        yield description
+
+
+@pytest.fixture(scope="session")
+def provider(provisioned, boot_timeline):
+    return get_provider(provisioned["provider"], boot_timeline).attach(provisioned)
+
+
+# scope='session' uses the same container for all the tests;
+# scope='function' uses a new container per test function.
+@pytest.fixture(scope="session")
+def host(provider):
     # return a testinfra connection to the instance
-    yield host
+    return provider.connect()
+
 
-    # at the end of the test suite, destroy the instance
-    instance.terminate()
+@pytest.fixture(scope="session")
+def base_url(provider):
+    return provider.base_url
+
+
+@pytest.fixture(scope="session")
+def batch(host):
+    runner = BatchRunner(host)
+    yield runner
+    logger.info(f"batched command round trips: {runner.report()}")
+
+
+def test_services_are_active(batch):
+    services = ["postgresql", "pgbouncer", "postgrest", "gotrue", "kong", "adminapi", "fail2ban"]
+    results = batch.run({service: f"systemctl is-active {service}" for service in services})
+    inactive = {
+        service: result.stdout.strip()
+        for service, result in results.items()
+        if result.failed
+    }
+    assert inactive == {}
+
+
+def test_boot_time_has_not_regressed(provisioned):
+    if not os.path.exists(BOOT_TIMELINE_BASELINE):
+        pytest.skip(f"no boot timeline baseline at {BOOT_TIMELINE_BASELINE}")
+    with open(BOOT_TIMELINE_BASELINE) as f:
+        baseline = json.load(f)
+    # read the artefact rather than the fixture: under xdist only the worker
+    # that provisioned the host recorded the timeline
+    with open(BOOT_TIMELINE_OUTPUT) as f:
+        current = json.load(f)
+    assert compare_timelines(current, baseline) == []
 
 
 def test_postgrest_is_running(host):
@@ -355,124 +351,137 @@ def test_postgrest_is_running(host):
     assert postgrest.is_running
 
 
-def test_postgrest_responds_to_requests(host):
-    res = requests.get(
-        f"http://{host.backend.get_hostname()}/rest/v1/",
-        headers={
-            "apikey": anon_key,
-            "authorization": f"Bearer {anon_key}",
-        },
-    )
-    assert res.ok
+storage_headers = {"accept-profile": "storage"}
+
+POSTGREST_CASES = [
+    RequestShape(
+        "responds_to_requests",
+        "/rest/v1/",
+        {"apikey": anon_key, "authorization": f"Bearer {anon_key}"},
+    ),
+    RequestShape(
+        "can_connect_to_db",
+        "/rest/v1/buckets",
+        {"apikey": service_role_key, "authorization": f"Bearer {service_role_key}", **storage_headers},
+    ),
+    # There would be an error if the `apikey` query parameter isn't removed,
+    # since PostgREST treats query parameters as conditions.
+    #
+    # Worth testing since remove_apikey_query_parameters uses regexp instead
+    # of parsed query parameters.
+    RequestShape(
+        "starting_apikey_query_parameter_is_removed",
+        "/rest/v1/buckets",
+        storage_headers,
+        [("apikey", service_role_key), ("id", "eq.absent"), ("name", "eq.absent")],
+    ),
+    RequestShape(
+        "middle_apikey_query_parameter_is_removed",
+        "/rest/v1/buckets",
+        storage_headers,
+        [("id", "eq.absent"), ("apikey", service_role_key), ("name", "eq.absent")],
+    ),
+    RequestShape(
+        "ending_apikey_query_parameter_is_removed",
+        "/rest/v1/buckets",
+        storage_headers,
+        [("id", "eq.absent"), ("name", "eq.absent"), ("apikey", service_role_key)],
+    ),
+    # There would be an error if the empty key query parameter isn't removed,
+    # since PostgREST treats empty key query parameters as malformed input.
+    #
+    # Worth testing since remove_apikey_and_empty_key_query_parameters uses regexp instead
+    # of parsed query parameters.
+    RequestShape(
+        "starting_empty_key_query_parameter_is_removed",
+        "/rest/v1/buckets",
+        storage_headers,
+        [("", "empty_key"), ("id", "eq.absent"), ("apikey", service_role_key)],
+    ),
+    RequestShape(
+        "middle_empty_key_query_parameter_is_removed",
+        "/rest/v1/buckets",
+        storage_headers,
+        [("apikey", service_role_key), ("", "empty_key"), ("id", "eq.absent")],
+    ),
+    RequestShape(
+        "ending_empty_key_query_parameter_is_removed",
+        "/rest/v1/buckets",
+        storage_headers,
+        [("id", "eq.absent"), ("apikey", service_role_key), ("", "empty_key")],
+    ),
+]
 
 
-def test_postgrest_can_connect_to_db(host):
-    res = requests.get(
-        f"http://{host.backend.get_hostname()}/rest/v1/buckets",
-        headers={
-            "apikey": service_role_key,
-            "authorization": f"Bearer {service_role_key}",
-            "accept-profile": "storage",
-        },
-    )
-    assert res.ok
-
-
-# There would be an error if the `apikey` query parameter isn't removed,
-# since PostgREST treats query parameters as conditions.
-#
-# Worth testing since remove_apikey_query_parameters uses regexp instead
-# of parsed query parameters.
-def test_postgrest_starting_apikey_query_parameter_is_removed(host):
-    res = requests.get(
-        f"http://{host.backend.get_hostname()}/rest/v1/buckets",
-        headers={
-            "accept-profile": "storage",
-        },
-        params={
-            "apikey": service_role_key,
-            "id": "eq.absent",
-            "name": "eq.absent",
-        },
-    )
-    assert res.ok
-
-
-def test_postgrest_middle_apikey_query_parameter_is_removed(host):
-    res = requests.get(
-        f"http://{host.backend.get_hostname()}/rest/v1/buckets",
-        headers={
-            "accept-profile": "storage",
-        },
-        params={
-            "id": "eq.absent",
-            "apikey": service_role_key,
-            "name": "eq.absent",
-        },
-    )
-    assert res.ok
-
-
-def test_postgrest_ending_apikey_query_parameter_is_removed(host):
-    res = requests.get(
-        f"http://{host.backend.get_hostname()}/rest/v1/buckets",
-        headers={
-            "accept-profile": "storage",
-        },
-        params={
-            "id": "eq.absent",
-            "name": "eq.absent",
-            "apikey": service_role_key,
-        },
-    )
-    assert res.ok
-
-
-# There would be an error if the empty key query parameter isn't removed,
-# since PostgREST treats empty key query parameters as malformed input.
-#
-# Worth testing since remove_apikey_and_empty_key_query_parameters uses regexp instead
-# of parsed query parameters.
-def test_postgrest_starting_empty_key_query_parameter_is_removed(host):
-    res = requests.get(
-        f"http://{host.backend.get_hostname()}/rest/v1/buckets",
-        headers={
-            "accept-profile": "storage",
-        },
-        params={
-            "": "empty_key",
-            "id": "eq.absent",
-            "apikey": service_role_key,
-        },
+@pytest.fixture(scope="session")
+def http_session():
+    session = make_session(len(POSTGREST_CASES))
+    yield session
+    session.close()
+
+
+@pytest.fixture(scope="session")
+def postgrest_responses(base_url, http_session):
+    """Send every POSTGREST_CASES request concurrently over one pooled session."""
+
+    def send(case):
+        try:
+            return http_session.get(
+                base_url + case.path, headers=case.headers, params=case.params, timeout=60
+            )
+        except requests.RequestException as e:
+            return e
+
+    start = time.monotonic()
+    with ThreadPoolExecutor(max_workers=len(POSTGREST_CASES)) as pool:
+        responses = dict(
+            zip([case.name for case in POSTGREST_CASES], pool.map(send, POSTGREST_CASES))
+        )
+    logger.info(
+        f"{len(POSTGREST_CASES)} PostgREST cases took {time.monotonic() - start:.3f}s wall time"
     )
-    assert res.ok
-
-
-def test_postgrest_middle_empty_key_query_parameter_is_removed(host):
-    res = requests.get(
-        f"http://{host.backend.get_hostname()}/rest/v1/buckets",
-        headers={
-            "accept-profile": "storage",
-        },
-        params={
-            "apikey": service_role_key,
-            "": "empty_key",
-            "id": "eq.absent",
-        },
+    return responses
+
+
+@pytest.mark.parametrize("case", POSTGREST_CASES, ids=lambda case: case.name)
+def test_postgrest(case, postgrest_responses):
+    res = postgrest_responses[case.name]
+    if isinstance(res, Exception):
+        raise res
+    assert res.ok, f"{res.status_code} {res.text}"
+
+
+@pytest.mark.skipif(not HTTP_BENCH_DURATION, reason="HTTP_BENCH_DURATION not set")
+def test_postgrest_load(base_url):
+    report = run_benchmark(
+        base_url,
+        postgrest_shapes(anon_key, service_role_key),
+        concurrency=HTTP_BENCH_CONCURRENCY,
+        duration=HTTP_BENCH_DURATION,
     )
-    assert res.ok
-
-
-def test_postgrest_ending_empty_key_query_parameter_is_removed(host):
-    res = requests.get(
-        f"http://{host.backend.get_hostname()}/rest/v1/buckets",
-        headers={
-            "accept-profile": "storage",
-        },
-        params={
-            "id": "eq.absent",
-            "apikey": service_role_key,
-            "": "empty_key",
-        },
+    with open(HTTP_BENCH_OUTPUT, "w") as f:
+        json.dump(report, f, indent=2)
+    logger.info(f"http benchmark written to {HTTP_BENCH_OUTPUT}: {report['total']}")
+    assert report["total"]["errors"] == 0, report["error_samples"]
+
+
+@pytest.mark.skipif(not FOOTPRINT_DURATION, reason="FOOTPRINT_DURATION not set")
+def test_service_footprint(host, base_url):
+    report = measure(
+        lambda duration: sample_host(host, SERVICES, duration),
+        idle=FOOTPRINT_DURATION,
+        load=FOOTPRINT_DURATION,
+        generate_load=lambda duration: run_benchmark(
+            base_url,
+            postgrest_shapes(anon_key, service_role_key),
+            concurrency=HTTP_BENCH_CONCURRENCY,
+            duration=duration,
+            warmup=0,
+        )["total"],
     )
-    assert res.ok
+    with open(FOOTPRINT_OUTPUT, "w") as f:
+        json.dump(report, f, indent=2)
+    logger.info(f"service footprint written to {FOOTPRINT_OUTPUT}:\n{format_report(report)}")
+    if os.path.exists(FOOTPRINT_BASELINE):
+        with open(FOOTPRINT_BASELINE) as f:
+            assert compare_footprints(report, json.load(f)) == []
@@ -0,0 +1,49 @@
+from boot_timeline import (
+    BootTimeline,
+    compare_timelines,
+    parse_blame,
+    parse_duration,
+    parse_startup_time,
+)
+
+
+def test_parse_duration():
+    assert parse_duration("1min 2.5s") == 62.5
+    assert parse_duration("850ms") == 0.85
+    assert parse_duration("cloud-init.service") is None
+
+
+def test_parse_systemd_analyze_output():
+    assert parse_startup_time(
+        "Startup finished in 2.345s (kernel) + 1min 20.123s (userspace) = 1min 22.468s\n"
+        "graphical.target reached after 1min 19.8s in userspace\n"
+    ) == {"kernel": 2.345, "userspace": 80.123, "total": 82.468}
+    assert parse_blame("1min 2.345s cloud-init.service\n    850ms postgresql.service\n") == [
+        {"unit": "cloud-init.service", "seconds": 62.345},
+        {"unit": "postgresql.service", "seconds": 0.85},
+    ]
+
+
+def test_only_the_first_mark_counts():
+    now = [100.0]
+    timeline = BootTimeline(clock=lambda: now[0])
+    now[0] = 112.5
+    timeline.mark("ssh_usable")
+    now[0] = 130.0
+    timeline.mark("ssh_usable")
+    assert timeline.to_dict()["events"] == {"ssh_usable": 12.5}
+
+
+def test_compare_timelines_reports_large_slowdowns_only():
+    baseline = {
+        "events": {"ssh_usable": 40.0, "postgres_ready": 90.0, "kong_ready": 100.0},
+        "systemd": {"startup": {"userspace": 30.0}},
+    }
+    current = {
+        "events": {"ssh_usable": 45.0, "postgres_ready": 150.0},
+        "systemd": {"startup": {"userspace": 31.0}},
+    }
+    assert compare_timelines(current, baseline) == [
+        {"name": "kong_ready", "baseline": 100.0, "current": None, "delta": None},
+        {"name": "postgres_ready", "baseline": 90.0, "current": 150.0, "delta": 60.0},
+    ]
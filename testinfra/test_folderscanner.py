@@ -0,0 +1,371 @@
+import argparse
+import importlib.util
+import io
+import os
+import tarfile
+import threading
+import time
+import zipfile
+
+import pytest
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SCRIPT = os.path.join(REPO_ROOT, "folderscanner_notest.py")
+
+
+@pytest.fixture(scope="module")
+def scanner():
+    spec = importlib.util.spec_from_file_location("folderscanner", SCRIPT)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def write_files(root, files):
+    for rel_path, content in files.items():
+        path = root / rel_path
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(content)
+
+
+def test_python_minifier_keeps_strings(scanner):
+    source = 'import os  # os\n\n\ndef f():\n    """doc\n\n    # kept\n    """\n    return "#no"  # yes\n'
+    assert scanner.minify_content(source, "mod.py") == (
+        'import os\ndef f():\n    """doc\n\n    # kept\n    """\n    return "#no"\n'
+    )
+
+
+def test_shell_minifier_keeps_heredocs(scanner):
+    source = "#!/bin/sh\n# comment\ncat <<-EOF  # heredoc\n\t# kept\n\tEOF\necho '#no' # yes\n"
+    assert scanner.minify_content(source, "run.sh") == (
+        "#!/bin/sh\ncat <<-EOF\n\t# kept\n\tEOF\necho '#no'\n"
+    )
+
+
+@pytest.mark.parametrize("line", ["x=$((1<<y))", "cat <<<EOF", "(( z = 1 << 3 ))"])
+def test_shell_minifier_ignores_shifts_and_here_strings(scanner, line):
+    # None of these open a heredoc, so the comments after them are still stripped
+    source = f"{line}  # first\n# second\necho done # third\n"
+    assert scanner.minify_content(source, "run.sh") == f"{line}\necho done\n"
+
+
+def test_yaml_minifier_keeps_block_scalars(scanner):
+    source = 'a: 1  # c\n# full\nb: |\n  # kept\n\n  x\nc: "#q"\n'
+    assert scanner.minify_content(source, "vars.yml.j2") == 'a: 1\nb: |\n  # kept\n\n  x\nc: "#q"\n'
+
+
+def test_nix_minifier_keeps_indented_strings(scanner):
+    source = "{ a = 1; # c\n  b = ''\n    # kept\n  '';\n  /* block */ c = \"#s\";\n}\n"
+    assert scanner.minify_content(source, "default.nix") == (
+        "{ a = 1;\n  b = ''\n    # kept\n  '';\n    c = \"#s\";\n}\n"
+    )
+
+
+def test_sql_minifier_keeps_dollar_quoted_bodies(scanner):
+    source = (
+        "select 1; -- c\n/* b */\ncreate function f() returns int as $$\n  -- kept\n  select 1;\n"
+        "$$ language sql;\nselect '--no';\n"
+    )
+    assert scanner.minify_content(source, "init.sql") == (
+        "select 1;\ncreate function f() returns int as $$\n  -- kept\n  select 1;\n"
+        "$$ language sql;\nselect '--no';\n"
+    )
+
+
+def test_tree_collapses_large_directories(scanner, tmp_path):
+    files = {f"big/f{i:02}.txt": "x" * 10 for i in range(5)}
+    files.update({"big/deep/a.sql": "select 1;\n", "small/b.py": "b = 1\n", "top.md": "# top\n", "node_modules/x.js": ""})
+    write_files(tmp_path, files)
+    config = scanner.ScanConfig(paths=[str(tmp_path)], exclude_dirs={"node_modules"}, collapse_threshold=3)
+
+    tree = scanner.TreeNode(tmp_path.name)
+    listed = sorted(rel for _, rel, _ in scanner.iter_root_files(str(tmp_path), config, tree=tree))
+    assert listed == sorted(path for path in files if not path.startswith("node_modules"))
+
+    big = tree.children[0]
+    assert (big.name, big.collapsed, big.file_count, big.total_size) == ("big", True, 6, 60)
+    assert big.extensions == {".txt": 5, ".sql": 1}
+    assert big.samples == ["a.sql", "f00.txt", "f01.txt"]
+    assert scanner.render_directory_tree(tree) == "\n".join([
+        f"{tmp_path.name}/",
+        "    top.md",
+        "    big/ [collapsed: 6 files, 60 B; .txt 5, .sql 1; e.g. a.sql, f00.txt, f01.txt]",
+        "    small/",
+        "        b.py",
+    ])
+
+
+def test_tree_respects_depth_limit(scanner, tmp_path):
+    write_files(tmp_path, {"a/b/c.txt": "c", "a/d.txt": "d", "e.txt": "e"})
+    config = scanner.ScanConfig(paths=[str(tmp_path)], depth_specs={str(tmp_path): 1})
+    assert scanner.get_directory_structure(str(tmp_path), config) == "\n".join([
+        f"{tmp_path.name}/", "    e.txt", "    a/", "        d.txt",
+    ])
+
+
+@pytest.mark.parametrize("value, rate", [("100", 100), ("512K", 512 * 1024), ("10M", 10 * 1024 ** 2), ("2mb", 2 * 1024 ** 2)])
+def test_parse_rate(scanner, value, rate):
+    assert scanner.parse_rate(value) == rate
+
+
+def test_parse_rate_rejects_garbage(scanner):
+    with pytest.raises(argparse.ArgumentTypeError):
+        scanner.parse_rate("fast")
+
+
+def test_throttle_counts_reads(scanner, tmp_path):
+    write_files(tmp_path, {"a.txt": "a" * 100, "b/c.txt": "c" * 50})
+    throttle = scanner.IOThrottle(bytes_per_sec=1024 * 1024, files_per_sec=1000)
+    file_data = scanner.walk_directories(scanner.ScanConfig(paths=[str(tmp_path)]), throttle=throttle)
+    assert len(file_data) == 2
+    assert (throttle.files_read, throttle.bytes_read) == (2, 150)
+    assert "limit 1000 files/s" in throttle.report()
+
+
+@pytest.mark.parametrize("options, limits", [
+    ({}, None),
+    ({"max_bytes_per_sec": 1024}, (1024, 0, False)),
+    ({"max_files_per_sec": 5}, (0, 5, False)),
+    ({"low_impact": True}, (4 * 1024 * 1024, 100, True)),
+    ({"low_impact": True, "max_files_per_sec": 0}, (4 * 1024 * 1024, 0, True)),
+])
+def test_unspecified_limits_are_unlimited_without_low_impact(scanner, options, limits):
+    args = argparse.Namespace(**{"low_impact": False, "max_bytes_per_sec": None, "max_files_per_sec": None, **options})
+    throttle = scanner.throttle_from_args(args)
+    if limits is None:
+        assert throttle is None
+    else:
+        assert (throttle.bytes_per_sec, throttle.files_per_sec, throttle.drop_cache) == limits
+
+
+def test_throttle_covers_directory_listings(scanner, tmp_path):
+    write_files(tmp_path, {"a/b/c.txt": "c\n", "d.txt": "d\n"})
+    config = scanner.ScanConfig(paths=[str(tmp_path)])
+    throttle = scanner.IOThrottle(files_per_sec=1000)
+    structures = {}
+    scanner.walk_directories(config, throttle=throttle, structures=structures)
+    assert (throttle.dirs_listed, throttle.files_read) == (3, 2)
+    assert "c.txt" in structures[str(tmp_path)]
+
+
+@pytest.fixture
+def archives(tmp_path):
+    members = {"pkg/setup.sh": "# comment\necho hi\n", "pkg/.git/HEAD": "ref\n", "README.md": "readme\n"}
+    tar_path = tmp_path / "src.tar.gz"
+    with tarfile.open(tar_path, "w:gz") as tar:
+        for name, content in members.items():
+            data = content.encode()
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            tar.addfile(info, io.BytesIO(data))
+    zip_path = tmp_path / "src.zip"
+    with zipfile.ZipFile(zip_path, "w", compression=zipfile.ZIP_DEFLATED) as zf:
+        for name, content in members.items():
+            zf.writestr(name, content)
+    return [str(tar_path), str(zip_path)]
+
+
+def test_archive_members_are_scanned_like_files(scanner, archives):
+    for archive in archives:
+        config = scanner.ScanConfig(paths=[archive], exclude_dirs={".git"}, minify=True)
+        assert sorted(scanner.scan_archive(archive, config)) == [
+            (archive, "README.md", "readme\n"),
+            (archive, "pkg/setup.sh", "echo hi\n"),
+        ]
+
+
+def test_archive_structure_lists_members(scanner, archives):
+    for archive in archives:
+        config = scanner.ScanConfig(paths=[archive], exclude_dirs={".git"})
+        dir_files = [(rel_path, content) for _, rel_path, content in scanner.scan_archive(archive, config)]
+        members = scanner.archive_members(archive, dir_files)
+        assert scanner.get_directory_structure(archive, config, members) == "\n".join([
+            f"{os.path.basename(archive)}/", "    README.md", "    pkg/", "        setup.sh",
+        ])
+
+
+def test_archive_member_paths_stay_inside_the_archive(scanner, tmp_path):
+    names = ["/etc/passwd", "../../x", "pkg/../../y", "pkg/../ok.txt"]
+    tar_path = tmp_path / "evil.tar"
+    with tarfile.open(tar_path, "w") as tar:
+        for name in names:
+            info = tarfile.TarInfo(name)
+            info.size = 2
+            tar.addfile(info, io.BytesIO(b"x\n"))
+    zip_path = tmp_path / "evil.zip"
+    with zipfile.ZipFile(zip_path, "w") as zf:
+        for name in names:
+            zf.writestr(zipfile.ZipInfo(name), "x\n")
+
+    for archive in (str(tar_path), str(zip_path)):
+        config = scanner.ScanConfig(paths=[archive])
+        file_data = scanner.scan_archive(archive, config)
+        assert sorted(rel_path for _, rel_path, _ in file_data) == ["etc/passwd", "ok.txt"]
+        members = scanner.archive_members(archive, [(rel_path, c) for _, rel_path, c in file_data])
+        assert sorted(members) == [("etc/passwd", 2), ("ok.txt", 2)]
+
+
+def test_encrypted_zip_members_are_skipped(scanner, tmp_path):
+    archive = tmp_path / "mixed.zip"
+    with zipfile.ZipFile(archive, "w") as zf:
+        zf.writestr("secret.txt", "hidden\n")
+        zf.writestr("plain.txt", "visible\n")
+    # Mark secret.txt encrypted in the central directory, which is what zipfile checks
+    data = bytearray(archive.read_bytes())
+    entry = data.index(b"PK\x01\x02")
+    assert data[entry + 46:entry + 56] == b"secret.txt"
+    data[entry + 8] |= 0x1
+    archive.write_bytes(bytes(data))
+
+    config = scanner.ScanConfig(paths=[str(archive)])
+    assert scanner.scan_archive(str(archive), config) == [(str(archive), "plain.txt", "visible\n")]
+
+
+def test_archive_structure_uses_stored_sizes(scanner, archives):
+    for archive in archives:
+        # Minified content is 15 bytes; the stored members are 25
+        config = scanner.ScanConfig(paths=[archive], exclude_dirs={".git"}, minify=True, collapse_threshold=1)
+        expected = f"{os.path.basename(archive)}/ [collapsed: 2 files, 25 B; .md 1, .sh 1; e.g. README.md, setup.sh]"
+        structures = {}
+        file_data = scanner.walk_directories(config, structures=structures)
+        assert structures == {archive: expected}
+        dir_files = [(rel_path, content) for _, rel_path, content in file_data]
+        assert scanner.root_structure(archive, dir_files, config) == expected
+
+        service = scanner.ScanService([os.path.dirname(archive)], use_inotify=False)
+        for _ in range(2):
+            _, service_structures, _ = service.collect(config)
+            assert service_structures == {archive: expected}
+
+
+def test_manifest_diff_reports_changes(scanner, tmp_path):
+    root = tmp_path / "root"
+    write_files(root, {"keep.txt": "same words\n", "edit.txt": "old\n", "gone.txt": "bye\n"})
+    config = scanner.ScanConfig(paths=[str(root)])
+    manifest_path = str(tmp_path / "manifest.json")
+    file_stats = {}
+    file_data = scanner.walk_directories(config, file_stats=file_stats)
+    scanner.write_manifest(scanner.build_manifest(file_data, config, file_stats), manifest_path)
+
+    (root / "edit.txt").write_text("new content\n")
+    (root / "gone.txt").unlink()
+    (root / "added.txt").write_text("hello\n")
+    stats = scanner.ScanStats()
+    diffs, manifest = scanner.diff_against_manifest(config, scanner.load_manifest(manifest_path), stats)
+
+    [diff] = diffs
+    assert diff.added == [("added.txt", "hello\n")]
+    assert diff.modified == [("edit.txt", "new content\n")]
+    assert diff.removed == ["gone.txt"]
+    assert diff.unchanged == 1
+    assert (diff.words_before, diff.words_after) == (4, 5)
+    # keep.txt matched by size and mtime and was not read again
+    assert stats.files_read == 2
+    assert sorted(manifest["roots"][str(root)]["files"]) == ["added.txt", "edit.txt", "keep.txt"]
+
+
+def test_manifest_keeps_the_stat_taken_at_read_time(scanner, tmp_path):
+    root = tmp_path / "root"
+    write_files(root, {"edit.txt": "old\n"})
+    config = scanner.ScanConfig(paths=[str(root)])
+    file_stats = {}
+    file_data = scanner.walk_directories(config, file_stats=file_stats)
+
+    # Rewritten after it was read but before the manifest is built
+    (root / "edit.txt").write_text("rewritten\n")
+    manifest = scanner.build_manifest(file_data, config, file_stats)
+
+    [diff], _ = scanner.diff_against_manifest(config, manifest)
+    assert diff.modified == [("edit.txt", "rewritten\n")]
+
+
+def wait_for(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "condition not met in time"
+        time.sleep(0.02)
+
+
+def test_scan_service_round_trip(scanner, tmp_path):
+    root = tmp_path / "root"
+    write_files(root, {"a.sh": "# c\necho a\n", "sub/b.txt": "b\n"})
+    service = scanner.ScanService([str(root)])
+    socket_path = str(tmp_path / "scan.sock")
+    server = scanner.ScanServer(socket_path, service)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        config = scanner.ScanConfig(paths=[str(root)], minify=True)
+        request = scanner.scan_request(config)
+        header, payload = scanner.request_scan(socket_path, request)
+        assert (header["files"], header["hits"], header["misses"]) == (2, 0, 2)
+
+        expected = io.StringIO()
+        scanner.write_output(expected, scanner.walk_directories(config), config)
+        assert payload.decode() == expected.getvalue()
+
+        header, again = scanner.request_scan(socket_path, request)
+        assert (header["hits"], header["misses"], again) == (2, 0, payload)
+
+        (root / "sub" / "b.txt").write_text("changed\n")
+        if service.watcher is not None:
+            wait_for(lambda: any(index.dirty for index in service.indexes.values()))
+        header, payload = scanner.request_scan(socket_path, request)
+        assert (header["hits"], header["misses"]) == (1, 1)
+        assert "changed" in payload.decode()
+
+        header, _ = scanner.request_scan(socket_path, {"command": "metrics"})
+        assert header["metrics"]["requests"] == 3
+        with pytest.raises(RuntimeError, match="Scan service error"):
+            scanner.request_scan(socket_path, {"paths": [str(tmp_path)]})
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def test_scan_service_refuses_symlinks_out_of_its_roots(scanner, tmp_path):
+    root, outside = tmp_path / "root", tmp_path / "outside"
+    write_files(root, {"a.txt": "a\n"})
+    write_files(outside, {"secret.txt": "s\n"})
+    (root / "escape").symlink_to(outside)
+    (tmp_path / "alias").symlink_to(root)
+    service = scanner.ScanService([str(tmp_path / "alias")], use_inotify=False)
+
+    with pytest.raises(ValueError, match="not under a registered root"):
+        service.request_config({"paths": [str(root / "escape")]})
+    assert service.request_config({"paths": [str(root)]}).paths == [str(root)]
+
+
+def test_scan_service_keeps_a_bounded_number_of_indexes(scanner, tmp_path):
+    root = tmp_path / "root"
+    write_files(root, {"a.txt": "a\n"})
+    service = scanner.ScanService([str(root)], use_inotify=False, max_indexes=2)
+    for threshold in (10, 20, 10, 30):
+        service.collect(scanner.ScanConfig(paths=[str(root)], collapse_threshold=threshold))
+    assert [key[-1] for key in service.indexes] == [10, 30]
+
+
+def test_scan_service_sees_changes_made_during_the_walk(scanner, tmp_path, monkeypatch):
+    root = tmp_path / "root"
+    write_files(root, {"a.txt": "a\n", "sub/b.txt": "b\n"})
+    service = scanner.ScanService([str(root)])
+    if service.watcher is None:
+        pytest.skip("inotify is not available")
+    list_directory = scanner._list_directory
+
+    def list_then_change(dir_path, rel_path, config):
+        listing = list_directory(dir_path, rel_path, config)
+        if dir_path == str(root / "sub") and not (root / "sub" / "late.txt").exists():
+            # Lands after sub was listed but before the walk finished
+            (root / "sub" / "late.txt").write_text("late\n")
+        return listing
+
+    monkeypatch.setattr(scanner, "_list_directory", list_then_change)
+    config = scanner.ScanConfig(paths=[str(root)])
+    file_data, _, _ = service.collect(config)
+    assert sorted(rel for _, rel, _ in file_data) == ["a.txt", "sub/b.txt"]
+
+    wait_for(lambda: all(index.dirty for index in service.indexes.values()))
+    file_data, structures, _ = service.collect(config)
+    assert sorted(rel for _, rel, _ in file_data) == ["a.txt", "sub/b.txt", "sub/late.txt"]
+    assert "late.txt" in structures[str(root)]
@@ -0,0 +1,70 @@
+from footprint import compare_footprints, measure, sample_local
+
+
+def make_cgroup(root, path, memory, usage_usec):
+    cgroup = root / path
+    cgroup.mkdir(parents=True)
+    (cgroup / "memory.current").write_text(f"{memory}\n")
+    (cgroup / "memory.peak").write_text(f"{memory * 2}\n")
+    (cgroup / "memory.stat").write_text(f"anon {memory // 2}\nfile {memory // 4}\n")
+    (cgroup / "cpu.stat").write_text(f"usage_usec {usage_usec}\nuser_usec 0\nsystem_usec 0\n")
+    return cgroup
+
+
+def test_sampler_reads_cgroup_files(tmp_path):
+    (tmp_path / "cgroup.controllers").write_text("cpu memory\n")
+    make_cgroup(tmp_path, "services.slice/postgrest.service", 50 * 2**20, 1000)
+    report = sample_local(
+        ["postgrest", "gotrue"],
+        duration=0.2,
+        interval=0.05,
+        root=str(tmp_path),
+        cgroups={"postgrest": "/services.slice/postgrest.service", "gotrue": ""},
+    )
+    postgrest = report["units"]["postgrest"]
+    assert postgrest["memory_current_max"] == 50 * 2**20
+    assert postgrest["memory_peak"] == 100 * 2**20
+    assert postgrest["anon"] == 25 * 2**20
+    assert postgrest["cpu_usage_usec"] == 0
+    assert report["units"]["gotrue"] == {"error": "not running"}
+
+
+def test_measure_runs_load_alongside_the_load_phase():
+    calls = []
+
+    def sample(duration):
+        calls.append(("sample", duration))
+        return {"elapsed": duration, "units": {}}
+
+    report = measure(sample, idle=5, load=10, generate_load=lambda duration: calls.append(("load", duration)) or "done")
+    assert sorted(calls) == [("load", 10), ("sample", 5), ("sample", 10)]
+    assert list(report["phases"]) == ["idle", "load"]
+    assert report["load_result"] == "done"
+
+
+def test_compare_footprints_flags_growth_above_the_floors():
+    mib = 2**20
+
+    def phase(**units):
+        return {"elapsed": 60, "units": units}
+
+    baseline = {"phases": {"idle": phase(
+        postgresql={"memory_current_max": 200 * mib, "cpu_percent": 1.0},
+        kong={"memory_current_max": 300 * mib, "cpu_percent": 2.0},
+        vector={"memory_current_max": 20 * mib, "cpu_percent": 0.5},
+        gotrue={"memory_current_max": 30 * mib, "cpu_percent": 0.1},
+    )}}
+    current = {"phases": {"idle": phase(
+        # +100 MiB
+        postgresql={"memory_current_max": 300 * mib, "cpu_percent": 1.5},
+        # +10%, +6 points
+        kong={"memory_current_max": 330 * mib, "cpu_percent": 8.0},
+        # doubled, but only by 10 MiB
+        vector={"memory_current_max": 30 * mib, "cpu_percent": 0.5},
+        gotrue={"error": "not running"},
+    )}}
+    assert [(r["unit"], r["metric"]) for r in compare_footprints(current, baseline)] == [
+        ("gotrue", "running"),
+        ("kong", "cpu_percent"),
+        ("postgresql", "memory_current_max"),
+    ]
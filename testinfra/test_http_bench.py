@@ -0,0 +1,72 @@
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+requests = pytest.importorskip("requests")
+
+from http_bench import RequestShape, percentile, run_benchmark
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        status = 404 if self.path.startswith("/missing") else 200
+        self.send_response(status)
+        self.send_header("Content-Length", "2")
+        self.end_headers()
+        self.wfile.write(b"[]")
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{httpd.server_address[1]}"
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def test_percentile_uses_nearest_rank():
+    samples = [float(n) for n in range(1, 101)]
+    assert percentile(samples, 50) == 50.0
+    assert percentile(samples, 99) == 99.0
+    assert percentile([3.0], 95) == 3.0
+    assert percentile([], 50) is None
+
+
+def test_benchmark_reports_latency_and_errors_per_shape(server):
+    shapes = [
+        RequestShape("ok", "/rest/v1/", params=[("apikey", "k"), ("", "empty_key")]),
+        RequestShape("missing", "/missing"),
+    ]
+
+    report = run_benchmark(server, shapes, concurrency=4, duration=0.3, warmup=0.1)
+
+    ok, missing = report["shapes"]["ok"], report["shapes"]["missing"]
+    assert ok["requests"] > 0 and ok["errors"] == 0
+    assert ok["p50_ms"] <= ok["p95_ms"] <= ok["p99_ms"] <= ok["max_ms"]
+    assert missing["errors"] == missing["requests"] > 0
+    assert missing["p50_ms"] is None
+    assert report["total"]["requests"] == ok["requests"] + missing["requests"]
+    assert report["error_samples"][0] == "missing: HTTP 404"
+
+
+def test_benchmark_leaves_a_callers_session_open(server):
+    closed = []
+
+    class Session(requests.Session):
+        def close(self):
+            closed.append(self)
+            super().close()
+
+    session = Session()
+    run_benchmark(server, [RequestShape("ok", "/")], concurrency=1, duration=0.05, warmup=0, session=session)
+    assert closed == []
+    assert session.get(server + "/").status_code == 200
+    session.close()
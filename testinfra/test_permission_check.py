@@ -0,0 +1,312 @@
+import ctypes
+import importlib.util
+import json
+import os
+import queue
+import signal
+import subprocess
+import sys
+import threading
+
+import pytest
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FIXTURES = os.path.join(REPO_ROOT, "testinfra", "fixtures", "permission_check")
+SCRIPT = os.path.join(REPO_ROOT, "ansible", "files", "permission_check.py")
+
+
+@pytest.fixture(scope="module")
+def permission_check():
+    spec = importlib.util.spec_from_file_location(
+        "permission_check", SCRIPT
+    )
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+@pytest.fixture
+def native_memberships(permission_check):
+    return permission_check.fetch_native_group_memberships(
+        os.path.join(FIXTURES, "passwd"),
+        os.path.join(FIXTURES, "group"),
+    )
+
+
+@pytest.fixture
+def osquery_memberships(permission_check, monkeypatch):
+    with open(os.path.join(FIXTURES, "osquery_user_groups.json")) as f:
+        recorded = f.read()
+    monkeypatch.setattr(permission_check, "run_osquery", lambda query: recorded)
+    return permission_check.fetch_osquery_group_memberships()
+
+
+def test_native_and_osquery_backends_agree(permission_check, native_memberships, osquery_memberships):
+    assert native_memberships == osquery_memberships
+    assert permission_check.cross_check(native_memberships, osquery_memberships) == []
+
+
+def test_native_backend_includes_primary_groups(native_memberships):
+    groups = {row["groupname"] for row in native_memberships["postgres"]}
+    assert groups == {"postgres", "ssl-cert"}
+
+
+def test_native_backend_ignores_members_without_passwd_entry(native_memberships):
+    assert "ghost" not in native_memberships
+
+
+def test_gshadow_disagreement_is_reported(permission_check):
+    assert permission_check.check_gshadow(os.path.join(FIXTURES, "group"), os.path.join(FIXTURES, "gshadow")) == [
+        {"groupname": "nixbld", "only_in_group": ["ghost"], "only_in_gshadow": []}
+    ]
+
+
+@pytest.fixture(scope="module")
+def baseline(permission_check):
+    return permission_check.load_baseline(permission_check.DEFAULT_BASELINE)
+
+
+@pytest.mark.parametrize("username", ["postgres", "pgbouncer", "wal-g", "postgrest", "root"])
+def test_fixture_users_match_baseline(permission_check, baseline, native_memberships, username):
+    assert permission_check.compare_results(username, native_memberships[username], baseline["users"][username]) is None
+
+
+def test_membership_diff_lists_missing_and_unexpected_groups(permission_check, baseline, native_memberships):
+    diff = permission_check.compare_results("adminapi", native_memberships["adminapi"], baseline["users"]["adminapi"])
+    assert "systemd-journal" in diff["missing"]
+    assert diff["unexpected"] == []
+
+
+def test_nixbld_users_are_checked(permission_check, native_memberships):
+    assert permission_check.check_nixbld_users(native_memberships) == []
+    native_memberships["nixbld1"].append({"groupname": "root", "username": "nixbld1"})
+    assert permission_check.check_nixbld_users(native_memberships) == [
+        {"username": "nixbld1", "expected": "nixbld", "actual": "root"}
+    ]
+
+
+def test_path_audit_reports_owner_group_and_mode(permission_check, tmp_path):
+    config_dir = tmp_path / "pgbouncer"
+    config_dir.mkdir()
+    config_file = config_dir / "pgbouncer.ini"
+    config_file.write_text("")
+    config_dir.chmod(0o700)
+    config_file.chmod(0o644)
+    users_by_uid = {os.getuid(): ("pgbouncer", os.getgid())}
+    groups_by_gid = {os.getgid(): "pgbouncer"}
+    specs = [
+        {"path": str(config_dir), "owner": "pgbouncer", "group": "pgbouncer", "mode": "0700", "recurse": True},
+        {"path": str(config_file), "owner": "postgres", "mode": "0700"},
+        {"path": str(tmp_path / "missing"), "owner": "pgbouncer"},
+    ]
+
+    diffs = permission_check.audit_paths(specs, users_by_uid, groups_by_gid, workers=2)
+
+    assert diffs == [
+        {"path": str(config_file), "field": "owner", "expected": "postgres", "actual": "pgbouncer"},
+        {"path": str(config_file), "field": "mode", "expected": "0700", "actual": "0644"},
+        {"path": str(tmp_path / "missing"), "field": "exists", "expected": True, "actual": False},
+    ]
+
+
+def test_bind_parameters_quotes_values_outside_literals(permission_check):
+    assert permission_check.bind_parameters(
+        "SELECT groupname FROM groups WHERE groupname = ? AND comment != '?' AND gid > ?", ("o'brien", 100)
+    ) == "SELECT groupname FROM groups WHERE groupname = 'o''brien' AND comment != '?' AND gid > 100"
+    with pytest.raises(ValueError):
+        permission_check.bind_parameters("SELECT ?", ())
+
+
+FAKE_OSQUERYI = """\
+import json, os, queue, sys, threading, time
+# stderr is flushed by a background writer, in order but late, like a buffered logger
+errors = queue.Queue()
+def write_errors():
+    while True:
+        message = errors.get()
+        time.sleep(0.2)
+        sys.stderr.write(message)
+        sys.stderr.flush()
+threading.Thread(target=write_errors, daemon=True).start()
+hanging = False
+for line in sys.stdin:
+    statement = line.strip().rstrip(";")
+    if hanging:
+        continue
+    if statement.startswith("SELECT * FROM stderr_frame_"):
+        errors.put("Error: no such table: " + statement.split()[-1] + "\\n")
+    elif statement.endswith("AS __frame__"):
+        marker = statement.split("'")[1]
+        sys.stdout.write("[\\n  " + json.dumps({"__frame__": marker}) + "\\n]\\n")
+        sys.stdout.flush()
+    elif statement == "SELECT late_error":
+        errors.put("Error: late failure\\n")
+    elif statement == "SELECT hang":
+        hanging = True
+    elif statement == "SELECT crash" and not os.path.exists(os.environ["CRASHED"]):
+        open(os.environ["CRASHED"], "w").close()
+        sys.exit(1)
+    else:
+        sys.stdout.write(json.dumps([{"value": statement}]) + "\\n")
+        sys.stdout.flush()
+"""
+
+
+@pytest.fixture
+def fake_osqueryi(tmp_path, monkeypatch):
+    binary = tmp_path / "osqueryi"
+    binary.write_text(f"#!{sys.executable}\n" + FAKE_OSQUERYI)
+    binary.chmod(0o755)
+    monkeypatch.setenv("CRASHED", str(tmp_path / "crashed"))
+    return str(binary)
+
+
+def test_osquery_session_frames_stdout_and_stderr(permission_check, fake_osqueryi):
+    with permission_check.OsquerySession(binary=fake_osqueryi, timeout=5) as session:
+        assert session.query("SELECT ?", ("a",)) == [{"value": "SELECT 'a'"}]
+        # The error reaches stderr after the stdout frame; it must not leak into the next query
+        with pytest.raises(RuntimeError, match="late failure"):
+            session.query("SELECT late_error")
+        assert session.query("SELECT 'b'") == [{"value": "SELECT 'b'"}]
+        assert session.restarts == 0
+
+
+def test_osquery_session_keeps_whitespace_inside_literals(permission_check, fake_osqueryi):
+    with permission_check.OsquerySession(binary=fake_osqueryi, timeout=5) as session:
+        assert session.query("SELECT ?,\n  'a  b';", ("two  spaces",)) == [
+            {"value": "SELECT 'two  spaces',   'a  b'"}
+        ]
+        assert session.query("SELECT ?", ("line\nbreak",)) == [
+            {"value": "SELECT 'line' || char(10) || 'break'"}
+        ]
+
+
+def test_osquery_session_gives_up_after_timing_out_twice(permission_check, fake_osqueryi):
+    with permission_check.OsquerySession(binary=fake_osqueryi, timeout=0.5) as session:
+        with pytest.raises(TimeoutError):
+            session.query("SELECT hang")
+        assert session.restarts == 2
+        assert session.process is None
+
+
+def test_osquery_session_retries_once_after_a_crash(permission_check, fake_osqueryi):
+    with permission_check.OsquerySession(binary=fake_osqueryi, timeout=5) as session:
+        assert session.query("SELECT crash") == [{"value": "SELECT crash"}]
+        assert session.restarts == 1
+
+
+def test_unreadable_paths_are_skipped_without_root(permission_check, tmp_path, monkeypatch):
+    readable = tmp_path / "pgbouncer-custom"
+    readable.mkdir()
+    hidden = str(tmp_path / "pgbouncer" / "userlist.txt")
+    real_lstat = os.lstat
+
+    def lstat(path, *args, **kwargs):
+        if path == hidden:
+            raise PermissionError(13, "Permission denied", path)
+        return real_lstat(path, *args, **kwargs)
+
+    monkeypatch.setattr(permission_check.os, "lstat", lstat)
+    specs = [{"path": hidden, "owner": "pgbouncer"}, {"path": str(readable)}]
+
+    monkeypatch.setattr(permission_check.os, "geteuid", lambda: 1000)
+    skipped = []
+    assert permission_check.audit_paths(specs, {}, {}, workers=1, skipped=skipped) == []
+    assert skipped == [{"path": hidden, "field": "skipped", "actual": "needs root"}]
+
+    monkeypatch.setattr(permission_check.os, "geteuid", lambda: 0)
+    assert permission_check.audit_paths(specs, {}, {}, workers=1) == [
+        {"path": hidden, "field": "error", "actual": f"[Errno 13] Permission denied: '{hidden}'"}
+    ]
+
+
+def test_inotify_skips_paths_it_may_not_watch(permission_check, tmp_path):
+    def denied(*args):
+        ctypes.set_errno(13)
+        return -1
+
+    inotify = permission_check.Inotify()
+    try:
+        inotify._libc = type("Libc", (), {"inotify_add_watch": staticmethod(denied)})()
+        assert inotify.add_watch(str(tmp_path), permission_check.Inotify.DIR_MASK) is None
+    finally:
+        inotify.close()
+
+
+def test_inotify_adds_to_the_mask_of_an_existing_watch(permission_check, tmp_path):
+    watched = tmp_path / "pgbouncer"
+    watched.mkdir()
+    inotify = permission_check.Inotify()
+    try:
+        wd = inotify.add_watch(str(watched), permission_check.Inotify.SELF_MASK | permission_check.Inotify.DIR_MASK)
+        # A later parent-style watch on the same directory must keep DELETE_SELF
+        assert inotify.add_watch(str(watched), permission_check.Inotify.DIR_MASK) == wd
+        watched.rmdir()
+        events = inotify.read_events(timeout=5)
+        assert any(event_wd == wd and mask & permission_check.Inotify.IN_DELETE_SELF
+                   for event_wd, mask, _ in events)
+    finally:
+        inotify.close()
+
+
+class DaemonEvents:
+    """Drift events read from a running --daemon, with a timeout per event."""
+
+    def __init__(self, process):
+        self.process = process
+        self.lines = queue.Queue()
+        threading.Thread(target=self._read, daemon=True).start()
+
+    def _read(self):
+        for line in self.process.stdout:
+            self.lines.put(json.loads(line))
+
+    def next(self, timeout=10):
+        event = self.lines.get(timeout=timeout)
+        del event["ts"]
+        return event
+
+
+def test_daemon_emits_drift_and_resolved_events(tmp_path):
+    passwd, group, config = tmp_path / "passwd", tmp_path / "group", tmp_path / "pgbouncer.ini"
+    passwd.write_text("postgres:x:100:100::/var/lib/postgresql:/bin/bash\n")
+    group.write_text("postgres:x:100:\nssl-cert:x:101:\n")
+    config.write_text("")
+    config.chmod(0o640)
+    baseline = tmp_path / "baseline.json"
+    baseline.write_text(json.dumps({
+        "users": {"postgres": ["postgres"]},
+        "paths": [{"path": str(config), "mode": "0640"}],
+    }))
+
+    process = subprocess.Popen(
+        [sys.executable, SCRIPT, "--daemon", "--debounce", "0.05", "--baseline", str(baseline),
+         "--passwd", str(passwd), "--group", str(group), "--gshadow", str(tmp_path / "gshadow")],
+        stdout=subprocess.PIPE, text=True,
+    )
+    try:
+        events = DaemonEvents(process)
+        snapshot = events.next()
+        assert snapshot["event"] == "snapshot"
+        assert (snapshot["drifted_users"], snapshot["drifted_paths"]) == (0, 0)
+
+        config.chmod(0o644)
+        assert events.next() == {
+            "event": "drift", "kind": "path", "key": str(config),
+            "diff": {"path": str(config), "field": "mode", "expected": "0640", "actual": "0644"},
+        }
+
+        group.write_text("postgres:x:100:\nssl-cert:x:101:postgres\n")
+        assert events.next() == {
+            "event": "drift", "kind": "user", "key": "postgres",
+            "diff": {"username": "postgres", "missing": [], "unexpected": ["ssl-cert"]},
+        }
+
+        config.chmod(0o640)
+        assert events.next() == {
+            "event": "resolved", "kind": "path", "key": str(config),
+            "diff": {"path": str(config), "field": "mode", "expected": "0640", "actual": "0644"},
+        }
+    finally:
+        process.send_signal(signal.SIGTERM)
+        assert process.wait(timeout=10) == 0
@@ -0,0 +1,57 @@
+import json
+import os
+import shutil
+import subprocess
+
+import pytest
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+COLLECTOR = os.path.join(REPO_ROOT, "ansible", "files", "admin_api_scripts", "pg_egress_collect.pl")
+FIXTURES = os.path.join(REPO_ROOT, "testinfra", "fixtures", "pg_egress_collect")
+
+pytestmark = pytest.mark.skipif(shutil.which("perl") is None, reason="perl is not installed")
+
+
+def replay(tmp_path, capture, *options):
+    output, json_output = tmp_path / "egress.txt", tmp_path / "egress.json"
+    subprocess.run(
+        ["perl", COLLECTOR, "--replay", os.path.join(FIXTURES, capture), "-o", str(output),
+         "--json-output", str(json_output), *options],
+        check=True,
+        capture_output=True,
+    )
+    return output, json_output
+
+
+def expected_counters(capture):
+    # computed by generate.py from the packet list it wrote the synthetic captures from
+    with open(os.path.join(FIXTURES, "expected.json")) as f:
+        return json.load(f)[capture]
+
+
+@pytest.mark.parametrize("capture", ["ethernet_ipv4", "sll_mixed"])
+def test_pcap_mode_matches_generated_counters(tmp_path, capture):
+    expected = expected_counters(capture)
+    output, json_output = replay(tmp_path, f"{capture}.pcap", "--pcap")
+    document = json.loads(json_output.read_text())
+    assert {key: document[key] for key in expected} == expected
+    assert document["remotes_overflow"] == {"bytes": 0, "packets": 0}
+    # the total file keeps the text mode's format
+    assert output.read_text() == str(expected["bytes"])
+
+
+@pytest.mark.parametrize("capture", ["ethernet_ipv4", "sll_mixed"])
+def test_text_mode_matches_generated_counters(tmp_path, capture):
+    output, _ = replay(tmp_path, f"{capture}.txt")
+    assert output.read_text() == str(expected_counters(capture)["bytes"])
+
+
+def test_remote_table_is_bounded_and_files_rotate(tmp_path):
+    for _ in range(3):
+        _, json_output = replay(tmp_path, "ethernet_ipv4.pcap", "--pcap", "--max-remotes", "2", "--keep", "1")
+    assert sorted(os.listdir(tmp_path)) == ["egress.json", "egress.json.1", "egress.txt"]
+
+    document = json.loads(json_output.read_text())
+    assert len(document["remotes"]) == 2
+    counted = sum(remote["packets"] for remote in document["remotes"].values())
+    assert counted + document["remotes_overflow"]["packets"] == document["packets"]
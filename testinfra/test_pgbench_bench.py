@@ -0,0 +1,244 @@
+import asyncio
+import base64
+import hashlib
+import hmac
+import importlib.util
+import os
+import struct
+import sys
+
+import pytest
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PGBENCH_DIR = os.path.join(REPO_ROOT, "tests", "pgbench")
+
+PGBENCH_OUTPUT = """\
+transaction type: <builtin: select only>
+scaling factor: 10
+query mode: simple
+number of clients: 16
+number of threads: 4
+maximum number of tries: 1
+duration: 30 s
+number of transactions actually processed: 1234567
+number of failed transactions: 0 (0.000%)
+latency average = 0.389 ms
+initial connection time = 12.345 ms
+tps = 41152.233333 (without initial connection time)
+"""
+
+
+@pytest.fixture(scope="module")
+def bench():
+    spec = importlib.util.spec_from_file_location("pgbench_bench", os.path.join(PGBENCH_DIR, "bench.py"))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def load_script(name):
+    # the scripts import bench.py from their own directory, as they do when run as scripts
+    sys.path.insert(0, PGBENCH_DIR)
+    try:
+        spec = importlib.util.spec_from_file_location(name, os.path.join(PGBENCH_DIR, f"{name}.py"))
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+    finally:
+        sys.path.remove(PGBENCH_DIR)
+    return module
+
+
+@pytest.fixture(scope="module")
+def optimizer_bench():
+    return load_script("optimizer_bench")
+
+
+@pytest.fixture(scope="module")
+def extension_bench():
+    return load_script("extension_bench")
+
+
+@pytest.fixture(scope="module")
+def connection_storm():
+    return load_script("connection_storm")
+
+
+def test_parse_pgbench_summary(bench):
+    assert bench.parse_pgbench_summary(PGBENCH_OUTPUT) == {
+        "tps": 41152.233333,
+        "transactions": 1234567,
+        "failed": 0,
+        "latency_avg_ms": 0.389,
+        "connection_ms": 12.345,
+    }
+    with pytest.raises(bench.BenchError):
+        bench.parse_pgbench_summary("pgbench: error: connection to server failed\n")
+
+
+def test_transaction_logs_skip_failed_transactions(bench, tmp_path):
+    log = tmp_path / "read_only.1234"
+    log.write_text("0 1 250 0 1700000000 1\n0 2 failed 0 1700000000 2\n1 1 1500 0 1700000000 3\n")
+    assert bench.read_transaction_latencies([str(log)]) == [0.25, 1.5]
+
+
+def test_rendered_configs_point_at_the_work_directory(bench):
+    with open(bench.POSTGRESQL_CONF) as f:
+        conf = bench.render_postgresql_conf(f.read(), "/tmp/bench/data", "orioledb-17", 5499, {"shared_buffers": "1GB"})
+    assert "data_directory = '/tmp/bench/data'" in conf
+    assert "\ninclude = '/etc/postgresql/logging.conf'" not in conf
+    assert "timescaledb" not in conf.split("shared_preload_libraries = ", 1)[1].splitlines()[0]
+    assert ", orioledb'" in conf
+    assert conf.rstrip().endswith("shared_buffers = 1GB")
+
+    with open(bench.PGBOUNCER_INI) as f:
+        ini = bench.render_pgbouncer_ini(f.read(), "/tmp/bench", 5499)
+    assert "* = host=127.0.0.1 port=5499" in ini
+    assert "listen_port = 6543" in ini
+    assert "pool_mode = transaction" in ini
+    assert "\n%include" not in ini
+
+
+def test_compare_results_ignores_noise(bench):
+    baseline = {
+        "direct/read_only": {"tps": 40000.0, "p50_ms": 0.3, "p95_ms": 0.6, "p99_ms": 1.0},
+        "direct/tpcb": {"tps": 3000.0, "p50_ms": 4.0, "p95_ms": 9.0, "p99_ms": 15.0},
+    }
+    current = {
+        # p95 is a third slower, but only by 0.2ms
+        "direct/read_only": {"tps": 37000.0, "p50_ms": 0.35, "p95_ms": 0.8, "p99_ms": 1.6},
+        "direct/tpcb": {"tps": 2400.0, "p50_ms": 4.2, "p95_ms": 12.0, "p99_ms": 15.5},
+    }
+    assert bench.compare_results(current, baseline) == [
+        {"name": "direct/read_only", "metric": "p99_ms", "baseline": 1.0, "current": 1.6},
+        {"name": "direct/tpcb", "metric": "p95_ms", "baseline": 9.0, "current": 12.0},
+        {"name": "direct/tpcb", "metric": "tps", "baseline": 3000.0, "current": 2400.0},
+    ]
+
+
+def test_parse_generated_settings(optimizer_bench):
+    conf = "# generated\nshared_buffers = 1GB  # 25%\nshared_preload_libraries = 'a, b'\t# quoted\n"
+    assert optimizer_bench.parse_settings(conf) == {
+        "shared_buffers": "1GB",
+        "shared_preload_libraries": "'a, b'",
+    }
+    ini = "[databases]\n* = host=localhost\n[pgbouncer]\ndefault_pool_size = 20\n"
+    assert optimizer_bench.parse_settings(ini, "pgbouncer") == {"default_pool_size": "20"}
+
+
+def test_rule_of_thumb_scales_with_the_instance(optimizer_bench):
+    micro, xlarge = (
+        optimizer_bench.rule_of_thumb(optimizer_bench.InstanceSize(name, memory, cpus))
+        for name, memory, cpus in (("micro", 1024, 2), ("xlarge", 16384, 4))
+    )
+    assert micro["postgresql"]["shared_buffers"] == "256MB"
+    assert xlarge["postgresql"]["shared_buffers"] == "4096MB"
+    assert xlarge["postgresql"]["max_parallel_workers"] == "4"
+    assert int(micro["pgbouncer"]["max_client_conn"]) < int(xlarge["pgbouncer"]["max_client_conn"])
+
+
+def test_extensions_rank_most_expensive_first(extension_bench):
+    results = [
+        {"extension": "pgcrypto", "create_ms": 3.0, "cold_ms": 0.4, "warm_ms": 0.1, "rss_added_kb": 200, "libraries": {}},
+        {"extension": "broken", "error": "ERROR:  could not load library\nDETAIL: more"},
+        {"extension": "postgis", "create_ms": 180.0, "cold_ms": 25.5, "warm_ms": 0.3, "rss_added_kb": 9000,
+         "libraries": {"postgis-3.so": 4 * 1024 * 1024}},
+    ]
+    ranked = extension_bench.rank(results, "cold_ms")
+    assert [r["extension"] for r in ranked] == ["postgis", "pgcrypto", "broken"]
+
+    lines = extension_bench.format_table(ranked).splitlines()
+    assert lines[1].split() == ["postgis", "180.0", "25.50", "0.30", "9000", "4096"]
+    assert lines[3] == "broken     error: ERROR:  could not load library"
+
+
+def test_failed_drop_is_recorded_per_extension(extension_bench):
+    class Cluster:
+        def psql(self, sql):
+            raise extension_bench.BenchError(f"psql failed: {sql.split()[0]}")
+
+    result = extension_bench.measure_extension(Cluster(), "pg_cron", "extbench")
+    assert result == {"extension": "pg_cron", "error": "psql failed: CREATE", "drop_error": "psql failed: DROP"}
+
+
+def test_scram_client_matches_rfc7677(connection_storm):
+    scram = connection_storm.ScramClient("pencil", nonce="rOprNGfwEbeRWgbNEkqO", username="user")
+    assert scram.first_message() == "n,,n=user,r=rOprNGfwEbeRWgbNEkqO"
+    server_first = "r=rOprNGfwEbeRWgbNEkqO%hvYDpWUa2RaTCAfuxFIlj)hNlF$k0,s=W22ZaJ0SNY7soEsUEjb6gQ==,i=4096"
+    assert scram.final_message(server_first) == (
+        "c=biws,r=rOprNGfwEbeRWgbNEkqO%hvYDpWUa2RaTCAfuxFIlj)hNlF$k0,p=dHzbZapWIk4jUhN+Ute9ytag9zjfMHgsqmmiz7AndVQ="
+    )
+    scram.verify("v=6rriTRBi23WpRR/wtup+mMhUZUn/dB5nLTJRsjl95G4=")
+    with pytest.raises(connection_storm.ProtocolError):
+        scram.verify("v=AAAA")
+
+
+async def fake_postgres(reader, writer, password="pencil", salt=b"0123456789abcdef", iterations=64):
+    """Just enough of a server: trust for storm_trust, SCRAM for storm_scram, "too many clients" for anyone else."""
+
+    def send(kind, payload=b""):
+        writer.write(kind + struct.pack("!i", len(payload) + 4) + payload)
+
+    async def receive():
+        header = await reader.readexactly(5)
+        return header[:1], await reader.readexactly(struct.unpack("!i", header[1:])[0] - 4)
+
+    length = struct.unpack("!i", await reader.readexactly(4))[0]
+    params = (await reader.readexactly(length - 4))[4:].split(b"\0")
+    user = dict(zip(params[::2], params[1::2]))[b"user"].decode()
+    if user == "storm_scram":
+        send(b"R", struct.pack("!i", 10) + b"SCRAM-SHA-256\0\0")
+        _, payload = await receive()
+        client_first_bare = payload[payload.index(b"n,,") + 3:].decode()
+        nonce = dict(item.split("=", 1) for item in client_first_bare.split(","))["r"] + "server"
+        server_first = f"r={nonce},s={base64.b64encode(salt).decode()},i={iterations}"
+        send(b"R", struct.pack("!i", 11) + server_first.encode())
+        _, client_final = await receive()
+        without_proof, proof = client_final.decode().rsplit(",p=", 1)
+        salted = hashlib.pbkdf2_hmac("sha256", password.encode(), salt, iterations)
+        auth_message = f"{client_first_bare},{server_first},{without_proof}".encode()
+        client_key = hmac.digest(salted, b"Client Key", "sha256")
+        signature = hmac.digest(hashlib.sha256(client_key).digest(), auth_message, "sha256")
+        if base64.b64decode(proof) != bytes(a ^ b for a, b in zip(client_key, signature)):
+            send(b"E", b"SFATAL\0C28P01\0Mpassword authentication failed\0\0")
+            writer.close()
+            return
+        server_signature = hmac.digest(hmac.digest(salted, b"Server Key", "sha256"), auth_message, "sha256")
+        send(b"R", struct.pack("!i", 12) + b"v=" + base64.b64encode(server_signature))
+    elif user != "storm_trust":
+        send(b"E", b"SFATAL\0C53300\0Msorry, too many clients already\0\0")
+        writer.close()
+        return
+    send(b"R", struct.pack("!i", 0))
+    send(b"Z", b"I")
+    while True:
+        kind, _ = await receive()
+        if kind == b"X":
+            writer.close()
+            return
+        send(b"T", struct.pack("!h", 1) + b"?column?\0" + bytes(18))
+        send(b"D", struct.pack("!hi", 1, 1) + b"1")
+        send(b"C", b"SELECT 1\0")
+        send(b"Z", b"I")
+
+
+def test_storm_against_a_fake_server(connection_storm):
+    async def run(user, password):
+        server = await asyncio.start_server(fake_postgres, "127.0.0.1", 0)
+        port = server.sockets[0].getsockname()[1]
+        target = connection_storm.Target("direct", port, "scram" if password else "trust", user, password)
+        try:
+            return await connection_storm.storm(target, cycles=40, clients=8, sql="SELECT 1;", timeout=5)
+        finally:
+            server.close()
+
+    trust = asyncio.run(run("storm_trust", None))
+    scram = asyncio.run(run("storm_scram", "pencil"))
+    assert trust["ok"] == scram["ok"] == 40
+    assert set(scram["latency"]) == {"tcp_ms", "auth_ms", "setup_ms", "query_ms"}
+    assert set(connection_storm.auth_cost([trust, scram])) == {"direct"}
+
+    wrong = asyncio.run(run("storm_scram", "wrong"))
+    full = asyncio.run(run("someone", None))
+    assert wrong["errors"] == {"FATAL 28P01: password authentication failed": 40}
+    assert full["ok"] == 0 and full["errors"] == {"FATAL 53300: sorry, too many clients already": 40}
+    assert "40 x FATAL 53300" in connection_storm.format_table([trust, full])
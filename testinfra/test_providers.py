@@ -0,0 +1,111 @@
+import socket
+import subprocess
+import sys
+
+import pytest
+
+import providers
+from providers import DockerProvider, LocalProvider, QemuProvider, get_provider, wait_for_port
+
+
+class Timeline:
+    def __init__(self):
+        self.marks = []
+
+    def mark(self, name):
+        self.marks.append(name)
+
+
+def test_get_provider_selects_by_name():
+    timeline = Timeline()
+    assert isinstance(get_provider("qemu", timeline), QemuProvider)
+    assert isinstance(get_provider("docker", timeline), DockerProvider)
+    local = get_provider("local", timeline)
+    assert isinstance(local, LocalProvider)
+    assert local.timeline is timeline
+    with pytest.raises(ValueError, match="expected one of"):
+        get_provider("vagrant", timeline)
+
+
+def test_wait_for_port_returns_once_the_port_listens():
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as server:
+        server.bind(("127.0.0.1", 0))
+        server.listen()
+        wait_for_port("127.0.0.1", server.getsockname()[1], interval=0.01, timeout=1)
+
+
+def test_wait_for_port_gives_up_at_the_deadline():
+    with pytest.raises(TimeoutError):
+        wait_for_port("127.0.0.1", providers.free_local_port(), interval=0.01, timeout=0.05)
+
+
+@pytest.fixture
+def qemu(tmp_path, monkeypatch):
+    """A QemuProvider whose qemu binary is a script that prints its arguments and exits."""
+    binary = tmp_path / "qemu-system-aarch64"
+    binary.write_text(f"#!{sys.executable}\nimport sys\nprint(' '.join(sys.argv[1:]))\nsys.exit(3)\n")
+    binary.chmod(0o755)
+    monkeypatch.setenv("QEMU_BINARY", str(binary))
+    commands = []
+    monkeypatch.setattr(providers.subprocess, "run", lambda args, **kwargs: commands.append(args))
+    monkeypatch.setattr(providers.shutil, "copy", lambda source, destination: None)
+
+    provider = QemuProvider(Timeline())
+    provider.workdir = str(tmp_path)
+    provider.ssh_port = providers.free_local_port()
+    provider.http_port = providers.free_local_port()
+    provider.commands = commands
+    return provider
+
+
+@pytest.mark.parametrize("accel, cpu", [("tcg", "max"), ("kvm", "host")])
+def test_qemu_stops_waiting_when_the_vm_exits(qemu, tmp_path, monkeypatch, accel, cpu):
+    monkeypatch.setenv("QEMU_ACCEL", accel)
+    with pytest.raises(RuntimeError, match="exited with code 3"):
+        qemu.start("#cloud-config\n")
+    assert qemu.timeline.marks == ["instance_requested", "instance_running"]
+    assert [command[0] for command in qemu.commands] == ["qemu-img", "cloud-localds"]
+    console = (tmp_path / "console.log").read_text()
+    assert f"-cpu {cpu} -accel {accel}" in console
+    assert f"hostfwd=tcp:127.0.0.1:{qemu.ssh_port}-:22" in console
+
+
+def test_qemu_description_attaches_another_worker(qemu):
+    qemu.key_file = "/keys/id_ed25519"
+    qemu.pid = 4242
+    attached = QemuProvider(Timeline()).attach(qemu.describe())
+    assert attached.base_url == f"http://127.0.0.1:{qemu.http_port}"
+    assert attached.describe() == qemu.describe()
+
+
+class FakeDocker:
+    def __init__(self):
+        self.calls = []
+
+    def __call__(self, *args, **kwargs):
+        self.calls.append(args)
+        return subprocess.CompletedProcess(args, 0, stdout="c0ffee\n")
+
+
+def test_docker_builds_the_image_from_this_repo_by_default(monkeypatch):
+    monkeypatch.delenv("DOCKER_IMAGE", raising=False)
+    provider = DockerProvider(Timeline())
+    provider.docker = docker = FakeDocker()
+    provider.start("#cloud-config\n")
+
+    build = docker.calls[0]
+    assert build[0] == "build"
+    assert build[build.index("--file") + 1].endswith("testinfra/Dockerfile.ami")
+    run = docker.calls[1]
+    assert run[0] == "run"
+    assert run[-2:] == (DockerProvider.BUILD_TAG, "/sbin/init")
+    assert provider.describe() == {"container": "c0ffee"}
+
+
+def test_docker_uses_docker_image_when_set(monkeypatch):
+    monkeypatch.setenv("DOCKER_IMAGE", "registry.example/ami:latest")
+    provider = DockerProvider(Timeline())
+    provider.docker = docker = FakeDocker()
+    provider.start("#cloud-config\n")
+    assert [call[0] for call in docker.calls if call[0] in ("build", "run")] == ["run"]
+    assert docker.calls[0][-2:] == ("registry.example/ami:latest", "/sbin/init")
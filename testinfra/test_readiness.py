@@ -0,0 +1,95 @@
+import random
+
+import pytest
+
+from readiness import ReadinessTimeout, backoff_delay, wait_until_ready
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+def flaky(ready_after, calls):
+    def probe():
+        calls.append(probe)
+        return len(calls) > ready_after
+
+    return probe
+
+
+def test_ready_services_are_not_probed_again():
+    clock = FakeClock()
+    calls = {"postgres": [], "kong": []}
+    probes = {
+        "postgres": flaky(0, calls["postgres"]),
+        "kong": flaky(3, calls["kong"]),
+    }
+
+    states = wait_until_ready(probes, clock=clock, sleep=clock.sleep, rng=random.Random(0))
+
+    assert len(calls["postgres"]) == 1
+    assert len(calls["kong"]) == 4
+    assert states["postgres"].ready_at == 0
+    assert states["kong"].ready_at > 0
+
+
+def test_probe_exceptions_are_reported_and_retried():
+    clock = FakeClock()
+    attempts = []
+    reported = []
+
+    def probe():
+        attempts.append(None)
+        if len(attempts) == 1:
+            raise ConnectionResetError("ssh dropped")
+        return True
+
+    states = wait_until_ready(
+        {"adminapi": probe}, on_error=reported.append, clock=clock, sleep=clock.sleep
+    )
+
+    assert states["adminapi"].ready
+    assert list(reported[0]) == ["adminapi"]
+
+
+def test_deadline_raises_with_pending_services():
+    clock = FakeClock()
+    with pytest.raises(ReadinessTimeout) as excinfo:
+        wait_until_ready(
+            {"gotrue": lambda: False, "kong": lambda: True},
+            deadline=60,
+            clock=clock,
+            sleep=clock.sleep,
+        )
+    assert [state.name for state in excinfo.value.pending] == ["gotrue"]
+    assert clock.now == 60
+
+
+def test_backoff_is_capped_and_jittered():
+    rng = random.Random(0)
+    delays = [backoff_delay(attempt, 1.0, 30.0, rng) for attempt in range(1, 10)]
+    assert 0.5 <= delays[0] <= 1.0
+    assert all(15.0 <= delay <= 30.0 for delay in delays[5:])
+
+
+def test_batch_probe_only_receives_pending_services():
+    clock = FakeClock()
+    rounds = []
+
+    def batch_probe(names):
+        rounds.append(list(names))
+        return {name: name == "postgres" or len(rounds) > 2 for name in names}
+
+    states = wait_until_ready(
+        ["postgres", "kong"], batch_probe=batch_probe, clock=clock, sleep=clock.sleep
+    )
+
+    assert rounds == [["postgres", "kong"], ["kong"], ["kong"]]
+    assert all(state.ready for state in states.values())
@@ -0,0 +1,48 @@
+import subprocess
+from types import SimpleNamespace
+
+import pytest
+
+from remote_batch import BatchError, BatchRunner
+
+
+class LocalHost:
+    """Stands in for a testinfra host by running commands locally."""
+
+    def __init__(self):
+        self.calls = 0
+
+    def run(self, command):
+        self.calls += 1
+        proc = subprocess.run(command, shell=True, capture_output=True, text=True)
+        return SimpleNamespace(rc=proc.returncode, stdout=proc.stdout, stderr=proc.stderr)
+
+
+def test_commands_run_in_one_round_trip():
+    host = LocalHost()
+    runner = BatchRunner(host)
+
+    results = runner.run({
+        "ok": "echo 'it''s ok'",
+        "fails": "echo oops >&2; exit 3",
+        "quoted": "printf '%s' \"$HOME\" | wc -c",
+    })
+
+    assert host.calls == 1
+    assert results["ok"].succeeded and results["ok"].stdout == "its ok\n"
+    assert results["fails"].rc == 3 and results["fails"].stderr == "oops\n"
+    assert int(results["quoted"].stdout) > 0
+    report = runner.report()
+    assert report["round_trips"] == 1
+    assert report["round_trips_saved"] == 2
+
+
+def test_commands_time_out_on_the_host():
+    results = BatchRunner(LocalHost(), timeout=0.2).run({"slow": "sleep 5"})
+    assert results["slow"].rc == 124
+
+
+def test_runner_failure_raises():
+    host = SimpleNamespace(run=lambda command: SimpleNamespace(rc=127, stdout="", stderr="python3: not found"))
+    with pytest.raises(BatchError):
+        BatchRunner(host).run({"ok": "true"})
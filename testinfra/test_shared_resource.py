@@ -0,0 +1,31 @@
+from shared_resource import shared_across_workers
+
+
+def test_workers_share_one_resource(tmp_path_factory, monkeypatch):
+    monkeypatch.setenv("PYTEST_XDIST_WORKER", "gw0")
+    events = []
+
+    def create():
+        events.append("create")
+        return {"instance_id": f"i-{len(events)}"}
+
+    def destroy(description):
+        events.append(f"destroy {description['instance_id']}")
+
+    with shared_across_workers("host", tmp_path_factory, create, destroy) as first:
+        with shared_across_workers("host", tmp_path_factory, create, destroy) as second:
+            assert first == second == {"instance_id": "i-1"}
+        assert events == ["create"]
+    assert events == ["create", "destroy i-1"]
+
+    # a worker arriving after the last one left gets a fresh resource
+    with shared_across_workers("host", tmp_path_factory, create, destroy) as third:
+        assert third == {"instance_id": "i-3"}
+
+
+def test_without_xdist_the_resource_is_not_shared(tmp_path_factory, monkeypatch):
+    monkeypatch.delenv("PYTEST_XDIST_WORKER", raising=False)
+    events = []
+    with shared_across_workers("host", tmp_path_factory, lambda: events.append("create") or {}, lambda d: events.append("destroy")):
+        pass
+    assert events == ["create", "destroy"]
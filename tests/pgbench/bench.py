@@ -0,0 +1,508 @@
+#!/usr/bin/env python3
+"""
+pgbench performance regression suite for the Nix-built Postgres.
+
+Starts a throwaway cluster from a Nix-built bin directory, configured with
+ansible/files/postgresql_config/postgresql.conf.j2 rendered the way
+nix/tools/run-server.sh.in renders it, and optionally puts pgbouncer in
+front of it on 6543 with pgbouncer.ini.j2. It then runs a fixed set of
+workloads against each target and reports TPS and latency percentiles:
+
+    read_only           pgbench's built-in select-only script
+    tpcb                pgbench's built-in TPC-B-like script
+    connection_storm    workloads/connect.sql with a new connection per transaction
+
+Latency percentiles come from pgbench's per-transaction logs (-l), since
+its summary only reports the average. The report is compared against a
+stored baseline per Postgres version, and the exit code is 1 if any
+workload regressed.
+
+    nix build .#psql_15/bin -o result-15
+    python3 tests/pgbench/bench.py --bindir result-15/bin --version 15 \
+        --pgbouncer "$(which pgbouncer)" --output results/15.json
+
+Run with --update-baseline on a quiet machine to (re)record the baseline.
+"""
+
+import argparse
+import glob
+import json
+import os
+import re
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Sequence
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_ROOT = os.path.dirname(os.path.dirname(BENCH_DIR))
+CONFIG_DIR = os.path.join(REPO_ROOT, "ansible", "files")
+POSTGRESQL_CONF = os.path.join(CONFIG_DIR, "postgresql_config", "postgresql.conf.j2")
+SUPAUTILS_CONF = os.path.join(CONFIG_DIR, "postgresql_config", "supautils.conf.j2")
+EXTENSION_CUSTOM_SCRIPTS = os.path.join(CONFIG_DIR, "postgresql_extension_custom_scripts")
+PGBOUNCER_INI = os.path.join(CONFIG_DIR, "pgbouncer_config", "pgbouncer.ini.j2")
+PGSODIUM_GETKEY = os.path.join(REPO_ROOT, "nix", "tests", "util", "pgsodium_getkey.sh")
+BASELINE_DIR = os.path.join(BENCH_DIR, "baselines")
+VERSIONS = ["15", "orioledb-17"]
+
+SUPERUSER = "postgres"
+PGBOUNCER_PORT = 6543
+
+TPS_RE = re.compile(r"^tps = ([\d.]+)", re.MULTILINE)
+PROCESSED_RE = re.compile(r"^number of transactions actually processed: (\d+)", re.MULTILINE)
+FAILED_RE = re.compile(r"^number of failed transactions: (\d+)", re.MULTILINE)
+LATENCY_AVG_RE = re.compile(r"^latency average = ([\d.]+) ms", re.MULTILINE)
+CONNECTION_TIME_RE = re.compile(r"^(?:initial connection time|average connection time) = ([\d.]+) ms", re.MULTILINE)
+
+
+@dataclass
+class Workload:
+    name: str
+    args: List[str]
+    clients: int
+    # extra options for this workload only, e.g. -C for the connection storm
+    options: List[str] = field(default_factory=list)
+
+
+WORKLOADS = [
+    Workload("read_only", ["-b", "select-only"], clients=16),
+    Workload("tpcb", ["-b", "tpcb-like"], clients=16),
+    Workload(
+        "connection_storm",
+        ["-f", os.path.join(BENCH_DIR, "workloads", "connect.sql")],
+        clients=50,
+        options=["-C"],
+    ),
+]
+
+
+class BenchError(Exception):
+    pass
+
+
+def render_postgresql_conf(
+    template: str,
+    datadir: str,
+    version: str,
+    port: int,
+    settings: Optional[Dict[str, str]] = None,
+) -> str:
+    """
+    postgresql.conf.j2 with paths pointing into `datadir`, as run-server.sh.in does.
+
+    The logging and read-replica includes are commented out, supautils is
+    included from the data directory, and OrioleDB builds get the same
+    preload and access method changes as run-server.sh.in. `settings` are
+    appended last, so they override anything in the template.
+    """
+    text = template
+    text = text.replace("data_directory = '/var/lib/postgresql/data'", f"data_directory = '{datadir}'")
+    text = text.replace("hba_file = '/etc/postgresql/pg_hba.conf'", f"hba_file = '{datadir}/pg_hba.conf'")
+    text = text.replace("ident_file = '/etc/postgresql/pg_ident.conf'", f"ident_file = '{datadir}/pg_ident.conf'")
+    text = text.replace("include = '/etc/postgresql/logging.conf'", "#include = '/etc/postgresql/logging.conf'")
+    text = text.replace(
+        "include = '/etc/postgresql-custom/read-replica.conf'",
+        "#include = '/etc/postgresql-custom/read-replica.conf'",
+    )
+    text = f"include = '{datadir}/supautils.conf'\n" + text
+
+    if version == "orioledb-17":
+        text = text.replace(" timescaledb,", "")
+        text = text.replace("db_user_namespace = off", "#db_user_namespace = off")
+        text = re.sub(r"^(shared_preload_libraries = '[^']*)'", r"\1, orioledb'", text, flags=re.MULTILINE)
+        text += "\ndefault_table_access_method = 'orioledb'\n"
+
+    overrides = {
+        "pgsodium.getkey_script": f"'{PGSODIUM_GETKEY}'",
+        "session_preload_libraries": "'supautils'",
+        "listen_addresses": "'127.0.0.1'",
+        "port": str(port),
+        "unix_socket_directories": f"'{datadir}'",
+        **(settings or {}),
+    }
+    text += "\n# benchmark harness overrides\n"
+    text += "".join(f"{name} = {value}\n" for name, value in overrides.items())
+    return text
+
+
+def render_supautils_conf(template: str, datadir: str, version: str) -> str:
+    text = template.replace(
+        "'/etc/postgresql-custom/extension-custom-scripts'",
+        f"'{datadir}/extension-custom-scripts'",
+    )
+    if version == "orioledb-17":
+        for extension in ("timescaledb", "plv8", "postgis", "pgrouting"):
+            text = text.replace(f" {extension},", "")
+    return text
+
+
+def render_pgbouncer_ini(
+    template: str,
+    workdir: str,
+    pg_port: int,
+    port: int = PGBOUNCER_PORT,
+    settings: Optional[Dict[str, str]] = None,
+) -> str:
+    """
+    pgbouncer.ini.j2 pointed at the benchmark cluster.
+
+    Pooling settings are kept as they are. Authentication is switched to
+    trust with a local userlist, because the benchmark cluster has no
+    pgbouncer.get_auth(), and the %include files, which only exist on an
+    instance, are commented out. `settings` are appended to [pgbouncer].
+    """
+    lines = []
+    for line in template.splitlines():
+        key = line.split("=", 1)[0].strip()
+        if key == "*":
+            line = f"* = host=127.0.0.1 port={pg_port}"
+        elif key == "pidfile":
+            line = f"pidfile = {workdir}/pgbouncer.pid"
+        elif key == "listen_addr":
+            line = "listen_addr = 127.0.0.1"
+        elif key == "listen_port":
+            line = f"listen_port = {port}"
+        elif key == "unix_socket_dir":
+            line = f"unix_socket_dir = {workdir}"
+        elif key == "auth_type":
+            line = "auth_type = trust"
+        elif key == "auth_file":
+            line = f"auth_file = {workdir}/userlist.txt"
+        elif key == "auth_query" or line.startswith("%include"):
+            line = ";" + line
+        lines.append(line)
+    text = "\n".join(lines) + "\n"
+    if settings:
+        text += "\n; benchmark harness overrides\n"
+        text += "".join(f"{name} = {value}\n" for name, value in settings.items())
+    return text
+
+
+def wait_for_port(port: int, timeout: float = 30.0):
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            with socket.create_connection(("127.0.0.1", port), timeout=1):
+                return
+        except OSError:
+            if time.monotonic() > deadline:
+                raise BenchError(f"nothing is listening on port {port} after {timeout:.0f}s")
+            time.sleep(0.2)
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+class Cluster:
+    """
+    A throwaway cluster in `workdir`/data, run with the binaries in `bindir`.
+
+    `launcher` is prepended to the pg_ctl start command, e.g. a systemd-run
+    scope that puts the server in a resource-limited cgroup.
+    """
+
+    def __init__(self, bindir: str, workdir: str, version: str, port: int, settings: Optional[Dict[str, str]] = None,
+                 launcher: Sequence[str] = ()):
+        self.bindir = bindir
+        self.datadir = os.path.join(workdir, "data")
+        self.logfile = os.path.join(workdir, "postgresql.log")
+        self.version = version
+        self.port = port
+        self.settings = settings
+        self.launcher = list(launcher)
+        self.env = {**os.environ, "LANG": "C", "LC_ALL": "C", "PGHOST": "127.0.0.1", "PGUSER": SUPERUSER}
+
+    def tool(self, name: str) -> str:
+        return os.path.join(self.bindir, name)
+
+    def run(self, *args, **kwargs) -> subprocess.CompletedProcess:
+        proc = subprocess.run(args, env=self.env, capture_output=True, text=True, **kwargs)
+        if proc.returncode != 0:
+            raise BenchError(f"{os.path.basename(args[0])} failed: {proc.stderr.strip() or proc.stdout.strip()}")
+        return proc
+
+    def init(self):
+        self.run(
+            self.tool("initdb"), "-D", self.datadir, "-U", SUPERUSER, "--auth=trust",
+            "--locale=C", "--encoding=UTF8",
+        )
+        shutil.copytree(EXTENSION_CUSTOM_SCRIPTS, os.path.join(self.datadir, "extension-custom-scripts"))
+        with open(SUPAUTILS_CONF) as f:
+            supautils = render_supautils_conf(f.read(), self.datadir, self.version)
+        with open(os.path.join(self.datadir, "supautils.conf"), "w") as f:
+            f.write(supautils)
+        with open(POSTGRESQL_CONF) as f:
+            conf = render_postgresql_conf(f.read(), self.datadir, self.version, self.port, self.settings)
+        with open(os.path.join(self.datadir, "postgresql.conf"), "w") as f:
+            f.write(conf)
+
+    def start(self):
+        self.run(*self.launcher, self.tool("pg_ctl"), "-D", self.datadir, "-l", self.logfile, "-w", "-t", "120", "start")
+        if self.version == "orioledb-17":
+            self.psql("CREATE EXTENSION IF NOT EXISTS orioledb;")
+
+    def stop(self):
+        if os.path.exists(os.path.join(self.datadir, "postmaster.pid")):
+            self.run(self.tool("pg_ctl"), "-D", self.datadir, "-m", "fast", "-w", "stop")
+
+    def psql(self, sql: str) -> str:
+        return self.run(
+            self.tool("psql"), "-p", str(self.port), "-d", "postgres", "-v", "ON_ERROR_STOP=1",
+            "--no-psqlrc", "--no-align", "--tuples-only", "-c", sql,
+        ).stdout.strip()
+
+    def pgbench_init(self, scale: int):
+        # OrioleDB tables cannot be vacuumed, so skip the v step there
+        steps = "dtgp" if self.version == "orioledb-17" else "dtgvp"
+        self.run(self.tool("pgbench"), "-i", "-I", steps, "-s", str(scale), "-p", str(self.port), "postgres")
+
+    def show(self, names: Sequence[str]) -> Dict[str, str]:
+        return {name: self.psql(f"SHOW {name};") for name in names}
+
+
+class Pgbouncer:
+    """
+    pgbouncer with the rendered pgbouncer.ini.j2, in front of a Cluster.
+
+    `users` adds userlist.txt entries (name to password or SCRAM secret)
+    next to the superuser's.
+    """
+
+    def __init__(self, binary: str, workdir: str, pg_port: int, port: int = PGBOUNCER_PORT,
+                 settings: Optional[Dict[str, str]] = None, users: Optional[Dict[str, str]] = None):
+        self.binary = binary
+        self.workdir = workdir
+        self.pg_port = pg_port
+        self.port = port
+        self.settings = settings
+        self.users = {SUPERUSER: "", **(users or {})}
+        self.process = None
+
+    def start(self):
+        with open(PGBOUNCER_INI) as f:
+            ini = render_pgbouncer_ini(f.read(), self.workdir, self.pg_port, self.port, self.settings)
+        config = os.path.join(self.workdir, "pgbouncer.ini")
+        with open(config, "w") as f:
+            f.write(ini)
+        with open(os.path.join(self.workdir, "userlist.txt"), "w") as f:
+            f.write("".join(f'"{name}" "{password}"\n' for name, password in self.users.items()))
+        log = open(os.path.join(self.workdir, "pgbouncer.log"), "w")
+        self.process = subprocess.Popen([self.binary, config], stdout=log, stderr=subprocess.STDOUT)
+        log.close()
+        wait_for_port(self.port)
+
+    def stop(self):
+        if self.process and self.process.poll() is None:
+            self.process.terminate()
+            self.process.wait(timeout=30)
+
+
+def percentile(sorted_samples: Sequence[float], pct: float) -> Optional[float]:
+    """Nearest-rank percentile of already sorted samples."""
+    if not sorted_samples:
+        return None
+    rank = max(int(-(-pct * len(sorted_samples) // 100)), 1)
+    return sorted_samples[min(rank, len(sorted_samples)) - 1]
+
+
+def parse_pgbench_summary(output: str) -> Dict[str, Optional[float]]:
+    """TPS, transaction counts and average latency from pgbench's summary."""
+
+    def number(regex, cast=float):
+        match = regex.search(output)
+        return cast(match.group(1)) if match else None
+
+    tps = number(TPS_RE)
+    if tps is None:
+        raise BenchError(f"no tps in pgbench output:\n{output}")
+    return {
+        "tps": tps,
+        "transactions": number(PROCESSED_RE, int),
+        "failed": number(FAILED_RE, int) or 0,
+        "latency_avg_ms": number(LATENCY_AVG_RE),
+        "connection_ms": number(CONNECTION_TIME_RE),
+    }
+
+
+def read_transaction_latencies(paths: Sequence[str]) -> List[float]:
+    """
+    Latencies in ms from pgbench -l logs.
+
+    Each line is `client_id transaction_no time script_no epoch us ...`
+    with `time` in microseconds. Failed and skipped transactions have a
+    word instead of a number there and are left out.
+    """
+    latencies = []
+    for path in paths:
+        with open(path) as f:
+            for line in f:
+                fields = line.split()
+                if len(fields) >= 3 and fields[2].isdigit():
+                    latencies.append(int(fields[2]) / 1000)
+    return latencies
+
+
+def run_workload(cluster: Cluster, workload: Workload, port: int, duration: int, threads: int,
+                 logdir: str, warmup: int = 0) -> Dict[str, Optional[float]]:
+    clients = workload.clients
+    jobs = min(threads, clients)
+    base = [
+        cluster.tool("pgbench"), "-n", "-p", str(port), "-c", str(clients), "-j", str(jobs),
+        *workload.options, *workload.args,
+    ]
+    if warmup:
+        cluster.run(*base, "-T", str(warmup), "postgres")
+
+    prefix = os.path.join(logdir, f"{workload.name}_{port}")
+    proc = cluster.run(*base, "-T", str(duration), "-l", f"--log-prefix={prefix}", "postgres")
+    result = parse_pgbench_summary(proc.stdout)
+    latencies = sorted(read_transaction_latencies(glob.glob(f"{prefix}.*")))
+    for pct in (50, 95, 99):
+        value = percentile(latencies, pct)
+        result[f"p{pct}_ms"] = None if value is None else round(value, 3)
+    return result
+
+
+def compare_results(
+    current: Dict[str, Dict[str, Optional[float]]],
+    baseline: Dict[str, Dict[str, Optional[float]]],
+    tolerance: float = 0.15,
+    min_latency_delta_ms: float = 0.5,
+) -> List[Dict[str, object]]:
+    """
+    Workloads that got slower than `baseline`.
+
+    TPS regresses when it drops by more than `tolerance` (a fraction).
+    A latency percentile regresses when it grows by more than `tolerance`
+    and by more than `min_latency_delta_ms`, so sub-millisecond noise on
+    fast queries is not reported. Workloads or metrics missing from either
+    side are skipped.
+    """
+    regressions = []
+    for name, expected in baseline.items():
+        actual = current.get(name)
+        if not actual:
+            continue
+        if expected.get("tps") and actual.get("tps") is not None:
+            if actual["tps"] < expected["tps"] * (1 - tolerance):
+                regressions.append({
+                    "name": name, "metric": "tps", "baseline": expected["tps"], "current": actual["tps"],
+                })
+        for metric in ("p50_ms", "p95_ms", "p99_ms"):
+            if expected.get(metric) is None or actual.get(metric) is None:
+                continue
+            delta = actual[metric] - expected[metric]
+            if delta > min_latency_delta_ms and delta > expected[metric] * tolerance:
+                regressions.append({
+                    "name": name, "metric": metric, "baseline": expected[metric], "current": actual[metric],
+                })
+    return sorted(regressions, key=lambda r: (r["name"], r["metric"]))
+
+
+def run_suite(args) -> Dict[str, object]:
+    workdir = tempfile.mkdtemp(prefix=f"pgbench-{args.version}-")
+    logdir = os.path.join(workdir, "logs")
+    os.makedirs(logdir)
+    cluster = Cluster(args.bindir, workdir, args.version, args.port or free_port())
+    pgbouncer = None
+    try:
+        cluster.init()
+        cluster.start()
+        cluster.pgbench_init(args.scale)
+
+        targets = {"direct": cluster.port}
+        if args.pgbouncer:
+            pgbouncer = Pgbouncer(args.pgbouncer, workdir, cluster.port, args.pgbouncer_port)
+            pgbouncer.start()
+            targets["pgbouncer"] = pgbouncer.port
+
+        workloads = [w for w in WORKLOADS if not args.workload or w.name in args.workload]
+        results = {}
+        for target, port in targets.items():
+            for workload in workloads:
+                name = f"{target}/{workload.name}"
+                print(f"running {name} for {args.duration}s", file=sys.stderr)
+                results[name] = run_workload(
+                    cluster, workload, port, args.duration, args.threads, logdir, args.warmup
+                )
+        return {
+            "version": args.version,
+            "scale": args.scale,
+            "duration_s": args.duration,
+            "settings": cluster.show(["server_version", "shared_buffers", "max_connections", "default_table_access_method"]),
+            "results": results,
+        }
+    finally:
+        if pgbouncer:
+            pgbouncer.stop()
+        cluster.stop()
+        if args.keep:
+            print(f"kept {workdir}", file=sys.stderr)
+        else:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="pgbench regression suite for the Nix-built Postgres")
+    parser.add_argument("--bindir", required=True, help="bin directory of a Nix build, e.g. result-15/bin")
+    parser.add_argument("--version", required=True, choices=VERSIONS)
+    parser.add_argument("--pgbouncer", help="pgbouncer binary; also benchmark through it when given")
+    parser.add_argument("--pgbouncer-port", type=int, default=PGBOUNCER_PORT)
+    parser.add_argument("--port", type=int, help="Postgres port (default: a free one)")
+    parser.add_argument("--scale", type=int, default=10, help="pgbench scale factor")
+    parser.add_argument("--duration", type=int, default=30, help="Measured seconds per workload")
+    parser.add_argument("--warmup", type=int, default=5, help="Unmeasured seconds before each workload")
+    parser.add_argument("--threads", type=int, default=os.cpu_count() or 4, help="pgbench -j")
+    parser.add_argument("--workload", action="append", choices=[w.name for w in WORKLOADS],
+                        help="Only run this workload (repeatable)")
+    parser.add_argument("--baseline", help="Baseline JSON (default: baselines/<version>.json)")
+    parser.add_argument("--tolerance", type=float, default=0.15)
+    parser.add_argument("--update-baseline", action="store_true", help="Write this run as the new baseline")
+    parser.add_argument("-o", "--output", help="Write the JSON report here as well as to stdout")
+    parser.add_argument("--keep", action="store_true", help="Keep the data directory and pgbench logs")
+    args = parser.parse_args()
+
+    try:
+        report = run_suite(args)
+    except BenchError as e:
+        print(f"{sys.argv[0]}: {e}", file=sys.stderr)
+        sys.exit(2)
+
+    baseline_path = args.baseline or os.path.join(BASELINE_DIR, f"{args.version}.json")
+    regressions = []
+    if args.update_baseline:
+        os.makedirs(os.path.dirname(baseline_path), exist_ok=True)
+        with open(baseline_path, "w") as f:
+            json.dump(report, f, indent=2)
+            f.write("\n")
+    elif os.path.exists(baseline_path):
+        with open(baseline_path) as f:
+            baseline = json.load(f)
+        regressions = compare_results(report["results"], baseline["results"], args.tolerance)
+        report["baseline"] = baseline_path
+    report["regressions"] = regressions
+
+    text = json.dumps(report, indent=2)
+    print(text)
+    if args.output:
+        os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    for regression in regressions:
+        print(
+            f"REGRESSION {regression['name']} {regression['metric']}:"
+            f" {regression['baseline']} -> {regression['current']}",
+            file=sys.stderr,
+        )
+    sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,534 @@
+#!/usr/bin/env python3
+"""
+Connection-storm latency of Postgres directly versus through pgbouncer.
+
+Most of an instance's traffic is short-lived connections from PostgREST,
+GoTrue and client apps. This tool opens thousands of concurrent
+connect/authenticate/query/disconnect cycles with asyncio and measures each
+phase of every cycle:
+
+    tcp_ms      TCP connect
+    auth_ms     startup message to ReadyForQuery, including authentication
+    setup_ms    tcp_ms + auth_ms, what a client waits before it can send a query
+    query_ms    one simple query. Through pgbouncer in transaction mode this
+                includes waiting for a server connection from the pool
+
+It speaks the Postgres wire protocol itself (trust, password, md5 and
+SCRAM-SHA-256 auth, simple query), so it has no driver dependency and one
+process can hold thousands of connections.
+
+By default it starts the cluster from bench.py, and pgbouncer with
+pgbouncer.ini.j2 when --pgbouncer is given. It then runs a storm per target
+(direct and pgbouncer) and auth method:
+
+    trust       a role that pg_hba.conf (and pgbouncer's hba) trusts
+    scram       a role with a SCRAM-SHA-256 password, as on an instance
+
+The difference between the two is the auth cost. While a storm runs through
+pgbouncer, SHOW POOLS is polled on its admin console and the peak client
+waiting, server active and maxwait per pool are reported.
+
+    python3 tests/pgbench/connection_storm.py --bindir result-15/bin --version 15 \
+        --pgbouncer "$(which pgbouncer)" --clients 2000 --cycles 20000 -o storm.json
+
+With --instance it targets an already running local instance on 5432 and
+6543 instead. The password comes from PGPASSWORD, and SHOW POOLS needs the
+pgbouncer admin user's password in PGBOUNCER_PASSWORD.
+"""
+
+import argparse
+import asyncio
+import base64
+import collections
+import hashlib
+import hmac
+import json
+import os
+import resource
+import shutil
+import struct
+import sys
+import tempfile
+import time
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
+
+from bench import SUPERUSER, VERSIONS, BenchError, Cluster, Pgbouncer, free_port, percentile
+
+PROTOCOL_VERSION = 196608  # 3.0
+
+TRUST_ROLE = "storm_trust"
+SCRAM_ROLE = "storm_scram"
+SCRAM_PASSWORD = "storm"
+
+# pgbouncer's SHOW POOLS columns worth tracking during a storm
+POOL_COLUMNS = ["cl_active", "cl_waiting", "sv_active", "sv_idle", "sv_used"]
+
+
+class ProtocolError(Exception):
+    """An ErrorResponse from the server, or a message we did not expect."""
+
+
+@dataclass
+class Target:
+    name: str
+    port: int
+    auth: str
+    user: str
+    password: Optional[str] = None
+    database: str = "postgres"
+    host: str = "127.0.0.1"
+
+
+class ScramClient:
+    """
+    The client side of SCRAM-SHA-256 (RFC 5802, RFC 7677), without channel binding.
+
+    Postgres takes the user name from the startup message, so the SCRAM
+    user name is empty unless given.
+    """
+
+    def __init__(self, password: str, nonce: Optional[str] = None, username: str = ""):
+        self.password = password.encode()
+        self.nonce = nonce or base64.b64encode(os.urandom(18)).decode()
+        self.client_first_bare = f"n={username},r={self.nonce}"
+        self.server_signature = None
+
+    def first_message(self) -> str:
+        return "n,," + self.client_first_bare
+
+    def final_message(self, server_first: str) -> str:
+        fields = dict(item.split("=", 1) for item in server_first.split(","))
+        if not fields["r"].startswith(self.nonce):
+            raise ProtocolError("SCRAM server nonce does not extend the client nonce")
+        salted = hashlib.pbkdf2_hmac("sha256", self.password, base64.b64decode(fields["s"]), int(fields["i"]))
+        client_key = hmac.digest(salted, b"Client Key", "sha256")
+        without_proof = f"c=biws,r={fields['r']}"
+        auth_message = f"{self.client_first_bare},{server_first},{without_proof}".encode()
+        signature = hmac.digest(hashlib.sha256(client_key).digest(), auth_message, "sha256")
+        proof = bytes(a ^ b for a, b in zip(client_key, signature))
+        server_key = hmac.digest(salted, b"Server Key", "sha256")
+        self.server_signature = base64.b64encode(hmac.digest(server_key, auth_message, "sha256")).decode()
+        return f"{without_proof},p={base64.b64encode(proof).decode()}"
+
+    def verify(self, server_final: str):
+        if server_final != f"v={self.server_signature}":
+            raise ProtocolError("SCRAM server signature does not match")
+
+
+class Connection:
+    """One frontend connection, just enough protocol for connect, simple queries and terminate."""
+
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.reader = reader
+        self.writer = writer
+
+    @classmethod
+    async def open(cls, host: str, port: int) -> "Connection":
+        reader, writer = await asyncio.open_connection(host, port)
+        return cls(reader, writer)
+
+    def send(self, kind: bytes, payload: bytes = b""):
+        self.writer.write(kind + struct.pack("!i", len(payload) + 4) + payload)
+
+    async def receive(self) -> Tuple[bytes, bytes]:
+        header = await self.reader.readexactly(5)
+        length = struct.unpack("!i", header[1:])[0]
+        payload = await self.reader.readexactly(length - 4)
+        if header[:1] == b"E":
+            raise ProtocolError(error_message(payload))
+        return header[:1], payload
+
+    async def startup(self, user: str, database: str, password: Optional[str]):
+        """Send the startup message and authenticate, up to the first ReadyForQuery."""
+        params = {"user": user, "database": database, "application_name": "connection_storm"}
+        body = struct.pack("!i", PROTOCOL_VERSION)
+        body += b"".join(f"{key}\0{value}\0".encode() for key, value in params.items()) + b"\0"
+        self.writer.write(struct.pack("!i", len(body) + 4) + body)
+        await self.writer.drain()
+        scram = None
+        while True:
+            kind, payload = await self.receive()
+            if kind == b"Z":
+                return
+            if kind != b"R":
+                # ParameterStatus, BackendKeyData and notices
+                continue
+            code = struct.unpack("!i", payload[:4])[0]
+            if code == 0:
+                continue
+            if password is None:
+                raise ProtocolError(f"server asked for a password (auth code {code}) and none was given")
+            if code == 3:
+                self.send(b"p", password.encode() + b"\0")
+            elif code == 5:
+                inner = hashlib.md5((password + user).encode()).hexdigest()
+                self.send(b"p", b"md5" + hashlib.md5(inner.encode() + payload[4:8]).hexdigest().encode() + b"\0")
+            elif code == 10:
+                mechanisms = payload[4:].split(b"\0")
+                if b"SCRAM-SHA-256" not in mechanisms:
+                    raise ProtocolError(f"no supported SASL mechanism in {mechanisms}")
+                scram = ScramClient(password)
+                first = scram.first_message().encode()
+                self.send(b"p", b"SCRAM-SHA-256\0" + struct.pack("!i", len(first)) + first)
+            elif code == 11:
+                self.send(b"p", scram.final_message(payload[4:].decode()).encode())
+            elif code == 12:
+                scram.verify(payload[4:].decode())
+            else:
+                raise ProtocolError(f"unsupported auth code {code}")
+            await self.writer.drain()
+
+    async def query(self, sql: str) -> List[Dict[str, Optional[str]]]:
+        """Run `sql` with the simple query protocol and return the rows of its last result."""
+        self.send(b"Q", sql.encode() + b"\0")
+        await self.writer.drain()
+        columns, rows, error = [], [], None
+        while True:
+            try:
+                kind, payload = await self.receive()
+            except ProtocolError as e:
+                # the server still sends ReadyForQuery after an error in a query
+                error = e
+                continue
+            if kind == b"T":
+                columns, rows = row_description(payload), []
+            elif kind == b"D":
+                rows.append(dict(zip(columns, data_row(payload))))
+            elif kind == b"Z":
+                if error:
+                    raise error
+                return rows
+
+    async def close(self):
+        try:
+            self.send(b"X")
+            await self.writer.drain()
+        except ConnectionError:
+            pass
+        self.writer.close()
+        try:
+            await self.writer.wait_closed()
+        except ConnectionError:
+            pass
+
+
+def error_message(payload: bytes) -> str:
+    fields = {}
+    for field in payload.split(b"\0"):
+        if field:
+            fields[field[:1]] = field[1:].decode(errors="replace")
+    return f"{fields.get(b'S', 'ERROR')} {fields.get(b'C', '?????')}: {fields.get(b'M', '')}"
+
+
+def row_description(payload: bytes) -> List[str]:
+    count = struct.unpack("!h", payload[:2])[0]
+    names, offset = [], 2
+    for _ in range(count):
+        end = payload.index(b"\0", offset)
+        names.append(payload[offset:end].decode())
+        # table oid, column number, type oid, type size, type modifier, format code
+        offset = end + 1 + 18
+    return names
+
+
+def data_row(payload: bytes) -> List[Optional[str]]:
+    count = struct.unpack("!h", payload[:2])[0]
+    values, offset = [], 2
+    for _ in range(count):
+        length = struct.unpack("!i", payload[offset:offset + 4])[0]
+        offset += 4
+        if length < 0:
+            values.append(None)
+        else:
+            values.append(payload[offset:offset + length].decode())
+            offset += length
+    return values
+
+
+async def cycle(target: Target, sql: str) -> Dict[str, float]:
+    """One connect/authenticate/query/disconnect cycle, timed per phase in ms."""
+    start = time.perf_counter()
+    connection = await Connection.open(target.host, target.port)
+    try:
+        connected = time.perf_counter()
+        await connection.startup(target.user, target.database, target.password)
+        ready = time.perf_counter()
+        await connection.query(sql)
+        done = time.perf_counter()
+    finally:
+        await connection.close()
+    return {
+        "tcp_ms": (connected - start) * 1000,
+        "auth_ms": (ready - connected) * 1000,
+        "setup_ms": (ready - start) * 1000,
+        "query_ms": (done - ready) * 1000,
+    }
+
+
+async def poll_pools(admin: Target, interval: float, stop: asyncio.Event) -> Dict[str, Dict[str, float]]:
+    """Peak SHOW POOLS values per database/user pool until `stop` is set."""
+    peaks: Dict[str, Dict[str, float]] = {}
+    connection = await Connection.open(admin.host, admin.port)
+    try:
+        await connection.startup(admin.user, "pgbouncer", admin.password)
+        while True:
+            for row in await connection.query("SHOW POOLS;"):
+                if row["database"] == "pgbouncer":
+                    continue
+                pool = peaks.setdefault(f"{row['database']}/{row['user']}", {})
+                # maxwait is whole seconds, maxwait_us the microseconds on top
+                values = {column: float(row[column]) for column in POOL_COLUMNS if row.get(column) is not None}
+                values["maxwait_s"] = float(row.get("maxwait") or 0) + float(row.get("maxwait_us") or 0) / 1e6
+                for column, value in values.items():
+                    pool[column] = max(pool.get(column, 0.0), value)
+            try:
+                await asyncio.wait_for(stop.wait(), interval)
+                return peaks
+            except asyncio.TimeoutError:
+                pass
+    finally:
+        await connection.close()
+
+
+async def storm(target: Target, cycles: int, clients: int, sql: str, timeout: float,
+                admin: Optional[Target] = None, pool_interval: float = 0.5) -> Dict[str, object]:
+    """
+    `cycles` cycles against `target` with `clients` of them in flight at once.
+
+    Failed cycles (refused connections, "too many clients", timeouts) are
+    counted by error message and left out of the latency percentiles.
+    """
+    remaining = cycles
+    samples: Dict[str, List[float]] = collections.defaultdict(list)
+    errors: collections.Counter = collections.Counter()
+
+    async def client():
+        nonlocal remaining
+        while remaining > 0:
+            remaining -= 1
+            try:
+                phases = await asyncio.wait_for(cycle(target, sql), timeout)
+            except asyncio.TimeoutError:
+                errors[f"timeout after {timeout:g}s"] += 1
+            except (OSError, asyncio.IncompleteReadError, ProtocolError) as e:
+                errors[str(e) or type(e).__name__] += 1
+            else:
+                for phase, ms in phases.items():
+                    samples[phase].append(ms)
+
+    stop = asyncio.Event()
+    poller = asyncio.ensure_future(poll_pools(admin, pool_interval, stop)) if admin else None
+    start = time.perf_counter()
+    try:
+        await asyncio.gather(*(client() for _ in range(min(clients, cycles))))
+    finally:
+        elapsed = time.perf_counter() - start
+        stop.set()
+    pools = None
+    if poller:
+        try:
+            pools = await poller
+        except (OSError, asyncio.IncompleteReadError, ProtocolError) as e:
+            pools = {"error": str(e)}
+
+    ok = len(samples["setup_ms"])
+    return {
+        "target": target.name,
+        "auth": target.auth,
+        "port": target.port,
+        "clients": clients,
+        "cycles": cycles,
+        "ok": ok,
+        "errors": dict(errors.most_common()),
+        "elapsed_s": round(elapsed, 3),
+        "cycles_per_s": round(ok / elapsed, 1) if elapsed else 0.0,
+        "latency": {phase: summarize(values) for phase, values in samples.items()},
+        "pools": pools,
+    }
+
+
+def summarize(values: List[float]) -> Dict[str, Optional[float]]:
+    values = sorted(values)
+    return {
+        **{f"p{pct}": round(percentile(values, pct), 3) if values else None for pct in (50, 95, 99)},
+        "max": round(values[-1], 3) if values else None,
+    }
+
+
+def auth_cost(runs: List[Dict[str, object]]) -> Dict[str, Optional[float]]:
+    """Median scram minus median trust auth_ms, per target."""
+    medians = {}
+    for run in runs:
+        medians[(run["target"], run["auth"])] = run["latency"].get("auth_ms", {}).get("p50")
+    costs = {}
+    for target in sorted({target for target, _ in medians}):
+        scram, trust = medians.get((target, "scram")), medians.get((target, "trust"))
+        if scram is not None and trust is not None:
+            costs[target] = round(scram - trust, 3)
+    return costs
+
+
+def format_table(runs: List[Dict[str, object]]) -> str:
+    header = ["target", "auth", "ok", "errors", "cycles/s", "setup p50", "p95", "p99", "auth p50", "query p50", "p99"]
+    rows = [header]
+    for run in runs:
+        latency = run["latency"]
+
+        def ms(phase, pct):
+            value = latency.get(phase, {}).get(pct)
+            return "-" if value is None else f"{value:.2f}"
+
+        rows.append([
+            run["target"], run["auth"], str(run["ok"]), str(sum(run["errors"].values())), f"{run['cycles_per_s']:g}",
+            ms("setup_ms", "p50"), ms("setup_ms", "p95"), ms("setup_ms", "p99"),
+            ms("auth_ms", "p50"), ms("query_ms", "p50"), ms("query_ms", "p99"),
+        ])
+    widths = [max(len(row[i]) for row in rows) for i in range(len(header))]
+    lines = ["  ".join(cell.ljust(widths[i]) for i, cell in enumerate(row)).rstrip() for row in rows]
+    for run in runs:
+        for message, count in run["errors"].items():
+            lines.append(f"{run['target']}/{run['auth']}: {count} x {message}")
+        for pool, peaks in (run["pools"] or {}).items():
+            if pool == "error":
+                lines.append(f"{run['target']}/{run['auth']}: SHOW POOLS failed: {peaks}")
+                continue
+            lines.append(
+                f"{run['target']}/{run['auth']} pool {pool}: peak " + ", ".join(f"{k} {v:g}" for k, v in peaks.items())
+            )
+    return "\n".join(lines)
+
+
+def raise_open_files_limit(clients: int):
+    """Each client holds a socket, and pgbouncer needs two per client on the same host."""
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    wanted = clients * 2 + 256
+    if soft != resource.RLIM_INFINITY and soft < wanted:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (wanted if hard == resource.RLIM_INFINITY else min(wanted, hard), hard))
+
+
+def start_stack(args, workdir: str) -> Tuple[Cluster, Optional[Pgbouncer], List[Target], Optional[Target]]:
+    """The bench.py cluster with a trust and a SCRAM role, and pgbouncer in front when asked."""
+    cluster = Cluster(args.bindir, workdir, args.version, free_port())
+    cluster.init()
+    # initdb --auth=trust trusts everyone; the first matching line wins
+    hba = os.path.join(cluster.datadir, "pg_hba.conf")
+    with open(hba) as f:
+        rules = f.read()
+    with open(hba, "w") as f:
+        f.write(f"host all {SCRAM_ROLE} 127.0.0.1/32 scram-sha-256\n" + rules)
+    cluster.start()
+    cluster.psql(
+        f"SET password_encryption = 'scram-sha-256';"
+        f" CREATE ROLE {SCRAM_ROLE} LOGIN PASSWORD '{SCRAM_PASSWORD}'; CREATE ROLE {TRUST_ROLE} LOGIN;"
+    )
+    targets = [
+        Target("direct", cluster.port, "trust", TRUST_ROLE),
+        Target("direct", cluster.port, "scram", SCRAM_ROLE, SCRAM_PASSWORD),
+    ]
+    if not args.pgbouncer:
+        return cluster, None, targets, None
+
+    # pgbouncer authenticates to the server with the client's SCRAM keys, so
+    # its userlist needs the same secret the server has
+    secret = cluster.psql(f"SELECT rolpassword FROM pg_authid WHERE rolname = '{SCRAM_ROLE}';")
+    pgbouncer_hba = os.path.join(workdir, "pgbouncer_hba.conf")
+    with open(pgbouncer_hba, "w") as f:
+        f.write(f"host all {SCRAM_ROLE} 127.0.0.1/32 scram-sha-256\nhost all all 127.0.0.1/32 trust\n")
+    settings = {"auth_type": "hba", "auth_hba_file": pgbouncer_hba, "admin_users": SUPERUSER}
+    settings.update(args.pool_setting)
+    pgbouncer = Pgbouncer(args.pgbouncer, workdir, cluster.port, free_port(), settings,
+                          {SCRAM_ROLE: secret, TRUST_ROLE: ""})
+    pgbouncer.start()
+    targets += [
+        Target("pgbouncer", pgbouncer.port, "trust", TRUST_ROLE),
+        Target("pgbouncer", pgbouncer.port, "scram", SCRAM_ROLE, SCRAM_PASSWORD),
+    ]
+    return cluster, pgbouncer, targets, Target("pgbouncer", pgbouncer.port, "trust", SUPERUSER)
+
+
+def instance_targets(args) -> Tuple[List[Target], Optional[Target]]:
+    password = os.environ.get("PGPASSWORD")
+    targets = [
+        Target("direct", args.port, "instance", args.user, password, args.dbname, args.host),
+        Target("pgbouncer", args.pgbouncer_port, "instance", args.user, password, args.dbname, args.host),
+    ]
+    admin = Target("pgbouncer", args.pgbouncer_port, "instance", args.admin_user,
+                   os.environ.get("PGBOUNCER_PASSWORD"), "pgbouncer", args.host)
+    return targets, admin
+
+
+def parse_pool_setting(spec: str) -> Tuple[str, str]:
+    name, sep, value = spec.partition("=")
+    if not sep:
+        raise argparse.ArgumentTypeError(f"expected NAME=VALUE, got {spec}")
+    return name.strip(), value.strip()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Connection-storm latency, direct and through pgbouncer")
+    parser.add_argument("--bindir", help="bin directory of a Nix build, e.g. result-15/bin")
+    parser.add_argument("--version", choices=VERSIONS, default="15")
+    parser.add_argument("--pgbouncer", help="pgbouncer binary; also storm through it when given")
+    parser.add_argument("--pool-setting", action="append", type=parse_pool_setting, default=[], metavar="NAME=VALUE",
+                        help="pgbouncer setting to try, e.g. max_client_conn=2000 (repeatable)")
+    parser.add_argument("--instance", action="store_true", help="Storm an already running local instance instead")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=5432)
+    parser.add_argument("--pgbouncer-port", type=int, default=6543)
+    parser.add_argument("--user", default=SUPERUSER)
+    parser.add_argument("--dbname", default="postgres")
+    parser.add_argument("--admin-user", default="pgbouncer", help="pgbouncer admin or stats user for SHOW POOLS")
+    parser.add_argument("--clients", type=int, default=1000, help="Cycles in flight at once")
+    parser.add_argument("--cycles", type=int, default=10000, help="Cycles per target and auth method")
+    parser.add_argument("--query", default="SELECT 1;")
+    parser.add_argument("--timeout", type=float, default=30.0, help="Seconds before a cycle counts as failed")
+    parser.add_argument("-o", "--output", help="Write the results as JSON here")
+    args = parser.parse_args()
+    args.pool_setting = dict(args.pool_setting)
+    if not args.instance and not args.bindir:
+        parser.error("give --bindir to start a cluster, or --instance to use a running one")
+
+    raise_open_files_limit(args.clients)
+    workdir = cluster = pgbouncer = None
+    try:
+        if args.instance:
+            targets, admin = instance_targets(args)
+        else:
+            workdir = tempfile.mkdtemp(prefix=f"connection-storm-{args.version}-")
+            cluster, pgbouncer, targets, admin = start_stack(args, workdir)
+
+        runs = []
+        for target in targets:
+            print(f"storming {target.name} ({target.auth}) on {target.port}", file=sys.stderr)
+            runs.append(asyncio.run(storm(
+                target, args.cycles, args.clients, args.query, args.timeout,
+                admin if target.name == "pgbouncer" else None,
+            )))
+    except BenchError as e:
+        print(f"{sys.argv[0]}: {e}", file=sys.stderr)
+        sys.exit(2)
+    finally:
+        if pgbouncer:
+            pgbouncer.stop()
+        if cluster:
+            try:
+                cluster.stop()
+            except BenchError:
+                pass
+        if workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    costs = auth_cost(runs)
+    print(format_table(runs))
+    for target, cost in costs.items():
+        print(f"scram auth cost {target}: {cost:+.2f} ms at p50 over trust")
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"version": args.version, "query": args.query, "pool_settings": args.pool_setting,
+                       "auth_cost_ms": costs, "runs": runs}, f, indent=2)
+            f.write("\n")
+
+
+if __name__ == "__main__":
+    main()
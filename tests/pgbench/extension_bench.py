@@ -0,0 +1,284 @@
+#!/usr/bin/env python3
+"""
+Load-time cost of every extension in a Nix-built Postgres.
+
+Starts the same cluster as bench.py, with the rendered postgresql.conf.j2 and
+its shared_preload_libraries. Then, for each extension the build makes
+available, it measures:
+
+    create_ms       CREATE EXTENSION ... CASCADE in an empty database
+    cold_ms         the first call in a fresh backend, which loads the
+                    extension's libraries into that backend
+    warm_ms         the same call again in the same backend
+    rss_added_kb    growth of the backend's VmRSS across the first call
+    libraries       shared objects the first call mapped into the backend,
+                    with their size on disk
+
+The first call is a representative query for well-known extensions, and
+otherwise a LOAD of each library the extension's C functions live in.
+Libraries already in shared_preload_libraries are mapped into every backend
+at fork, which shows up as a near-zero cold_ms. That cost is paid by every
+backend, and fresh_backend in the report measures it.
+
+Every extension gets its own database, and they run in parallel (-j). Use
+-j 1 when the absolute numbers matter more than the ranking.
+
+    python3 tests/pgbench/extension_bench.py --bindir result-15/bin --version 15 -j 4 -o extensions.json
+"""
+
+import argparse
+import json
+import os
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Set
+
+from bench import SUPERUSER, VERSIONS, BenchError, Cluster, free_port
+
+TIME_RE = re.compile(r"^Time: ([\d.]+) ms", re.MULTILINE)
+
+# a cheap query that exercises each extension's library, for the ones we care most about
+FIRST_CALL = {
+    "vector": "SELECT '[1,2,3]'::vector <-> '[3,2,1]'::vector;",
+    "postgis": "SELECT ST_AsText(ST_Buffer(ST_MakePoint(0, 0), 1, 2));",
+    "pgrouting": "SELECT pgr_version();",
+    "timescaledb": "SELECT time_bucket('1 hour', now());",
+    "pg_graphql": "SELECT graphql.resolve($$ { __typename } $$);",
+    "pg_jsonschema": "SELECT json_matches_schema('{\"type\": \"object\"}', '{}');",
+    "plv8": "DO $$ var x = 1; $$ LANGUAGE plv8;",
+    "pgroonga": "SELECT pgroonga_command('status');",
+    "pgcrypto": "SELECT crypt('x', gen_salt('bf', 4));",
+    "pgsodium": "SELECT pgsodium.crypto_secretbox_keygen();",
+    "rum": "SELECT to_tsvector('simple', 'a b') <=> to_tsquery('simple', 'a');",
+    "pg_hashids": "SELECT id_encode(1001);",
+}
+
+# extensions that can only be created in one database, or only with outside setup
+SKIP = {
+    "pg_cron": "can only be created in cron.database_name",
+    "orioledb": "created cluster-wide on OrioleDB builds",
+    "plpgsql": "always installed",
+}
+
+
+class PsqlSession:
+    """
+    One psql process, so statements run in the same backend.
+
+    Commands are written to psql's stdin, followed by an \\echo of a unique
+    marker, and everything printed before the marker is their output. stderr
+    is merged into stdout so errors arrive in order.
+    """
+
+    def __init__(self, cluster: Cluster, dbname: str):
+        self.counter = 0
+        self.process = subprocess.Popen(
+            [
+                cluster.tool("psql"), "-p", str(cluster.port), "-U", SUPERUSER, "-d", dbname,
+                "--no-psqlrc", "--quiet", "--no-align", "--tuples-only",
+            ],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            env=cluster.env,
+            text=True,
+            bufsize=1,
+        )
+
+    def run(self, commands: str) -> str:
+        self.counter += 1
+        marker = f"__extension_bench_{self.counter}__"
+        self.process.stdin.write(f"{commands}\n\\echo {marker}\n")
+        self.process.stdin.flush()
+        lines = []
+        for line in self.process.stdout:
+            if line.rstrip("\n") == marker:
+                return "".join(lines)
+            lines.append(line)
+        raise BenchError(f"psql exited ({self.process.wait()}): {''.join(lines).strip()}")
+
+    def timed(self, sql: str) -> float:
+        """Run one statement with \\timing and return its duration in ms."""
+        output = self.run(f"\\timing on\n{sql}\n\\timing off")
+        errors = [line for line in output.splitlines() if line.startswith(("ERROR:", "FATAL:"))]
+        if errors:
+            raise BenchError(errors[0])
+        match = TIME_RE.search(output)
+        if not match:
+            raise BenchError(f"no timing in psql output: {output.strip()}")
+        return float(match.group(1))
+
+    def close(self):
+        if self.process.poll() is None:
+            self.process.stdin.close()
+            self.process.wait()
+
+
+def backend_rss_kb(pid: int) -> int:
+    with open(f"/proc/{pid}/status") as f:
+        for line in f:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1])
+    return 0
+
+
+def mapped_libraries(pid: int) -> Set[str]:
+    with open(f"/proc/{pid}/maps") as f:
+        return {fields[5] for fields in (line.split() for line in f) if len(fields) > 5 and ".so" in fields[5]}
+
+
+def quote_ident(name: str) -> str:
+    return '"' + name.replace('"', '""') + '"'
+
+
+def quote_literal(value: str) -> str:
+    return "'" + value.replace("'", "''") + "'"
+
+
+def first_call(session: PsqlSession, extension: str) -> str:
+    """The first-call statement for `extension`: a known query, or LOAD of its C libraries."""
+    if extension in FIRST_CALL:
+        return FIRST_CALL[extension]
+    libraries = session.run(
+        "SELECT DISTINCT p.probin FROM pg_proc p"
+        " JOIN pg_depend d ON d.classid = 'pg_proc'::regclass AND d.objid = p.oid AND d.deptype = 'e'"
+        f" JOIN pg_extension e ON e.oid = d.refobjid AND e.extname = {quote_literal(extension)}"
+        " WHERE p.probin IS NOT NULL;"
+    ).split()
+    if not libraries:
+        return "SELECT 1;"
+    return " ".join(f"LOAD {quote_literal(library)};" for library in libraries)
+
+
+def measure_fresh_backend(cluster: Cluster, dbname: str) -> Dict[str, float]:
+    """What every new connection pays: connect plus first query, and the backend's RSS."""
+    start = time.monotonic()
+    session = PsqlSession(cluster, dbname)
+    try:
+        pid = int(session.run("SELECT pg_backend_pid();").strip())
+        connect_ms = (time.monotonic() - start) * 1000
+        return {"connect_ms": round(connect_ms, 2), "rss_kb": backend_rss_kb(pid)}
+    finally:
+        session.close()
+
+
+def measure_extension(cluster: Cluster, extension: str, prefix: str) -> Dict[str, object]:
+    dbname = f"{prefix}_{re.sub(r'[^a-z0-9]+', '_', extension.lower())}"[:63]
+    result: Dict[str, object] = {"extension": extension}
+    try:
+        cluster.psql(f"CREATE DATABASE {quote_ident(dbname)};")
+        setup = PsqlSession(cluster, dbname)
+        try:
+            result["create_ms"] = setup.timed(f"CREATE EXTENSION IF NOT EXISTS {quote_ident(extension)} CASCADE;")
+            statement = first_call(setup, extension)
+        finally:
+            setup.close()
+
+        fresh = PsqlSession(cluster, dbname)
+        try:
+            pid = int(fresh.run("SELECT pg_backend_pid();").strip())
+            rss_before, maps_before = backend_rss_kb(pid), mapped_libraries(pid)
+            result["cold_ms"] = fresh.timed(statement)
+            rss_after, maps_after = backend_rss_kb(pid), mapped_libraries(pid)
+            result["warm_ms"] = fresh.timed(statement)
+        finally:
+            fresh.close()
+        result["rss_added_kb"] = rss_after - rss_before
+        result["libraries"] = {
+            os.path.basename(path): os.path.getsize(path) for path in sorted(maps_after - maps_before)
+        }
+        result["first_call"] = statement
+    except BenchError as e:
+        result["error"] = str(e)
+    finally:
+        # a failed drop is reported with this extension instead of aborting the whole run
+        try:
+            cluster.psql(f"DROP DATABASE IF EXISTS {quote_ident(dbname)} WITH (FORCE);")
+        except BenchError as e:
+            result["drop_error"] = str(e)
+    return result
+
+
+def format_table(results: List[Dict[str, object]]) -> str:
+    header = ["extension", "create ms", "cold ms", "warm ms", "rss +kB", "libraries kB"]
+    rows = [header]
+    for result in results:
+        if "error" in result:
+            rows.append([result["extension"], f"error: {result['error'].splitlines()[0]}"])
+            continue
+        rows.append([
+            result["extension"],
+            f"{result['create_ms']:.1f}",
+            f"{result['cold_ms']:.2f}",
+            f"{result['warm_ms']:.2f}",
+            str(result["rss_added_kb"]),
+            str(sum(result["libraries"].values()) // 1024),
+        ])
+    # error rows span the measurement columns and do not set their widths
+    widths = [max(len(row[i]) for row in rows if i == 0 or len(row) == len(header)) for i in range(len(header))]
+    return "\n".join("  ".join(cell.ljust(widths[i]) for i, cell in enumerate(row)).rstrip() for row in rows)
+
+
+def rank(results: List[Dict[str, object]], key: str) -> List[Dict[str, object]]:
+    """Most expensive first by `key`; failed extensions last."""
+    return sorted(results, key=lambda r: ("error" in r, -(r.get(key) or 0)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure per-extension create, first-call and memory cost")
+    parser.add_argument("--bindir", required=True, help="bin directory of a Nix build, e.g. result-15/bin")
+    parser.add_argument("--version", required=True, choices=VERSIONS)
+    parser.add_argument("-j", "--jobs", type=int, default=max((os.cpu_count() or 2) // 2, 1))
+    parser.add_argument("--extension", action="append", help="Only this extension (repeatable)")
+    parser.add_argument("--rank-by", default="cold_ms", choices=["create_ms", "cold_ms", "warm_ms", "rss_added_kb"])
+    parser.add_argument("-o", "--output", help="Write the ranked report as JSON here")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix=f"extension-bench-{args.version}-")
+    cluster = Cluster(args.bindir, workdir, args.version, free_port())
+    try:
+        cluster.init()
+        cluster.start()
+        available = cluster.psql("SELECT name FROM pg_available_extensions ORDER BY name;").split()
+        extensions = [name for name in available if name not in SKIP and (not args.extension or name in args.extension)]
+        preloaded = cluster.psql("SHOW shared_preload_libraries;")
+        fresh_backend = measure_fresh_backend(cluster, "postgres")
+
+        prefix = f"extbench_{os.getpid()}"
+        with ThreadPoolExecutor(max_workers=args.jobs) as pool:
+            results = list(pool.map(lambda extension: measure_extension(cluster, extension, prefix), extensions))
+    except BenchError as e:
+        print(f"{sys.argv[0]}: {e}", file=sys.stderr)
+        sys.exit(2)
+    finally:
+        cluster.stop()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    results = rank(results, args.rank_by)
+    print(format_table(results))
+    print(
+        f"\nfresh backend: {fresh_backend['connect_ms']} ms to connect, {fresh_backend['rss_kb']} kB RSS"
+        f" with shared_preload_libraries = '{preloaded}'"
+    )
+    if args.output:
+        report = {
+            "version": args.version,
+            "jobs": args.jobs,
+            "ranked_by": args.rank_by,
+            "shared_preload_libraries": preloaded,
+            "fresh_backend": fresh_backend,
+            "skipped": SKIP,
+            "extensions": results,
+        }
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+            f.write("\n")
+
+
+if __name__ == "__main__":
+    main()
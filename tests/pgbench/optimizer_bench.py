@@ -0,0 +1,282 @@
+#!/usr/bin/env python3
+"""
+Compare candidate generated-optimizations settings across simulated instance sizes.
+
+On an instance, database-optimizations.service runs `capitala-admin-api
+optimize db` and `optimize pgbouncer` at boot, which write
+generated-optimizations.conf and generated-optimizations.ini for the
+instance's size. This bench measures what such settings are worth. For every
+instance size in the matrix and every candidate settings set, it starts the
+cluster from bench.py inside a systemd-run scope limited to that size's
+memory and CPUs. It then runs the standard workloads and prints a table of
+TPS and latency per size and candidate.
+
+Candidates:
+
+    template        postgresql.conf.j2 and pgbouncer.ini.j2 as shipped, with
+                    no generated file (what an instance gets if the
+                    optimizer fails)
+    rule_of_thumb   settings derived from the size with common sizing rules
+    NAME=PATH       settings read from files, e.g. generated-optimizations
+                    files captured from real instances. PATH is either one
+                    .conf file for every size, or a directory holding
+                    <size>.conf and optionally <size>.ini
+
+    python3 tests/pgbench/optimizer_bench.py --bindir result-15/bin --version 15 \
+        --candidate captured=path/to/captured --size small --size large
+
+pgbench itself runs outside the limited scope, so the client does not compete
+with the server for the simulated CPUs.
+"""
+
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
+
+from bench import VERSIONS, WORKLOADS, BenchError, Cluster, Pgbouncer, free_port, run_workload
+
+
+@dataclass
+class InstanceSize:
+    name: str
+    memory_mb: int
+    cpus: int
+
+
+INSTANCE_SIZES = [
+    InstanceSize("micro", 1024, 2),
+    InstanceSize("small", 2048, 2),
+    InstanceSize("medium", 4096, 2),
+    InstanceSize("large", 8192, 2),
+    InstanceSize("xlarge", 16384, 4),
+    InstanceSize("2xlarge", 32768, 8),
+]
+
+
+@dataclass
+class Candidate:
+    name: str
+    # postgresql.conf and pgbouncer.ini settings for an instance size
+    postgresql: Dict[str, Dict[str, str]] = field(default_factory=dict)
+    pgbouncer: Dict[str, Dict[str, str]] = field(default_factory=dict)
+
+
+def parse_settings(text: str, section: Optional[str] = None) -> Dict[str, str]:
+    """
+    `name = value` lines from a postgresql.conf or pgbouncer.ini file.
+
+    Comments (# or ;) and blank lines are skipped. With `section`, only lines
+    in that [section] are read; lines before any section header are included.
+    """
+    settings = {}
+    current = None
+    for line in text.splitlines():
+        line = line.strip()
+        if not line or line[0] in "#;%":
+            continue
+        if line.startswith("[") and line.endswith("]"):
+            current = line[1:-1]
+            continue
+        if section and current not in (None, section):
+            continue
+        name, sep, value = line.partition("=")
+        if not sep:
+            continue
+        value = value.strip()
+        if value.startswith("'"):
+            # keep the quoted string, drop a trailing comment after it
+            value = value[: value.find("'", 1) + 1] or value
+        else:
+            value = value.split("#", 1)[0].strip()
+        settings[name.strip()] = value
+    return settings
+
+
+def rule_of_thumb(size: InstanceSize) -> Dict[str, Dict[str, str]]:
+    """
+    Settings from the usual sizing rules, as a starting point to measure against.
+
+    This is not what `capitala-admin-api optimize` computes. Capture its
+    output from an instance to benchmark that.
+    """
+    memory = size.memory_mb
+    shared_buffers = memory // 4
+    max_connections = 60 if memory <= 1024 else 90 if memory <= 2048 else 120 if memory <= 8192 else 240
+    work_mem = max(4, (memory - shared_buffers) // (max_connections * 3))
+    return {
+        "postgresql": {
+            "shared_buffers": f"{shared_buffers}MB",
+            "effective_cache_size": f"{memory * 3 // 4}MB",
+            "maintenance_work_mem": f"{min(memory // 16, 2048)}MB",
+            "work_mem": f"{work_mem}MB",
+            "max_connections": str(max_connections),
+            "max_worker_processes": str(max(8, size.cpus * 2)),
+            "max_parallel_workers": str(size.cpus),
+            "max_parallel_workers_per_gather": str(max(1, size.cpus // 2)),
+            "max_parallel_maintenance_workers": str(max(1, size.cpus // 2)),
+        },
+        "pgbouncer": {
+            "default_pool_size": str(max(15, size.cpus * 5)),
+            "max_client_conn": str(max_connections * 4),
+        },
+    }
+
+
+def load_candidate(name: str, path: str, sizes: List[InstanceSize]) -> Candidate:
+    candidate = Candidate(name)
+    for size in sizes:
+        if os.path.isdir(path):
+            conf = os.path.join(path, f"{size.name}.conf")
+            ini = os.path.join(path, f"{size.name}.ini")
+        else:
+            conf, ini = path, None
+        if not os.path.exists(conf):
+            raise BenchError(f"candidate {name} has no settings for {size.name} ({conf})")
+        with open(conf) as f:
+            candidate.postgresql[size.name] = parse_settings(f.read())
+        if ini and os.path.exists(ini):
+            with open(ini) as f:
+                candidate.pgbouncer[size.name] = parse_settings(f.read(), "pgbouncer")
+    return candidate
+
+
+def builtin_candidates(sizes: List[InstanceSize]) -> List[Candidate]:
+    tuned = Candidate("rule_of_thumb")
+    for size in sizes:
+        settings = rule_of_thumb(size)
+        tuned.postgresql[size.name] = settings["postgresql"]
+        tuned.pgbouncer[size.name] = settings["pgbouncer"]
+    return [Candidate("template"), tuned]
+
+
+def scope_launcher(size: InstanceSize, unit: str) -> List[str]:
+    """A systemd-run scope limited to the size's memory and CPUs, without swap to hide behind."""
+    user = ["--user"] if os.geteuid() != 0 else []
+    return [
+        "systemd-run", *user, "--scope", "--quiet", f"--unit={unit}",
+        "-p", f"MemoryMax={size.memory_mb}M",
+        "-p", "MemorySwapMax=0",
+        "-p", f"CPUQuota={size.cpus * 100}%",
+    ]
+
+
+def run_candidate(args, size: InstanceSize, candidate: Candidate) -> Dict[str, object]:
+    workdir = tempfile.mkdtemp(prefix=f"optimizer-{size.name}-{candidate.name}-")
+    os.makedirs(os.path.join(workdir, "logs"))
+    settings = candidate.postgresql.get(size.name, {})
+    launcher = [] if args.no_cgroup else scope_launcher(size, f"optimizer-bench-{os.getpid()}-{size.name}-{candidate.name}")
+    cluster = Cluster(args.bindir, workdir, args.version, free_port(), settings, launcher)
+    pgbouncer = None
+    try:
+        cluster.init()
+        cluster.start()
+        cluster.pgbench_init(args.scale)
+        port = cluster.port
+        if args.pgbouncer:
+            pgbouncer = Pgbouncer(args.pgbouncer, workdir, cluster.port, free_port(),
+                                  candidate.pgbouncer.get(size.name))
+            pgbouncer.start()
+            port = pgbouncer.port
+
+        results = {}
+        for workload in WORKLOADS:
+            if workload.name in args.workload:
+                results[workload.name] = run_workload(
+                    cluster, workload, port, args.duration, args.threads, os.path.join(workdir, "logs"), args.warmup
+                )
+        return {"settings": settings, "results": results}
+    except BenchError as e:
+        # a candidate that does not fit the size (e.g. shared_buffers above the
+        # memory limit) is a result too
+        return {"settings": settings, "error": str(e)}
+    finally:
+        if pgbouncer:
+            pgbouncer.stop()
+        try:
+            cluster.stop()
+        except BenchError:
+            pass
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def format_table(rows: List[Dict[str, object]], workloads: List[str]) -> str:
+    header = ["size", "candidate"]
+    for workload in workloads:
+        header += [f"{workload} tps", "p50 ms", "p95 ms", "p99 ms"]
+    table = [header]
+    for row in rows:
+        line = [row["size"], row["candidate"]]
+        if "error" in row:
+            line.append(f"error: {row['error'].splitlines()[0]}")
+        else:
+            for workload in workloads:
+                result = row["results"].get(workload, {})
+                line += [
+                    "-" if result.get(metric) is None else f"{result[metric]:g}"
+                    for metric in ("tps", "p50_ms", "p95_ms", "p99_ms")
+                ]
+        table.append(line)
+
+    # error rows span the result columns and do not set their widths
+    widths = [
+        max(len(line[i]) for line in table if i < 2 or len(line) == len(header)) for i in range(len(header))
+    ]
+    return "\n".join(
+        "  ".join(cell.ljust(widths[i]) for i, cell in enumerate(line)).rstrip() for line in table
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark optimizer settings across simulated instance sizes")
+    parser.add_argument("--bindir", required=True, help="bin directory of a Nix build, e.g. result-15/bin")
+    parser.add_argument("--version", required=True, choices=VERSIONS)
+    parser.add_argument("--pgbouncer", help="pgbouncer binary; run the workloads through it when given")
+    parser.add_argument("--size", action="append", choices=[s.name for s in INSTANCE_SIZES],
+                        help="Only this instance size (repeatable)")
+    parser.add_argument("--candidate", action="append", default=[], metavar="NAME=PATH",
+                        help="Settings from a .conf file or a directory of <size>.conf/.ini (repeatable)")
+    parser.add_argument("--no-builtin", action="store_true", help="Skip the template and rule_of_thumb candidates")
+    parser.add_argument("--workload", action="append", choices=[w.name for w in WORKLOADS],
+                        help="Workloads to run (default: read_only and tpcb)")
+    parser.add_argument("--scale", type=int, default=50, help="pgbench scale factor (50 is about 750MB)")
+    parser.add_argument("--duration", type=int, default=60, help="Measured seconds per workload")
+    parser.add_argument("--warmup", type=int, default=10, help="Unmeasured seconds before each workload")
+    parser.add_argument("--threads", type=int, default=os.cpu_count() or 4, help="pgbench -j")
+    parser.add_argument("--no-cgroup", action="store_true", help="Run unlimited, e.g. on a machine of the right size")
+    parser.add_argument("-o", "--output", help="Write the results as JSON here")
+    args = parser.parse_args()
+    args.workload = args.workload or ["read_only", "tpcb"]
+
+    sizes = [s for s in INSTANCE_SIZES if not args.size or s.name in args.size]
+    try:
+        candidates = [] if args.no_builtin else builtin_candidates(sizes)
+        for spec in args.candidate:
+            name, sep, path = spec.partition("=")
+            if not sep:
+                parser.error(f"--candidate takes NAME=PATH, got {spec}")
+            candidates.append(load_candidate(name, path, sizes))
+    except BenchError as e:
+        parser.error(str(e))
+    if not candidates:
+        parser.error("no candidates to run")
+
+    rows = []
+    for size in sizes:
+        for candidate in candidates:
+            print(f"running {candidate.name} on {size.name} ({size.memory_mb}MB, {size.cpus} CPUs)", file=sys.stderr)
+            rows.append({"size": size.name, "candidate": candidate.name, **run_candidate(args, size, candidate)})
+
+    print(format_table(rows, args.workload))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"version": args.version, "scale": args.scale, "duration_s": args.duration, "rows": rows}, f, indent=2)
+            f.write("\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,2 @@
+-- one trivial query per connection; run with -C so every transaction reconnects
+SELECT 1;